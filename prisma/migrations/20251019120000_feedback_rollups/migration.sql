@@ -0,0 +1,115 @@
+-- CreateTable
+CREATE TABLE "FeedbackRollup" (
+    "day" DATE NOT NULL,
+    "agentName" TEXT NOT NULL,
+    "stepType" "StepType" NOT NULL,
+    "feedbackName" TEXT NOT NULL,
+    "count" INTEGER NOT NULL,
+    "positive" INTEGER NOT NULL,
+    "negative" INTEGER NOT NULL,
+    "valueSum" DOUBLE PRECISION NOT NULL,
+    "commented" INTEGER NOT NULL,
+    "refreshedAt" TIMESTAMP(3) NOT NULL DEFAULT CURRENT_TIMESTAMP,
+
+    CONSTRAINT "FeedbackRollup_pkey" PRIMARY KEY ("day", "agentName", "stepType", "feedbackName")
+);
+
+-- CreateTable
+CREATE TABLE "FeedbackRollupDirtyDay" (
+    "day" DATE NOT NULL,
+
+    CONSTRAINT "FeedbackRollupDirtyDay_pkey" PRIMARY KEY ("day")
+);
+
+-- CreateIndex
+CREATE INDEX "FeedbackRollup_agentName_day_idx" ON "FeedbackRollup"("agentName", "day");
+
+-- CreateIndex
+CREATE INDEX "FeedbackRollup_stepType_day_idx" ON "FeedbackRollup"("stepType", "day");
+
+-- Mark the days touched by every Feedback write. Statement-level triggers
+-- keep bulk writes to one dirty-day insert per statement.
+CREATE FUNCTION "feedback_rollup_mark_inserted"() RETURNS TRIGGER AS $$
+BEGIN
+    INSERT INTO "FeedbackRollupDirtyDay" ("day")
+    SELECT DISTINCT "createdAt"::DATE FROM new_rows
+    ON CONFLICT DO NOTHING;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE FUNCTION "feedback_rollup_mark_updated"() RETURNS TRIGGER AS $$
+BEGIN
+    INSERT INTO "FeedbackRollupDirtyDay" ("day")
+    SELECT "createdAt"::DATE FROM old_rows
+    UNION
+    SELECT "createdAt"::DATE FROM new_rows
+    ON CONFLICT DO NOTHING;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE FUNCTION "feedback_rollup_mark_deleted"() RETURNS TRIGGER AS $$
+BEGIN
+    INSERT INTO "FeedbackRollupDirtyDay" ("day")
+    SELECT DISTINCT "createdAt"::DATE FROM old_rows
+    ON CONFLICT DO NOTHING;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER "Feedback_rollup_insert" AFTER INSERT ON "Feedback"
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION "feedback_rollup_mark_inserted"();
+
+CREATE TRIGGER "Feedback_rollup_update" AFTER UPDATE ON "Feedback"
+    REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION "feedback_rollup_mark_updated"();
+
+CREATE TRIGGER "Feedback_rollup_delete" AFTER DELETE ON "Feedback"
+    REFERENCING OLD TABLE AS old_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION "feedback_rollup_mark_deleted"();
+
+-- Recompute the rollup rows of the dirty days only. Returns the number of days refreshed.
+-- A write that lands while this runs marks its day dirty again for the next refresh.
+CREATE FUNCTION "refresh_feedback_rollup"() RETURNS INTEGER AS $$
+DECLARE
+    dirty DATE[];
+BEGIN
+    -- One refresh at a time, a second caller waits and then finds little left to do
+    PERFORM pg_advisory_xact_lock(hashtext('refresh_feedback_rollup'));
+
+    WITH claimed AS (
+        DELETE FROM "FeedbackRollupDirtyDay" RETURNING "day"
+    )
+    SELECT array_agg("day") INTO dirty FROM claimed;
+    IF dirty IS NULL THEN
+        RETURN 0;
+    END IF;
+
+    DELETE FROM "FeedbackRollup" WHERE "day" = ANY(dirty);
+
+    INSERT INTO "FeedbackRollup" ("day", "agentName", "stepType", "feedbackName", "count", "positive", "negative", "valueSum", "commented")
+    SELECT
+        d."day",
+        COALESCE(s."name", 'unknown'),
+        COALESCE(s."type", 'undefined'),
+        f."name",
+        COUNT(*),
+        COUNT(*) FILTER (WHERE f."value" > 0),
+        COUNT(*) FILTER (WHERE f."value" <= 0),
+        SUM(f."value"),
+        COUNT(*) FILTER (WHERE f."comment" IS NOT NULL AND f."comment" <> '')
+    FROM unnest(dirty) AS d("day")
+    -- Range join so Feedback_createdAt_idx is used
+    JOIN "Feedback" f ON f."createdAt" >= d."day" AND f."createdAt" < d."day" + 1
+    LEFT JOIN "Step" s ON s."id" = f."stepId"
+    GROUP BY 1, 2, 3, 4;
+
+    RETURN cardinality(dirty);
+END;
+$$ LANGUAGE plpgsql;
+
+-- Backfill from the existing feedback
+INSERT INTO "FeedbackRollupDirtyDay" ("day") SELECT DISTINCT "createdAt"::DATE FROM "Feedback";
+SELECT "refresh_feedback_rollup"();
@@ -0,0 +1,46 @@
+-- CreateTable
+CREATE TABLE "ThreadArchive" (
+    "threadId" TEXT NOT NULL,
+    "blobKey" TEXT NOT NULL,
+    "offset" BIGINT NOT NULL,
+    "length" INTEGER NOT NULL,
+    "steps" INTEGER NOT NULL,
+    "elements" INTEGER NOT NULL,
+    "feedback" INTEGER NOT NULL,
+    "archivedAt" TIMESTAMP(3) NOT NULL DEFAULT CURRENT_TIMESTAMP,
+
+    CONSTRAINT "ThreadArchive_pkey" PRIMARY KEY ("threadId")
+);
+
+-- CreateIndex
+CREATE INDEX "ThreadArchive_blobKey_idx" ON "ThreadArchive"("blobKey");
+
+-- AddForeignKey
+ALTER TABLE "ThreadArchive" ADD CONSTRAINT "ThreadArchive_threadId_fkey" FOREIGN KEY ("threadId") REFERENCES "Thread"("id") ON DELETE CASCADE ON UPDATE CASCADE;
+
+-- Archiving and rehydrating move feedback out of and back into the table, but the
+-- ratings still happened: the archive job sets chainlit.archiving so the rollups
+-- of those days are left as they are.
+CREATE OR REPLACE FUNCTION "feedback_rollup_mark_inserted"() RETURNS TRIGGER AS $$
+BEGIN
+    IF current_setting('chainlit.archiving', true) = 'on' THEN
+        RETURN NULL;
+    END IF;
+    INSERT INTO "FeedbackRollupDirtyDay" ("day")
+    SELECT DISTINCT "createdAt"::DATE FROM new_rows
+    ON CONFLICT DO NOTHING;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION "feedback_rollup_mark_deleted"() RETURNS TRIGGER AS $$
+BEGIN
+    IF current_setting('chainlit.archiving', true) = 'on' THEN
+        RETURN NULL;
+    END IF;
+    INSERT INTO "FeedbackRollupDirtyDay" ("day")
+    SELECT DISTINCT "createdAt"::DATE FROM old_rows
+    ON CONFLICT DO NOTHING;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
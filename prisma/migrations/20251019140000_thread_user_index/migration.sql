@@ -0,0 +1,3 @@
+-- CreateIndex
+-- The sidebar lists a user's threads newest first
+CREATE INDEX "Thread_userId_createdAt_idx" ON "Thread"("userId", "createdAt");
@@ -0,0 +1,17 @@
+-- CreateTable
+CREATE TABLE "RunCheckpoint" (
+    "threadId" TEXT NOT NULL,
+    "agentThreadId" TEXT NOT NULL,
+    "runId" TEXT NOT NULL,
+    "lastEventId" TEXT,
+    "messageId" TEXT,
+    "messagesDone" INTEGER NOT NULL DEFAULT 0,
+    "content" TEXT NOT NULL DEFAULT '',
+    "replicaId" TEXT NOT NULL,
+    "updatedAt" TIMESTAMP(3) NOT NULL DEFAULT CURRENT_TIMESTAMP,
+
+    CONSTRAINT "RunCheckpoint_pkey" PRIMARY KEY ("threadId")
+);
+
+-- AddForeignKey
+ALTER TABLE "RunCheckpoint" ADD CONSTRAINT "RunCheckpoint_threadId_fkey" FOREIGN KEY ("threadId") REFERENCES "Thread"("id") ON DELETE CASCADE ON UPDATE CASCADE;
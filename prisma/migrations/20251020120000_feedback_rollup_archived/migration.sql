@@ -0,0 +1,159 @@
+-- CreateTable
+CREATE TABLE "FeedbackRollupArchived" (
+    "day" DATE NOT NULL,
+    "agentName" TEXT NOT NULL,
+    "stepType" "StepType" NOT NULL,
+    "feedbackName" TEXT NOT NULL,
+    "count" INTEGER NOT NULL,
+    "positive" INTEGER NOT NULL,
+    "negative" INTEGER NOT NULL,
+    "valueSum" DOUBLE PRECISION NOT NULL,
+    "commented" INTEGER NOT NULL,
+
+    CONSTRAINT "FeedbackRollupArchived_pkey" PRIMARY KEY ("day", "agentName", "stepType", "feedbackName")
+);
+
+-- Archived feedback is no longer in "Feedback", so recomputing its day would drop it from
+-- the rollups. While thread_archive.py moves feedback out (chainlit.archiving is set), its
+-- counts move to "FeedbackRollupArchived", which the refresh adds back in. Rehydrating takes
+-- them out again. The rollups themselves don't change, so no day is marked dirty.
+CREATE OR REPLACE FUNCTION "feedback_rollup_mark_deleted"() RETURNS TRIGGER AS $$
+BEGIN
+    IF current_setting('chainlit.archiving', true) = 'on' THEN
+        INSERT INTO "FeedbackRollupArchived" AS a ("day", "agentName", "stepType", "feedbackName", "count", "positive", "negative", "valueSum", "commented")
+        SELECT
+            f."createdAt"::DATE,
+            COALESCE(s."name", 'unknown'),
+            COALESCE(s."type", 'undefined'),
+            f."name",
+            COUNT(*),
+            COUNT(*) FILTER (WHERE f."value" > 0),
+            COUNT(*) FILTER (WHERE f."value" <= 0),
+            SUM(f."value"),
+            COUNT(*) FILTER (WHERE f."comment" IS NOT NULL AND f."comment" <> '')
+        FROM old_rows f
+        LEFT JOIN "Step" s ON s."id" = f."stepId"
+        GROUP BY 1, 2, 3, 4
+        ON CONFLICT ("day", "agentName", "stepType", "feedbackName") DO UPDATE SET
+            "count" = a."count" + EXCLUDED."count",
+            "positive" = a."positive" + EXCLUDED."positive",
+            "negative" = a."negative" + EXCLUDED."negative",
+            "valueSum" = a."valueSum" + EXCLUDED."valueSum",
+            "commented" = a."commented" + EXCLUDED."commented";
+        RETURN NULL;
+    END IF;
+    INSERT INTO "FeedbackRollupDirtyDay" ("day")
+    SELECT DISTINCT "createdAt"::DATE FROM old_rows
+    ON CONFLICT DO NOTHING;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION "feedback_rollup_mark_inserted"() RETURNS TRIGGER AS $$
+BEGIN
+    IF current_setting('chainlit.archiving', true) = 'on' THEN
+        INSERT INTO "FeedbackRollupArchived" AS a ("day", "agentName", "stepType", "feedbackName", "count", "positive", "negative", "valueSum", "commented")
+        SELECT
+            f."createdAt"::DATE,
+            COALESCE(s."name", 'unknown'),
+            COALESCE(s."type", 'undefined'),
+            f."name",
+            -COUNT(*),
+            -COUNT(*) FILTER (WHERE f."value" > 0),
+            -COUNT(*) FILTER (WHERE f."value" <= 0),
+            -SUM(f."value"),
+            -COUNT(*) FILTER (WHERE f."comment" IS NOT NULL AND f."comment" <> '')
+        FROM new_rows f
+        LEFT JOIN "Step" s ON s."id" = f."stepId"
+        GROUP BY 1, 2, 3, 4
+        ON CONFLICT ("day", "agentName", "stepType", "feedbackName") DO UPDATE SET
+            "count" = a."count" + EXCLUDED."count",
+            "positive" = a."positive" + EXCLUDED."positive",
+            "negative" = a."negative" + EXCLUDED."negative",
+            "valueSum" = a."valueSum" + EXCLUDED."valueSum",
+            "commented" = a."commented" + EXCLUDED."commented";
+        DELETE FROM "FeedbackRollupArchived" WHERE "count" <= 0;
+        RETURN NULL;
+    END IF;
+    INSERT INTO "FeedbackRollupDirtyDay" ("day")
+    SELECT DISTINCT "createdAt"::DATE FROM new_rows
+    ON CONFLICT DO NOTHING;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Same as before, plus the archived counts of each dirty day
+CREATE OR REPLACE FUNCTION "refresh_feedback_rollup"() RETURNS INTEGER AS $$
+DECLARE
+    dirty DATE[];
+BEGIN
+    -- One refresh at a time, a second caller waits and then finds little left to do
+    PERFORM pg_advisory_xact_lock(hashtext('refresh_feedback_rollup'));
+
+    WITH claimed AS (
+        DELETE FROM "FeedbackRollupDirtyDay" RETURNING "day"
+    )
+    SELECT array_agg("day") INTO dirty FROM claimed;
+    IF dirty IS NULL THEN
+        RETURN 0;
+    END IF;
+
+    DELETE FROM "FeedbackRollup" WHERE "day" = ANY(dirty);
+
+    INSERT INTO "FeedbackRollup" ("day", "agentName", "stepType", "feedbackName", "count", "positive", "negative", "valueSum", "commented")
+    SELECT "day", "agentName", "stepType", "feedbackName", SUM("count"), SUM("positive"), SUM("negative"), SUM("valueSum"), SUM("commented")
+    FROM (
+        SELECT
+            d."day",
+            COALESCE(s."name", 'unknown') AS "agentName",
+            COALESCE(s."type", 'undefined') AS "stepType",
+            f."name" AS "feedbackName",
+            COUNT(*) AS "count",
+            COUNT(*) FILTER (WHERE f."value" > 0) AS "positive",
+            COUNT(*) FILTER (WHERE f."value" <= 0) AS "negative",
+            SUM(f."value") AS "valueSum",
+            COUNT(*) FILTER (WHERE f."comment" IS NOT NULL AND f."comment" <> '') AS "commented"
+        FROM unnest(dirty) AS d("day")
+        -- Range join so Feedback_createdAt_idx is used
+        JOIN "Feedback" f ON f."createdAt" >= d."day" AND f."createdAt" < d."day" + 1
+        LEFT JOIN "Step" s ON s."id" = f."stepId"
+        GROUP BY 1, 2, 3, 4
+        UNION ALL
+        SELECT "day", "agentName", "stepType", "feedbackName", "count", "positive", "negative", "valueSum", "commented"
+        FROM "FeedbackRollupArchived"
+        WHERE "day" = ANY(dirty)
+    ) AS counts
+    GROUP BY 1, 2, 3, 4;
+
+    RETURN cardinality(dirty);
+END;
+$$ LANGUAGE plpgsql;
+
+-- Backfill: on days that aren't waiting for a refresh, whatever the rollup counts beyond the
+-- live feedback was archived. Pending dirty days are refreshed from the live rows as before.
+INSERT INTO "FeedbackRollupArchived" ("day", "agentName", "stepType", "feedbackName", "count", "positive", "negative", "valueSum", "commented")
+SELECT
+    r."day", r."agentName", r."stepType", r."feedbackName",
+    r."count" - COALESCE(l."count", 0),
+    r."positive" - COALESCE(l."positive", 0),
+    r."negative" - COALESCE(l."negative", 0),
+    r."valueSum" - COALESCE(l."valueSum", 0),
+    r."commented" - COALESCE(l."commented", 0)
+FROM "FeedbackRollup" r
+LEFT JOIN (
+    SELECT
+        f."createdAt"::DATE AS "day",
+        COALESCE(s."name", 'unknown') AS "agentName",
+        COALESCE(s."type", 'undefined') AS "stepType",
+        f."name" AS "feedbackName",
+        COUNT(*) AS "count",
+        COUNT(*) FILTER (WHERE f."value" > 0) AS "positive",
+        COUNT(*) FILTER (WHERE f."value" <= 0) AS "negative",
+        SUM(f."value") AS "valueSum",
+        COUNT(*) FILTER (WHERE f."comment" IS NOT NULL AND f."comment" <> '') AS "commented"
+    FROM "Feedback" f
+    LEFT JOIN "Step" s ON s."id" = f."stepId"
+    GROUP BY 1, 2, 3, 4
+) l USING ("day", "agentName", "stepType", "feedbackName")
+WHERE r."count" > COALESCE(l."count", 0)
+  AND r."day" NOT IN (SELECT "day" FROM "FeedbackRollupDirtyDay");
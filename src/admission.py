@@ -0,0 +1,218 @@
+import os
+import time
+import asyncio
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import Awaitable, Callable, Deque, Dict, Optional, Tuple
+
+MAX_CONCURRENT_RUNS = int(os.getenv("ADMISSION_MAX_RUNS", "16"))
+MAX_RUNS_PER_USER = int(os.getenv("ADMISSION_MAX_RUNS_PER_USER", "1"))
+MAX_CONCURRENT_UPLOADS = int(os.getenv("ADMISSION_MAX_UPLOADS", "4"))
+MAX_UPLOAD_BYTES = int(os.getenv("ADMISSION_MAX_UPLOAD_MB", "256")) * 1024 * 1024
+MAX_MCP_PROCESSES = int(os.getenv("ADMISSION_MAX_MCP_PROCESSES", "8"))
+# How long a request may wait in the queue before the user is told to come back later
+QUEUE_TIMEOUT = float(os.getenv("ADMISSION_QUEUE_TIMEOUT", "120"))
+MCP_QUEUE_TIMEOUT = float(os.getenv("ADMISSION_MCP_QUEUE_TIMEOUT", "5"))
+
+BUSY_MESSAGE = "We're handling a lot of requests right now, please try again in a minute."
+QUEUED_MESSAGE = "Waiting for a free slot, you're number {position} in line..."
+
+OnWait = Optional[Callable[[int], Awaitable[None]]]
+
+
+class AdmissionRejected(Exception):
+    def __init__(self, gate: str, reason: str = "queue timeout") -> None:
+        super().__init__(f"{gate}: {reason}")
+        self.gate = gate
+
+
+class Gate:
+    """FIFO weighted semaphore with queue metrics.
+
+    A request asking for more than the capacity is clamped to it, so one
+    oversized upload runs alone instead of waiting forever.
+    """
+
+    def __init__(self, name: str, capacity: int) -> None:
+        self.name = name
+        self.capacity = max(capacity, 1)
+        self.in_use = 0
+        self._waiters: Deque[Tuple[int, asyncio.Future]] = deque()
+        self.admitted = 0
+        self.queued = 0
+        self.rejected = 0
+        self.max_wait = 0.0
+
+    @property
+    def waiting(self) -> int:
+        return len(self._waiters)
+
+    def _clamp(self, amount: int) -> int:
+        return min(max(amount, 1), self.capacity)
+
+    def try_acquire(self, amount: int = 1) -> bool:
+        amount = self._clamp(amount)
+        if self._waiters or self.in_use + amount > self.capacity:
+            return False
+        self.in_use += amount
+        self.admitted += 1
+        return True
+
+    async def acquire(self, amount: int = 1, timeout: Optional[float] = QUEUE_TIMEOUT, on_wait: OnWait = None) -> int:
+        """Wait for `amount` units, returning the clamped amount that must be released."""
+        amount = self._clamp(amount)
+        if self.try_acquire(amount):
+            return amount
+
+        future = asyncio.get_running_loop().create_future()
+        self._waiters.append((amount, future))
+        self.queued += 1
+        start = time.monotonic()
+        print(f"Admission {self.name}: queued {self.stats()}")
+        try:
+            # Inside the try: a notifier that fails or is cancelled must still give up the place in line
+            if on_wait:
+                await on_wait(self.waiting)
+            await asyncio.wait_for(asyncio.shield(future), timeout)
+        except BaseException as e:
+            if future.done() and not future.cancelled():
+                # Admitted just as we gave up, hand the units back
+                self.release(amount)
+            else:
+                future.cancel()
+                self._waiters = deque(waiter for waiter in self._waiters if waiter[1] is not future)
+                self._wake()
+            if not isinstance(e, asyncio.TimeoutError):
+                raise
+            self.rejected += 1
+            print(f"Admission {self.name}: rejected after {time.monotonic() - start:.1f}s {self.stats()}")
+            raise AdmissionRejected(self.name) from None
+        self.max_wait = max(self.max_wait, time.monotonic() - start)
+        return amount
+
+    def release(self, amount: int = 1) -> None:
+        self.in_use = max(self.in_use - amount, 0)
+        self._wake()
+
+    def _wake(self) -> None:
+        while self._waiters:
+            amount, future = self._waiters[0]
+            if future.done():
+                self._waiters.popleft()
+                continue
+            if self.in_use + amount > self.capacity:
+                break
+            self._waiters.popleft()
+            self.in_use += amount
+            self.admitted += 1
+            future.set_result(None)
+
+    def stats(self) -> Dict:
+        return {
+            "gate": self.name,
+            "capacity": self.capacity,
+            "in_use": self.in_use,
+            "waiting": self.waiting,
+            "admitted": self.admitted,
+            "queued": self.queued,
+            "rejected": self.rejected,
+            "max_wait_seconds": round(self.max_wait, 2),
+        }
+
+
+class AdmissionController:
+    """Per-replica limits on runs, uploads and MCP server processes."""
+
+    def __init__(
+        self,
+        max_runs: int = MAX_CONCURRENT_RUNS,
+        max_runs_per_user: int = MAX_RUNS_PER_USER,
+        max_uploads: int = MAX_CONCURRENT_UPLOADS,
+        max_upload_bytes: int = MAX_UPLOAD_BYTES,
+        max_mcp_processes: int = MAX_MCP_PROCESSES,
+    ) -> None:
+        self.runs = Gate("runs", max_runs)
+        self.max_runs_per_user = max_runs_per_user
+        self.user_runs: Dict[str, Gate] = {}
+        self.uploads = Gate("uploads", max_uploads)
+        self.upload_bytes = Gate("upload_bytes", max_upload_bytes)
+        self.mcp = Gate("mcp_processes", max_mcp_processes)
+
+    def _user_gate(self, user: str) -> Gate:
+        if user not in self.user_runs:
+            self.user_runs[user] = Gate(f"runs:{user}", self.max_runs_per_user)
+        return self.user_runs[user]
+
+    @asynccontextmanager
+    async def run(self, user: str, on_wait: OnWait = None, timeout: Optional[float] = QUEUE_TIMEOUT):
+        """Hold a per-user and a per-replica run slot for the duration of the block."""
+        user_gate = self._user_gate(user)
+        await user_gate.acquire(timeout=timeout, on_wait=on_wait)
+        try:
+            await self.runs.acquire(timeout=timeout, on_wait=on_wait)
+            try:
+                yield
+            finally:
+                self.runs.release()
+        finally:
+            user_gate.release()
+            if not user_gate.in_use and not user_gate.waiting:
+                self.user_runs.pop(user, None)
+
+    @asynccontextmanager
+    async def upload(self, size: int, on_wait: OnWait = None, timeout: Optional[float] = QUEUE_TIMEOUT):
+        """Hold an upload slot and `size` bytes of the upload budget."""
+        await self.uploads.acquire(timeout=timeout, on_wait=on_wait)
+        try:
+            reserved = await self.upload_bytes.acquire(size, timeout=timeout, on_wait=on_wait)
+            try:
+                yield
+            finally:
+                self.upload_bytes.release(reserved)
+        finally:
+            self.uploads.release()
+
+    async def acquire_mcp(self, timeout: Optional[float] = MCP_QUEUE_TIMEOUT) -> None:
+        """MCP servers live as long as the chat session, release with release_mcp on chat end."""
+        await self.mcp.acquire(timeout=timeout)
+
+    def release_mcp(self) -> None:
+        self.mcp.release()
+
+    def stats(self) -> Dict:
+        return {
+            "runs": self.runs.stats(),
+            "users_with_runs": len(self.user_runs),
+            "uploads": self.uploads.stats(),
+            "upload_bytes": self.upload_bytes.stats(),
+            "mcp_processes": self.mcp.stats(),
+        }
+
+
+_controller: Optional[AdmissionController] = None
+
+
+def get_admission() -> AdmissionController:
+    global _controller
+    if _controller is None:
+        _controller = AdmissionController()
+    return _controller
+
+
+def user_key_for(context) -> str:
+    """Limit per signed-in user, falling back to the browser session for anonymous chats."""
+    user = getattr(context.session, "user", None)
+    return getattr(user, "identifier", None) or context.session.id
+
+
+def queued_notifier(send: Callable[[str], Awaitable[None]]) -> OnWait:
+    """on_wait callback that tells the user their place in line once."""
+    notified = False
+
+    async def notify(position: int) -> None:
+        nonlocal notified
+        if not notified:
+            notified = True
+            await send(QUEUED_MESSAGE.format(position=position))
+
+    return notify
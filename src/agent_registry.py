@@ -0,0 +1,172 @@
+import os
+import re
+import time
+import asyncio
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Tuple
+
+import yaml
+
+AGENTS_PATH = os.path.join(os.path.dirname(__file__), "agents.yaml")
+# Agent definitions are re-read this often so instruction or tool changes reach running replicas
+AGENT_REGISTRY_REFRESH_SECONDS = int(os.getenv("AGENT_REGISTRY_REFRESH_SECONDS", "300"))
+
+EXPLICIT_ROUTE = re.compile(r"^@(\w[\w-]*)\s+", re.IGNORECASE)
+
+
+@dataclass
+class AgentRoute:
+    key: str
+    agent_id: str
+    description: str = ""
+    keywords: List[str] = field(default_factory=list)
+    default: bool = False
+
+
+@dataclass
+class AgentInfo:
+    id: str
+    name: str
+    model: Optional[str]
+    instructions: Optional[str]
+    loaded_at: float = field(default_factory=time.time)
+
+
+def load_routes(path: str = AGENTS_PATH) -> List[AgentRoute]:
+    """Read agents.yaml, skipping routes whose agent id env var isn't set."""
+    with open(path, "r", encoding="utf-8") as f:
+        entries = yaml.safe_load(f) or []
+    routes = []
+    for entry in entries:
+        agent_id = os.getenv(entry["agent_id_env"])
+        if not agent_id:
+            print(f"Agent route {entry['key']} disabled, {entry['agent_id_env']} is not set")
+            continue
+        routes.append(AgentRoute(
+            key=entry["key"],
+            agent_id=agent_id,
+            description=entry.get("description", ""),
+            keywords=[keyword.lower() for keyword in entry.get("keywords", [])],
+            default=bool(entry.get("default", False)),
+        ))
+    return routes
+
+
+class AgentRegistry:
+    """Agent metadata for every route, loaded once per process and refreshed in the background.
+
+    A failed refresh keeps serving the last good definition, so a transient
+    error on the agents endpoint never takes a route down.
+    """
+
+    def __init__(self, routes: List[AgentRoute], refresh_seconds: int = AGENT_REGISTRY_REFRESH_SECONDS) -> None:
+        self.routes: Dict[str, AgentRoute] = {route.key: route for route in routes}
+        self.refresh_seconds = refresh_seconds
+        self.agents: Dict[str, AgentInfo] = {}
+        self._client = None
+        self._lock = asyncio.Lock()
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def default_key(self) -> Optional[str]:
+        for route in self.routes.values():
+            if route.default:
+                return route.key
+        return next(iter(self.routes), None)
+
+    async def start(self, agents_client) -> None:
+        """Load all agents on first use, later calls return immediately."""
+        async with self._lock:
+            if self._client is not None:
+                return
+            self._client = agents_client
+            await self.refresh()
+            if self.refresh_seconds > 0:
+                self._task = asyncio.create_task(self._run())
+
+    async def _load(self, route: AgentRoute) -> None:
+        try:
+            agent = await self._client.get_agent(agent_id=route.agent_id)
+        except Exception as e:
+            if route.key in self.agents:
+                print(f"Could not refresh agent {route.key}, keeping the cached definition: {str(e)}")
+            else:
+                print(f"Could not load agent {route.key} ({route.agent_id}): {str(e)}")
+            return
+        self.agents[route.key] = AgentInfo(
+            id=agent.id,
+            name=agent.name or route.key,
+            model=getattr(agent, "model", None),
+            instructions=getattr(agent, "instructions", None),
+        )
+
+    async def refresh(self) -> None:
+        await asyncio.gather(*(self._load(route) for route in self.routes.values()))
+        print(f"Agent registry: {', '.join(f'{key}={info.name}' for key, info in self.agents.items()) or 'empty'}")
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.refresh_seconds)
+            await self.refresh()
+
+    def get(self, key: Optional[str]) -> Optional[AgentInfo]:
+        return self.agents.get(key) if key else None
+
+    async def close(self) -> None:
+        if self._task:
+            self._task.cancel()
+            self._task = None
+
+
+class KeywordRouter:
+    """Pick a route from the message text.
+
+    "@key message" selects a route explicitly. Otherwise the route with the
+    most keyword hits wins; with no hits (a follow-up such as "and in blue?")
+    the conversation stays with its previous agent.
+    """
+
+    def __init__(self, routes: List[AgentRoute], default_key: Optional[str] = None) -> None:
+        self.keys = [route.key for route in routes]
+        self.default_key = default_key or (self.keys[0] if self.keys else None)
+        self._patterns = {
+            route.key: re.compile(r"\b(" + "|".join(re.escape(keyword) for keyword in route.keywords) + r")\b", re.IGNORECASE)
+            for route in routes
+            if route.keywords
+        }
+
+    def scores(self, text: str) -> Dict[str, int]:
+        return {key: len(pattern.findall(text)) for key, pattern in self._patterns.items()}
+
+    def route(self, text: str, previous: Optional[str] = None) -> Tuple[str, str]:
+        """Return the route key and the message with any "@key" prefix removed."""
+        explicit = EXPLICIT_ROUTE.match(text)
+        if explicit and explicit.group(1).lower() in self.keys:
+            return explicit.group(1).lower(), text[explicit.end():]
+
+        scores = self.scores(text)
+        best = max(scores.values(), default=0)
+        if best == 0:
+            return (previous if previous in self.keys else self.default_key), text
+        leaders = [key for key, score in scores.items() if score == best]
+        # On a tie, don't bounce the conversation between agents
+        return (previous if previous in leaders else leaders[0]), text
+
+
+_registry: Optional[AgentRegistry] = None
+_router: Optional[KeywordRouter] = None
+
+
+def get_registry() -> AgentRegistry:
+    global _registry
+    if _registry is None:
+        _registry = AgentRegistry(load_routes())
+    return _registry
+
+
+def get_router() -> KeywordRouter:
+    global _router
+    if _router is None:
+        registry = get_registry()
+        _router = KeywordRouter(list(registry.routes.values()), registry.default_key)
+    return _router
@@ -3,6 +3,7 @@ import json
 import asyncio
 import chainlit as cl
 import logging
+import yaml
 from dotenv import load_dotenv
 from azure.ai.projects.aio import AIProjectClient
 from azure.ai.agents.models import (
@@ -18,11 +19,22 @@ from azure.ai.agents.models import (
     AzureAISearchQueryType
 )
 from azure.ai.agents.aio import AgentsClient
+from azure.core.credentials import AzureKeyCredential
+from azure.search.documents.aio import SearchClient
 from azure.identity.aio import DefaultAzureCredential
 from pprint import pprint
 
 from wsproto import ConnectionType
 
+from session_state import get_session_state, session_key_for
+from admission import get_admission, user_key_for, queued_notifier, AdmissionRejected, BUSY_MESSAGE
+from rate_limiter import azure_client_options, is_throttled, THROTTLED_MESSAGE
+from agent_registry import get_registry, get_router
+from citations import CitationResolver, sources_markdown, CITATION_INDEX_NAME
+from run_steps import RunStepWatcher, ToolProgress
+from data_layer import register_data_layer
+from sku_index import load_sku_index
+
 # Load environment variables
 load_dotenv()
 
@@ -33,52 +45,77 @@ logger.setLevel(logging.WARNING)
 PROJECT_ENDPOINT = os.getenv("AIPROJECT_ENDPOINT")
 ASSISTANT_ID = os.getenv("ASSISTANT_ID")
 
-# We'll initialize the client in the on_chat_start handler to ensure it's created in the async context
+# We'll initialize the client in the on_chat_start handler to ensure it's created in the async context.
+# One pair of clients serves every session so they share the connection pool.
 project_client = None
 agents_client = None
+_clients_lock = None
+
+
+async def get_clients():
+    global project_client, agents_client, _clients_lock
+    if _clients_lock is None:
+        _clients_lock = asyncio.Lock()
+    async with _clients_lock:
+        if agents_client is None:
+            if not PROJECT_ENDPOINT:
+                raise ValueError("AIPROJECT_ENDPOINT environment variable is not set.")
+            credential = DefaultAzureCredential()
+            project_client = AIProjectClient(endpoint=PROJECT_ENDPOINT, credential=credential, **azure_client_options())
+            agents_client = AgentsClient(endpoint=PROJECT_ENDPOINT, credential=credential, **azure_client_options())
+    return project_client, agents_client
+
+
+citation_resolver = None
+
+
+def get_citation_resolver(agents_client) -> CitationResolver:
+    global citation_resolver
+    if citation_resolver is None:
+        # Without search credentials the titles and links carried by the annotations are used as-is
+        search_client = None
+        if os.getenv("AZURE_SEARCH_SERVICE_ENDPOINT") and os.getenv("AZURE_SEARCH_API_KEY"):
+            search_client = SearchClient(
+                endpoint=os.getenv("AZURE_SEARCH_SERVICE_ENDPOINT"),
+                index_name=CITATION_INDEX_NAME,
+                credential=AzureKeyCredential(os.getenv("AZURE_SEARCH_API_KEY")),
+                **azure_client_options("search"),
+            )
+        citation_resolver = CitationResolver(agents_client, search_client)
+    return citation_resolver
 
 # Chainlit setup
 import chainlit as cl
 
+# Threads moved to blob storage by thread_archive.py are restored when opened
+register_data_layer()
+
+STARTERS_PATH = os.path.join(os.path.dirname(__file__), "starters.yaml")
+
+
+def load_starters(path: str = STARTERS_PATH):
+    # Starters live in starters.yaml so evaluate_agent.py can replay them
+    with open(path, "r", encoding="utf-8") as f:
+        return yaml.safe_load(f) or []
+
+
 @cl.set_starters
 async def set_starters(user: cl.User | None):
     return [
         cl.Starter(
-            label="Which SPD is right for PoE Mode A applications?",
-            message="Which SPD is right for PoE Mode A applications?",
-            icon="lightning"
-        ),
-        cl.Starter(
-            label="Can the I2R-75KD480 protect a 480V VFD?",
-            message="Can the I2R-75KD480 protect a 480V VFD?",
-            icon="shield"
-        ),
-        cl.Starter(
-            label="What cable pairs best with the DPR-F140 for an outdoor PoE++ install?",
-            message="What cable pairs best with the DPR-F140 for an outdoor PoE++ install?",
-            icon="cable"
-        ),
-        cl.Starter(
-            label="Need an RF coax protector for a 900 MHz antenna with N-Type connectors?",
-            message="Need an RF coax protector for a 900 MHz antenna with N-Type connectors?",
-            icon="shield"
-        ),
+            label=starter["label"],
+            message=starter["message"],
+            icon=starter.get("icon"),
+        )
+        for starter in load_starters()
     ]
 
 
 @cl.on_chat_start
 async def on_chat_start():
-    # Instantiate the AI assistant client
-    global project_client, agents_client
-    credential = DefaultAzureCredential()
-    if not PROJECT_ENDPOINT:
-        raise ValueError("AIPROJECT_ENDPOINT environment variable is not set.")
-    # Create clients that will be properly managed
-    
-    # Initialize the project client
-    project_client = AIProjectClient(endpoint=PROJECT_ENDPOINT, credential=credential)
+    # Instantiate the AI assistant clients, shared by all sessions
+    project_client, agents_client = await get_clients()
 
-    
     connections = project_client.connections.list()
     async for cs in connections:
         pprint(vars(cs))
@@ -91,7 +128,7 @@ async def on_chat_start():
      # Initialize agent AI search tool and add the search index connection id
     ai_search = AzureAISearchTool(
         index_connection_id=conn_id,
-        index_name="azureblob-index",
+        index_name=CITATION_INDEX_NAME,
         query_type=AzureAISearchQueryType.SIMPLE,
         top_k=3,
         filter="",
@@ -106,19 +143,19 @@ async def on_chat_start():
     # conn_id = conn.id
     # print(f"Connection ID: {conn_id}")
     
-    # Initialize the agents client
-    agents_client = AgentsClient(endpoint=PROJECT_ENDPOINT, credential=credential)
-
+    # Build the part number index now rather than on the first product question
+    await load_sku_index()
 
-    # Verify the assistant exists by trying to get it
-    try:
-        # Check if ASSISTANT_ID is set
-        if not ASSISTANT_ID:
-            raise ValueError("ASSISTANT_ID environment variable is not set.")
-        assistant = await agents_client.get_agent(agent_id=ASSISTANT_ID)
-        print(f"Connected to agent: {assistant.name} (ID: {assistant.id})")
-    except Exception as e:
-        raise ValueError(f"Assistant with ID {ASSISTANT_ID} not found or could not be accessed: {str(e)}")
+    # Check if ASSISTANT_ID is set
+    if not ASSISTANT_ID:
+        raise ValueError("ASSISTANT_ID environment variable is not set.")
+    # The registry loads every routed agent once per process and refreshes them in the background
+    registry = get_registry()
+    await registry.start(agents_client)
+    assistant = registry.get(registry.default_key)
+    if not assistant:
+        raise ValueError(f"Assistant with ID {ASSISTANT_ID} not found or could not be accessed.")
+    print(f"Connected to agent: {assistant.name} (ID: {assistant.id})")
 
     # List existing vector stores
     vector_stores = agents_client.vector_stores.list()
@@ -174,16 +211,54 @@ async def on_chat_start():
     cl.user_session.set("project_client", project_client)
     cl.user_session.set("agents_client", agents_client)
 
+    # Pick up the thread from the shared session state when another replica started it
+    session_state = get_session_state()
+    session_key = session_key_for(cl.context)
+    snapshot = await session_state.load(session_key)
+    if snapshot and snapshot.thread_id and not cl.user_session.get("thread_id"):
+        cl.user_session.set("thread_id", snapshot.thread_id)
+        print(f"Restored Thread ID: {snapshot.thread_id} (last served by {snapshot.replica_id})")
+    if snapshot and snapshot.agent_key and not cl.user_session.get("agent_key"):
+        cl.user_session.set("agent_key", snapshot.agent_key)
+
     # Create a new thread for this conversation
     if not cl.user_session.get("thread_id"):
         thread = await agents_client.threads.create()
         cl.user_session.set("thread_id", thread.id)
         print(f"New Thread ID: {thread.id}")
 
+    await session_state.update(session_key, thread_id=cl.user_session.get("thread_id"))
+
+async def poll_steps(watcher: RunStepWatcher):
+    try:
+        await watcher.poll()
+    except Exception as e:
+        # Progress display is best effort, the final answer is still fetched after the run
+        print(f"Could not poll run steps: {str(e)}")
+
+
+async def render_answer(target: cl.Message, assistant_message, agents_client, send: bool = False):
+    # Resolve the citation annotations to document titles and links
+    message_text, citations = await get_citation_resolver(agents_client).resolve(assistant_message)
+
+    # Update the Chainlit message with the assistant's response and its sources in one go
+    target.content = message_text + sources_markdown(citations)
+    target.elements = [
+        cl.Text(
+            name=citation.label,
+            content=f"**{citation.title}**\n\n{citation.url or ''}\n\n{citation.quote or ''}".strip(),
+            display="side",
+        )
+        for citation in citations
+    ]
+    if send:
+        await target.send()
+    else:
+        await target.update()
+
+
 @cl.on_message
 async def on_message(message: cl.Message):
-    global agents_client
-    
     thread_id = cl.user_session.get("thread_id")
     if not thread_id:
         await cl.Message(content="No active thread. Please refresh the page.").send()
@@ -192,47 +267,100 @@ async def on_message(message: cl.Message):
     if not ASSISTANT_ID:
         await cl.Message(content="ASSISTANT_ID environment variable is not set.").send()
         return
-        
-    if not agents_client:
-        # Re-initialize if needed
-        credential = DefaultAzureCredential()
-        if not PROJECT_ENDPOINT:
-            await cl.Message(content="AIPROJECT_ENDPOINT environment variable is not set.").send()
-            return
-            
-        # Create new clients
-        project_client = AIProjectClient(endpoint=PROJECT_ENDPOINT, credential=credential)
-        agents_client = AgentsClient(endpoint=PROJECT_ENDPOINT, credential=credential)
-        
-        # Update the session
-        cl.user_session.set("project_client", project_client)
-        cl.user_session.set("agents_client", agents_client)
+
+    try:
+        project_client, agents_client = await get_clients()
+    except ValueError as e:
+        await cl.Message(content=str(e)).send()
+        return
+    registry = get_registry()
+    await registry.start(agents_client)
+
+    # Send the message to the agent it's about, the thread is shared so context carries over
+    agent_key, content = get_router().route(message.content, previous=cl.user_session.get("agent_key"))
+    if not registry.get(agent_key):
+        agent_key = registry.default_key
+    assistant = registry.get(agent_key)
+    if not assistant:
+        await cl.Message(content="No agent is available to answer right now.").send()
+        return
+    if agent_key != cl.user_session.get("agent_key"):
+        print(f"Routing to agent {agent_key} ({assistant.name})")
+    cl.user_session.set("agent_key", agent_key)
     
     try:
         # Show thinking message to user
-        thinking_msg = await cl.Message(content="thinking...", author="assistant").send()
+        thinking_msg = await cl.Message(content="thinking...", author=assistant.name).send()
 
-        # Add the user message to the thread
-        await agents_client.messages.create(
-            thread_id=thread_id,
-            role=MessageRole.USER,
-            content=message.content
-        )
-        
-        # Run the assistant to process the message in the thread
-        run = await agents_client.runs.create(
-            thread_id=thread_id, 
-            agent_id=ASSISTANT_ID
-        )
-        
-        # Poll until run is complete
-        while run.status in ["queued", "in_progress", "requires_action"]:
-            await asyncio.sleep(1)
-            run = await agents_client.runs.get(
+        # Queue behind other runs on this replica and this user's previous message
+        notify = queued_notifier(lambda text: thinking_msg.stream_token(f"\n{text}"))
+        async with get_admission().run(user_key_for(cl.context), on_wait=notify):
+            # Add the user message to the thread
+            await agents_client.messages.create(
                 thread_id=thread_id,
-                run_id=run.id
+                role=MessageRole.USER,
+                content=content
             )
-            print(f"Run status: {run.status}")
+        
+            # Known part numbers are answered from the inventory rows, anything else goes to the search tool
+            inventory_context = (await load_sku_index()).context_for(content)
+            if inventory_context:
+                print(f"Inventory rows injected for run on thread {thread_id}")
+
+            # Run the assistant to process the message in the thread
+            run = await agents_client.runs.create(
+                thread_id=thread_id, 
+                agent_id=assistant.id,
+                additional_instructions=inventory_context
+            )
+
+            # Record the run so a stop request on any replica can cancel it
+            session_state = get_session_state()
+            session_key = session_key_for(cl.context)
+            await session_state.update(session_key, thread_id=thread_id, run_id=run.id, run_thread_id=thread_id, agent_key=agent_key)
+        
+            # Show tool calls and answers as their run steps complete instead of at the end of the run
+            tool_steps = {}
+            answers = []
+
+            async def show_tool(progress: ToolProgress):
+                step = tool_steps.get(progress.id)
+                if step is None:
+                    step = tool_steps[progress.id] = cl.Step(name=progress.type, type="tool", parent_id=thinking_msg.id)
+                    step.input = progress.query or ""
+                    await step.send()
+                if progress.query:
+                    step.input = progress.query
+                step.output = progress.describe()
+                await step.update()
+
+            async def show_answer(assistant_message):
+                target = thinking_msg if not answers else cl.Message(content="", author=assistant.name)
+                await render_answer(target, assistant_message, agents_client, send=bool(answers))
+                answers.append(target)
+
+            watcher = RunStepWatcher(agents_client, thread_id, run.id, on_tool=show_tool, on_message=show_answer)
+
+            # Poll until run is complete
+            try:
+                async with session_state.watch_cancel(run.id) as wait_for_cancel:
+                    while run.status in ["queued", "in_progress", "requires_action"]:
+                        if await wait_for_cancel(1):
+                            await agents_client.runs.cancel(thread_id=thread_id, run_id=run.id)
+                            await session_state.clear_cancel(run.id)
+                            print(f"Cancel requested for run {run.id}")
+                        run = await agents_client.runs.get(
+                            thread_id=thread_id,
+                            run_id=run.id
+                        )
+                        print(f"Run status: {run.status}")
+                        await poll_steps(watcher)
+                # Pick up the steps that finished between the last poll and the end of the run
+                await poll_steps(watcher)
+            finally:
+                # Also on errors and cancels, so the snapshot never points at a finished run
+                await session_state.update(session_key, run_id=None, run_thread_id=None)
+                await session_state.clear_cancel(run.id)
             
         print(f"Run finished with status: {run.status}")
 
@@ -246,49 +374,59 @@ async def on_message(message: cl.Message):
                     error_message = f"Error code: {run.last_error.code}"
             raise Exception(error_message)
 
-        # Get all messages from the thread
-        messages = agents_client.messages.list(
-            thread_id=thread_id,
-            order=ListSortOrder.DESCENDING  # Get newest messages first
-        )
-        
-        # Find the latest assistant message
-        assistant_message = None
-        async for msg in messages:
-            if msg.role == MessageRole.AGENT:  # In the new API, assistants have the role "agent"
-                assistant_message = msg
-                break
-                
-        if not assistant_message:
+        if run.status in ["cancelling", "cancelled"]:
+            if not answers:
+                thinking_msg.content = "Run cancelled."
+                await thinking_msg.update()
+            return
+
+        if not answers:
+            # The run steps didn't yield the answer, read it from this run's messages only
+            messages = agents_client.messages.list(
+                thread_id=thread_id,
+                run_id=run.id,
+                order=ListSortOrder.DESCENDING  # Get newest messages first
+            )
+            async for msg in messages:
+                if msg.role == MessageRole.AGENT:  # In the new API, assistants have the role "agent"
+                    await show_answer(msg)
+                    break
+
+        if not answers:
             raise Exception("No response from the assistant.")
-        
-        # Extract text from the message
-        message_text = ""
-        if hasattr(assistant_message, 'text_messages') and assistant_message.text_messages:
-            for content in assistant_message.text_messages:
-                if hasattr(content, 'text'):
-                    message_text += content.text.value
-        
-        # Update the Chainlit message with the assistant's response
-        thinking_msg.content = message_text
-        await thinking_msg.update()
 
+    except AdmissionRejected:
+        await cl.Message(content=BUSY_MESSAGE).send()
     except Exception as e:
+        if is_throttled(e):
+            await cl.Message(content=THROTTLED_MESSAGE).send()
+            return
         await cl.Message(content=f"Error: {str(e)}").send()
 
+@cl.on_stop
+async def on_stop():
+    # The run may be polled by another replica, so signal through the shared state
+    session_state = get_session_state()
+    snapshot = await session_state.load(session_key_for(cl.context))
+    if snapshot and snapshot.run_id:
+        await session_state.request_cancel(snapshot.run_id)
+        print(f"Stop requested for run {snapshot.run_id}")
+        # Chainlit cancels the local on_message task, so cancel the run here as well
+        agents_client = cl.user_session.get("agents_client")
+        if agents_client:
+            try:
+                await agents_client.runs.cancel(thread_id=snapshot.run_thread_id, run_id=snapshot.run_id)
+            except Exception as e:
+                print(f"Could not cancel run {snapshot.run_id}: {str(e)}")
+        await session_state.update(snapshot.session_key, run_id=None, run_thread_id=None)
+
 @cl.on_chat_end
 async def on_chat_end():
-    # Clean up resources when the session ends
-    project_client = cl.user_session.get("project_client")
-    agents_client = cl.user_session.get("agents_client")
-    
-    # Close the clients properly
-    if project_client:
-        await project_client.close()
-    if agents_client:
-        await agents_client.close()
-    
-    print("Client sessions closed properly")
+    # The clients are shared by every session on this replica and live as long as the process
+    cl.user_session.set("project_client", None)
+    cl.user_session.set("agents_client", None)
+    # The snapshot only matters while the session is open, don't keep it around until the TTL
+    await get_session_state().delete(session_key_for(cl.context))
 
 if __name__ == "__main__":
     # Chainlit will automatically run the application
@@ -1,10 +1,12 @@
 import os
-import plotly
+import asyncio
 from pathlib import Path
 from typing import List, Dict, Optional
 
 from azure.ai.projects import AIProjectClient
 from azure.identity import DefaultAzureCredential
+from azure.identity.aio import DefaultAzureCredential as AsyncDefaultAzureCredential
+from azure.ai.agents.aio import AgentsClient as AsyncAgentsClient
 from azure.ai.agents.models import (
     AgentEventHandler,
     MessageDeltaChunk,
@@ -22,11 +24,31 @@ from chainlit.config import config
 from chainlit.element import Element
 from chainlit.context import local_steps
 
+from session_state import get_session_state, session_key_for
+from upload_preprocessing import is_tabular, preprocess_table, remove_preprocessed
+from vector_store_manager import VectorStoreManager
+from streaming_upload import upload_streaming, upload_agent_file, format_progress
+from admission import get_admission, user_key_for, queued_notifier, AdmissionRejected, BUSY_MESSAGE
+from figure_downsampling import reduce_figure
+from callback_profiler import start_profiling
+from element_storage import get_element_storage, mount_element_route
+from data_layer import register_data_layer
+from run_checkpoint import (
+    RunCheckpointer,
+    ACTIVE_RUN_STATUSES,
+    RUN_CHECKPOINT_INTERVAL,
+    create_checkpointer,
+    load_checkpoint,
+    claim_orphaned_run,
+)
+from rate_limiter import azure_client_options, openai_http_client, is_throttled, THROTTLED_MESSAGE
+
 
 # Initialize Azure AI Project Client
 project_client = AIProjectClient(
     credential=DefaultAzureCredential(),
-    endpoint=os.environ.get("AIPROJECT_ENDPOINT", "")  # Using AIPROJECT_ENDPOINT from .env with empty default
+    endpoint=os.environ.get("AIPROJECT_ENDPOINT", ""),  # Using AIPROJECT_ENDPOINT from .env with empty default
+    **azure_client_options(sync=True)  # Shared rate limiter and retry for the agents calls
 )
 # -- Azure AI Projects Examples -------------------------------------------
 # # List project flows
@@ -70,6 +92,30 @@ agent = agents_client.get_agent(os.environ.get("ASSISTANT_ID", ""))  # Using ASS
 
 config.ui.name = agent.name
 
+# Per-thread vector stores for uploaded documents, managed through the async agents client
+vector_store_manager = VectorStoreManager(AsyncAgentsClient(
+    endpoint=os.environ.get("AIPROJECT_ENDPOINT", ""),
+    credential=AsyncDefaultAzureCredential(),
+    **azure_client_options(),
+))
+
+# Generated files and images go to blob storage instead of through the websocket and the database
+element_storage = get_element_storage()
+if element_storage:
+    from chainlit.server import app as chainlit_app
+
+    mount_element_route(chainlit_app, element_storage)
+
+# Threads moved to blob storage by thread_archive.py are restored when opened
+register_data_layer()
+
+DOCUMENT_MIMES = [
+    "application/vnd.openxmlformats-officedocument.wordprocessingml.document",
+    "text/markdown",
+    "application/pdf",
+    "text/plain",
+]
+
 class EventHandler(AgentEventHandler):
 
     def __init__(self, assistant_name: str) -> None:
@@ -77,6 +123,9 @@ class EventHandler(AgentEventHandler):
         self.current_message: cl.Message = None
         self.current_step: cl.Step = None
         self.current_tool_call = None
+        self.cancel_watcher: asyncio.Task = None
+        # Written to the data layer as the run streams so another replica can resume it
+        self.checkpointer: Optional[RunCheckpointer] = None
         self.assistant_name = assistant_name
         previous_steps = local_steps.get() or []
         parent_step = previous_steps[-1] if previous_steps else None
@@ -85,16 +134,57 @@ class EventHandler(AgentEventHandler):
 
     async def on_run_step_created(self, run_step: RunStep) -> None:
         cl.user_session.set("run_step", run_step)
+        # Share the run so a stop on another replica can reach it
+        await get_session_state().update(
+            session_key_for(cl.context),
+            run_id=run_step.run_id,
+            run_thread_id=run_step.thread_id,
+        )
+        if not self.cancel_watcher:
+            self.cancel_watcher = asyncio.create_task(self.watch_for_cancel(run_step))
+        if self.checkpointer is None:
+            self.checkpointer = create_checkpointer(cl.context.session.thread_id, run_step.thread_id, run_step.run_id)
+            if self.checkpointer:
+                self.checkpointer.update(last_event_id=run_step.id)
+                await self.checkpointer.start()
+        else:
+            self.checkpointer.update(last_event_id=run_step.id)
+            await self.checkpointer.save()
+
+    def release(self) -> None:
+        """Drop references to Chainlit objects once the run is over so finished runs don't pin them."""
+        if self.cancel_watcher:
+            self.cancel_watcher.cancel()
+        self.cancel_watcher = None
+        self.current_message = None
+        self.current_step = None
+
+    async def watch_for_cancel(self, run_step: RunStep) -> None:
+        session_state = get_session_state()
+        async with session_state.watch_cancel(run_step.run_id) as wait_for_cancel:
+            while not await wait_for_cancel(5):
+                pass
+        await session_state.clear_cancel(run_step.run_id)
+        await agents_client.cancel_run(thread_id=run_step.thread_id, run_id=run_step.run_id)
 
     async def on_text_created(self, text) -> None:
         self.current_message = await cl.Message(author=self.assistant_name, content="").send()
+        if self.checkpointer:
+            self.checkpointer.update(message_id=self.current_message.id, content="")
 
     async def on_text_delta(self, delta, snapshot):
         if delta.value:
             await self.current_message.stream_token(delta.value)
+            if self.checkpointer:
+                # Written by the heartbeat, not on every token
+                self.checkpointer.update(content=self.current_message.content)
 
     async def on_text_done(self, text):
         await self.current_message.update()
+        if self.checkpointer:
+            checkpoint = self.checkpointer.checkpoint
+            self.checkpointer.update(messages_done=checkpoint.messages_done + 1, message_id=None, content="")
+            await self.checkpointer.save()
         if text.annotations:
             for annotation in text.annotations:
                 if annotation.type == "file_path":
@@ -102,19 +192,27 @@ class EventHandler(AgentEventHandler):
                     file_content = await agents_client.get_file_content(annotation.file_path.file_id)
                     file_name = annotation.text.split("/")[-1]
                     try:
-                        fig = plotly.io.from_json(file_content)
+                        # Big figures are downsampled off the event loop before they reach the browser
+                        fig, _ = await asyncio.to_thread(reduce_figure, annotation.file_path.file_id, file_content)
                         element = cl.Plotly(name=file_name, figure=fig)
                         await cl.Message(
                             content="",
                             elements=[element]).send()
+                        # The figure JSON is stored by Chainlit now, release our copy
+                        element.figure = None
+                        element.content = None
                     except Exception as e:
-                        element = cl.File(content=file_content, name=file_name)
+                        if element_storage:
+                            element = cl.File(url=await element_storage.upload(file_content, file_name), name=file_name)
+                        else:
+                            element = cl.File(content=file_content, name=file_name)
                         await cl.Message(
                             content="",
                             elements=[element]).send()
                     # Hack to fix links
-                    if annotation.text in self.current_message.content and element.chainlit_key:
-                        self.current_message.content = self.current_message.content.replace(annotation.text, f"/project/file/{element.chainlit_key}?session_id={cl.context.session.id}")
+                    if annotation.text in self.current_message.content and (element.url or element.chainlit_key):
+                        link = element.url or f"/project/file/{element.chainlit_key}?session_id={cl.context.session.id}"
+                        self.current_message.content = self.current_message.content.replace(annotation.text, link)
                         await self.current_message.update()
 
     async def on_tool_call_created(self, tool_call):
@@ -156,9 +254,13 @@ class EventHandler(AgentEventHandler):
 
     async def on_event(self, event) -> None:
         if event.event == "error":
+            if getattr(event.data, "code", None) == "rate_limit_exceeded":
+                return cl.ErrorMessage(content=THROTTLED_MESSAGE).send()
             return cl.ErrorMessage(content=str(event.data.message)).send()
 
     async def on_exception(self, exception: Exception) -> None:
+        if is_throttled(exception):
+            return cl.ErrorMessage(content=THROTTLED_MESSAGE).send()
         return cl.ErrorMessage(content=str(exception)).send()
 
     async def on_tool_call_done(self, tool_call):       
@@ -168,50 +270,105 @@ class EventHandler(AgentEventHandler):
     async def on_image_file_done(self, image_file):
         image_id = image_file.file_id
         response = await agents_client.get_file_content(image_id)
-        image_element = cl.Image(
-            name=image_id,
-            content=response,
-            display="inline",
-            size="large"
-        )
+        if element_storage:
+            # The browser fetches the image from blob storage, not through this process
+            image_element = cl.Image(
+                name=image_id,
+                url=await element_storage.upload(response, f"{image_id}.png", mime="image/png"),
+                display="inline",
+                size="large"
+            )
+        else:
+            image_element = cl.Image(
+                name=image_id,
+                content=response,
+                display="inline",
+                size="large"
+            )
         if not self.current_message.elements:
             self.current_message.elements = []
         self.current_message.elements.append(image_element)
         await self.current_message.update()
+        # Chainlit has stored the file by now, don't keep the bytes alive with the message
+        image_element.content = None
 
 
 @cl.step(type="tool")
 async def speech_to_text(audio_file):
     # Using Azure AI Projects for speech-to-text
-    with project_client.inference.get_azure_openai_client() as openai_client:
+    with project_client.inference.get_azure_openai_client(http_client=openai_http_client(sync=True)) as openai_client:
         response = await openai_client.audio.transcriptions.create(
             model="whisper-1", file=audio_file
         )
     return response.text
 
 
-async def upload_files(files: List[Element]):
+async def upload_files(file_paths: List[str]):
     file_ids = []
-    for file in files:
-        uploaded_file = await agents_client.upload_file(
-            file_path=file.path, purpose="assistants"
-        )
+    for file_path in file_paths:
+        # Stream the file in chunks instead of letting the SDK read it whole, off the event loop
+        async with cl.Step(name=f"Uploading {os.path.basename(file_path)}", type="tool") as step:
+            async def show_progress(sent: int, total: int):
+                step.output = format_progress(sent, total)
+                await step.update()
+
+            uploaded_file, _ = await upload_streaming(
+                lambda reader: asyncio.to_thread(upload_agent_file, agents_client, reader),
+                file_path,
+                on_progress=show_progress,
+            )
         file_ids.append(uploaded_file.id)
     return file_ids
 
 
-async def process_files(files: List[Element]):
-    # Upload files if any and get file_ids
+async def preprocess_files(files: List[Element]):
+    # Convert CSV/XLSX uploads to Parquet + a summary sidecar so code interpreter loads them faster
+    uploads = []
+    converted = []
+    for file in files:
+        if is_tabular(file.name):
+            try:
+                results = await asyncio.to_thread(preprocess_table, file.path, file.name)
+                converted.extend(results)
+                uploads.extend((path, None) for result in results for path in result.paths)
+                continue
+            except Exception as e:
+                print(f"Could not preprocess {file.name}, uploading as-is: {str(e)}")
+        uploads.append((file.path, file.mime))
+    return uploads, converted
+
+
+async def process_files(files: List[Element], thread_id: str):
+    uploads, converted = await preprocess_files(files)
+    try:
+        return await upload_processed(uploads, thread_id)
+    finally:
+        # The Parquet copies only exist to be uploaded
+        remove_preprocessed(converted)
+
+
+async def upload_processed(uploads, thread_id: str):
+    documents = [path for path, mime in uploads if mime in DOCUMENT_MIMES]
+    others = [path for path, mime in uploads if mime not in DOCUMENT_MIMES]
+
+    # Documents go into the thread's vector store, which keeps growing instead of being rebuilt per message
+    document_ids = []
+    if documents:
+        vector_store_manager.schedule_expiry_sweep()
+        document_ids = await vector_store_manager.add_files(thread_id, documents)
+        await vector_store_manager.attach(thread_id)
+
+    # Upload the rest if any and get file_ids
     file_ids = []
-    if len(files) > 0:
-        file_ids = await upload_files(files)
+    if len(others) > 0:
+        file_ids = await upload_files(others)
 
     return [
         {
             "file_id": file_id,
-            "tools": [{"type": "code_interpreter"}, {"type": "file_search"}] if file.mime in ["application/vnd.openxmlformats-officedocument.wordprocessingml.document", "text/markdown", "application/pdf", "text/plain"] else [{"type": "code_interpreter"}],
+            "tools": [{"type": "code_interpreter"}],
         }
-        for file_id, file in zip(file_ids, files)
+        for file_id in document_ids + file_ids
     ]
 
 
@@ -220,7 +377,7 @@ async def set_starters():
     return [
         cl.Starter(
             label="Run Tesla stock analysis",
-            message="Make a data analysis on the tesla-stock-price.csv file I previously uploaded.",
+            message="Make a data analysis on the tesla-stock-price data I previously uploaded.",
             icon="/public/write.svg",
             ),
         cl.Starter(
@@ -242,6 +399,7 @@ async def start_chat():
     thread = await agents_client.create_thread()
     # Store thread ID in user session for later use
     cl.user_session.set("thread_id", thread.id)
+    await get_session_state().update(session_key_for(cl.context), thread_id=thread.id)
     
     app_user = cl.user_session.get("user")
     await cl.Message(f"Hello {app_user.identifier}").send()
@@ -252,29 +410,161 @@ async def stop_chat():
     current_run_step: RunStep = cl.user_session.get("run_step")
     if current_run_step:
         await agents_client.cancel_run(thread_id=current_run_step.thread_id, run_id=current_run_step.run_id)
+        return
+    # The run was started on another replica, signal it through the shared state
+    session_state = get_session_state()
+    snapshot = await session_state.load(session_key_for(cl.context))
+    if snapshot and snapshot.run_id:
+        await session_state.request_cancel(snapshot.run_id)
+
+
+@cl.on_chat_end
+async def end_chat():
+    # The snapshot only matters while the session is open, don't keep it around until the TTL
+    await get_session_state().delete(session_key_for(cl.context))
+
+
+async def resume_run(thread_id: str) -> None:
+    """Pick up the run a replica that went away was streaming into this thread.
+
+    Waits for the run if it's still going, then shows the part of its answer
+    the user hasn't seen, so the run isn't paid for twice.
+    """
+    checkpoint = await load_checkpoint(thread_id)
+    if not checkpoint:
+        return
+    notice = None
+    if not checkpoint.stale:
+        # The replica that owns it may still be alive, give it time to finish or go quiet
+        notice = await cl.Message(content="Still working on your previous message...").send()
+    checkpointer = await claim_orphaned_run(thread_id)
+    if notice:
+        await notice.remove()
+    if not checkpointer:
+        return
+
+    checkpoint = checkpointer.checkpoint
+    cl.user_session.set("thread_id", checkpoint.agent_thread_id)
+    session_state = get_session_state()
+    session_key = session_key_for(cl.context)
+    await session_state.update(session_key, run_id=checkpoint.run_id, run_thread_id=checkpoint.agent_thread_id)
+    await checkpointer.start()
+    try:
+        async with cl.Step(name="Resuming run", type="run") as step:
+            step.input = checkpoint.run_id
+            run = await agents_client.get_run(thread_id=checkpoint.agent_thread_id, run_id=checkpoint.run_id)
+            async with session_state.watch_cancel(run.id) as wait_for_cancel:
+                while run.status in ACTIVE_RUN_STATUSES:
+                    if await wait_for_cancel(RUN_CHECKPOINT_INTERVAL):
+                        await session_state.clear_cancel(run.id)
+                        await agents_client.cancel_run(thread_id=run.thread_id, run_id=run.id)
+                    run = await agents_client.get_run(thread_id=run.thread_id, run_id=run.id)
+            step.output = f"Run {run.status}"
+
+        if run.status == "failed":
+            error = getattr(run.last_error, "message", None) or "Run failed"
+            await cl.ErrorMessage(content=error).send()
+            return
+
+        # Agent messages of this run, skipping the ones that were shown in full before the restart
+        messages = await agents_client.list_messages(thread_id=run.thread_id, run_id=run.id, order="asc")
+        unseen = [message for message in messages.data if message.role == "assistant"][checkpoint.messages_done:]
+        for index, thread_message in enumerate(unseen):
+            text = "\n\n".join(item.text.value for item in thread_message.content if item.type == "text")
+            if index == 0 and checkpoint.message_id:
+                # Finish the message the text was streaming into rather than adding another one
+                await cl.Message(id=checkpoint.message_id, author=agent.name, content=text).update()
+            else:
+                await cl.Message(author=agent.name, content=text).send()
+    except Exception as e:
+        # The run may have expired server-side, the thread carries on without it
+        print(f"Could not resume run {checkpoint.run_id}: {str(e)}")
+    finally:
+        await checkpointer.finish()
+        await session_state.update(session_key, run_id=None, run_thread_id=None)
+
+
+@cl.on_chat_resume
+async def resume_chat(thread):
+    await resume_run(thread["id"])
 
 
 @cl.on_message
 async def main(message: cl.Message):
+    if message.content.strip() in ("/profile on", "/profile off"):
+        # Opt this session in or out of callback profiling for the following runs
+        enabled = message.content.strip().endswith("on")
+        cl.user_session.set("profile_callbacks", enabled)
+        await cl.Message(content=f"Callback profiling {'enabled' if enabled else 'disabled'}.").send()
+        return
+
+    # A run cut off by a restart is finished first, the thread takes no new message while it's active
+    await resume_run(cl.context.session.thread_id)
+
     thread_id = cl.user_session.get("thread_id")
+    session_state = get_session_state()
+    session_key = session_key_for(cl.context)
+    if not thread_id:
+        # Reconnected to a different replica, pick the thread up from the shared state
+        snapshot = await session_state.load(session_key)
+        if snapshot and snapshot.thread_id:
+            thread_id = snapshot.thread_id
+            cl.user_session.set("thread_id", thread_id)
+
+    admission = get_admission()
+    notify = queued_notifier(lambda text: cl.Message(content=text).send())
+    try:
+        attachments = []
+        if message.elements:
+            upload_size = sum(os.path.getsize(file.path) for file in message.elements if file.path)
+            async with admission.upload(upload_size, on_wait=notify):
+                attachments = await process_files(message.elements, thread_id)
+
+        async with admission.run(user_key_for(cl.context), on_wait=notify):
+            # Add a Message to the Thread
+            thread_message = await agents_client.create_message(
+                thread_id=thread_id,
+                role="user",
+                content=message.content,
+                attachments=attachments,
+            )
 
-    attachments = await process_files(message.elements)
-
-    # Add a Message to the Thread
-    thread_message = await agents_client.create_message(
-        thread_id=thread_id,
-        role="user",
-        content=message.content,
-        attachments=attachments,
-    )
-
-    # Create and Stream a Run
-    async with agents_client.create_stream(
-        thread_id=thread_id,
-        agent_id=agent.id,
-        event_handler=EventHandler(assistant_name=agent.name),
-    ) as stream:
-        await stream.until_done()
+            # Create and Stream a Run
+            event_handler = EventHandler(assistant_name=agent.name)
+            profiler = start_profiling(
+                event_handler,
+                emitter=cl.context.emitter,
+                label=f"{session_key}-{thread_id}",
+                requested=bool(cl.user_session.get("profile_callbacks")),
+            )
+            completed = False
+            try:
+                async with agents_client.create_stream(
+                    thread_id=thread_id,
+                    agent_id=agent.id,
+                    event_handler=event_handler,
+                ) as stream:
+                    await stream.until_done()
+                completed = True
+            except asyncio.CancelledError:
+                # Stopped by the user, the run is cancelled along with the task
+                completed = True
+                raise
+            finally:
+                if event_handler.checkpointer:
+                    # A stream that broke off keeps its checkpoint, the run goes on server-side
+                    await event_handler.checkpointer.finish(delete=completed)
+                if profiler:
+                    profiler.detach()
+                    await asyncio.to_thread(profiler.dump)
+                event_handler.release()
+                run_step: RunStep = cl.user_session.get("run_step")
+                if run_step:
+                    await session_state.clear_cancel(run_step.run_id)
+                cl.user_session.set("run_step", None)
+                await session_state.update(session_key, run_id=None, run_thread_id=None)
+    except AdmissionRejected:
+        await cl.ErrorMessage(content=BUSY_MESSAGE).send()
 
 @cl.oauth_callback
 async def oauth_callback(
@@ -1,11 +1,14 @@
 import os
 import json
+import asyncio
+from typing import Dict, List, Optional
 from dotenv import load_dotenv
 
 
 import chainlit as cl
 from mcp import ClientSession
 
+from openai import AsyncAzureOpenAI
 from semantic_kernel.kernel import Kernel
 from azure.core.credentials import AzureKeyCredential
 
@@ -16,6 +19,7 @@ from semantic_kernel.connectors.ai import FunctionChoiceBehavior
 from semantic_kernel.contents.function_call_content import FunctionCallContent
 from semantic_kernel.contents.function_result_content import FunctionResultContent
 from semantic_kernel.connectors.mcp import MCPStdioPlugin
+from semantic_kernel.filters import FilterTypes
 from semantic_kernel.connectors.ai.open_ai import AzureChatCompletion
 from semantic_kernel.agents import ChatCompletionAgent, ChatHistoryAgentThread, AgentGroupChat
 from semantic_kernel.agents.strategies import (
@@ -24,31 +28,63 @@ from semantic_kernel.agents.strategies import (
 )
 
 from azure.search.documents import SearchClient
-from azure.search.documents.indexes import SearchIndexClient
-from azure.search.documents.indexes.models import SearchIndex, SimpleField, SearchFieldDataType, SearchableField
+
+from rate_limiter import azure_client_options, openai_http_client
+from event_index import EVENT_INDEX_NAME, create_embedder, hybrid_search, multi_query_search, format_event
+
+from session_state import get_session_state, session_key_for
+from tool_cache import tool_cache, cache_tool_invocations, is_tool_error
+from prompt_cache import stable_text, prepare_agent, order_tools, prompt_cache_stats
+from session_memory import IdleSessionEvictor, cap_history
+from admission import get_admission, user_key_for, queued_notifier, AdmissionRejected, BUSY_MESSAGE
+from data_layer import register_data_layer
+from transcript import TranscriptAgent, create_group_chat, cap_transcript
 
 
 # Load environment variables
 load_dotenv()
 
+# Threads moved to blob storage by thread_archive.py are restored when opened
+register_data_layer()
+
 
 # Example Weather Plugin (Tool)
 
         
 
 class RAGPlugin:
-    def __init__(self, search_client):
+    def __init__(self, search_client, embed=None):
         self.search_client = search_client
+        self.embed = embed
 
     @kernel_function(name="search_events", description="Searches for relevant events based on a query")
-    def search_events(self, query: str) -> str:
-        """Retrieves relevant events from Azure Search based on the query."""
+    async def search_events(self, query: str) -> str:
+        """Retrieves relevant event chunks from Azure Search using hybrid (keyword + vector) search."""
         try:
-            results = self.search_client.search(query, top=5)
+            # The search client and embedder are synchronous, keep their requests off the event loop
+            results = await asyncio.to_thread(hybrid_search, self.search_client, query, embed=self.embed, top=5)
             context_strings = []
             for result in results:
                 if 'content' in result:
-                    context_strings.append(f"Event: {result['content']}")
+                    context_strings.append(format_event(result))
+
+            if context_strings:
+                return "\n\n".join(context_strings)
+            else:
+                return "No relevant events found."
+        except Exception as e:
+            return f"Error searching for events: {str(e)}"
+
+    @kernel_function(
+        name="search_events_many",
+        description="Searches for relevant events with several queries at once and returns the merged results",
+    )
+    async def search_events_many(self, queries: List[str]) -> str:
+        """Runs the queries concurrently, merging their hits with reciprocal rank fusion."""
+        try:
+            # The search client is synchronous, keep its requests off the event loop
+            results = await asyncio.to_thread(multi_query_search, self.search_client, queries, embed=self.embed)
+            context_strings = [format_event(result) for result in results if 'content' in result]
 
             if context_strings:
                 return "\n\n".join(context_strings)
@@ -61,81 +97,155 @@ class RAGPlugin:
 # Initialize Azure AI Search with persistent storage
 search_service_endpoint = os.getenv("AZURE_SEARCH_SERVICE_ENDPOINT")
 search_api_key = os.getenv("AZURE_SEARCH_API_KEY")
-index_name = "event-descriptions"
+index_name = EVENT_INDEX_NAME
 
 search_client = SearchClient(
     endpoint=search_service_endpoint,
     index_name=index_name,
-    credential=AzureKeyCredential(search_api_key)
+    credential=AzureKeyCredential(search_api_key),
+    **azure_client_options("search", sync=True)
 )
 
-index_client = SearchIndexClient(
-    endpoint=search_service_endpoint,
-    credential=AzureKeyCredential(search_api_key)
-)
+# The index is filled by event_index.py (see the README), the app only queries it
+embed = create_embedder()
+
+_completion_client = None
+
+
+def create_chat_completion(service_id=None):
+    # One rate-limited client (and connection pool) shared by every session and agent
+    global _completion_client
+    if _completion_client is None:
+        _completion_client = AsyncAzureOpenAI(
+            azure_endpoint=os.getenv("AZURE_OPENAI_ENDPOINT"),
+            api_key=os.getenv("AZURE_OPENAI_API_KEY"),
+            api_version=os.getenv("AZURE_OPENAI_API_VERSION", "2024-06-01"),
+            http_client=openai_http_client(),
+        )
+    return AzureChatCompletion(service_id=service_id, async_client=_completion_client)
+
+
+# Static agent instructions live at module level and are normalized once, so every
+# session sends a byte-identical prefix the provider can serve from its prompt cache
+GITHUB_INSTRUCTIONS = stable_text("""
+You are an expert on GitHub repositories. When answering questions, you **must** use the provided GitHub username to find specific information about that user's repositories, including:
+
+*   Who created the repositories
+*   The programming languages used
+*   Information found in files and README.md files within those repositories
+*   Provide links to each repository referenfced in your answers
+
+**Important:** Never perform general searches for repositories. Always use the given GitHub username to find the relevant information. If a GitHub username is not provided, state that you need a username to proceed.
+""")
+
+HACKATHON_AGENT = stable_text("""
+You are an AI Agent Hackathon Strategist specializing in recommending winning project ideas.
+
+Your task:
+1. Analyze the GitHub activity of users to understand their technical skills
+2. Suggest creative AI Agent projects tailored to their expertise. 
+3. Focus on projects that align with Microsoft's AI Agent Hackathon prize categories
+
+When making recommendations:
+- Base your ideas strictly on the user's GitHub repositories, languages, and tools
+- Give suggestions on tools, languaghes and framweworks to use to build it. 
+- Provide detailed project descriptions including architecture and implementation approach
+- Explain why the project has potential to win in specific prize categories
+- Highlight technical feasibility given the user's demonstrated skills by referencing the specific repositories or languages used.
+
+Formatting your response:
+- Provide a clear and structured response that includes:
+    - Suggested Project Name
+    - Project Description 
+    - Potential languages and tools to use
+    - Link to each relevant GitHub repository you based your recommendation on
+
+Hackathon prize categories:
+- Best Overall Agent ($20,000)
+- Best Agent in Python ($5,000)
+- Best Agent in C# ($5,000)
+- Best Agent in Java ($5,000)
+- Best Agent in JavaScript/TypeScript ($5,000)
+- Best Copilot Agent using Microsoft Copilot Studio or Microsoft 365 Agents SDK ($5,000)
+- Best Azure AI Agent Service Usage ($5,000)
+""")
+
+EVENTS_AGENT = stable_text("""
+You are an Event Recommendation Agent specializing in suggesting relevant tech events.
+
+Your task:
+1. Review the project idea recommended by the Hackathon Agent
+2. Use the search_events function to find relevant events based on the technologies mentioned.
+3. NEVER suggest and event that the where there is not a relevant technology that the user has used.
+3. ONLY recommend events that were returned by the search_events or search_events_many functions
+
+When making recommendations:
+- IMPORTANT: You must first call the search_events function with appropriate technology keywords from the project
+- Only recommend events that were explicitly returned by the search_events function
+- Do not make up or suggest events that weren't in the search results
+- Construct search queries using specific technologies mentioned (e.g., "Python AI workshop" or "JavaScript hackathon")
+- To search with several queries, pass them all in one search_events_many call instead of calling search_events for each
+
+
+For each recommended event:
+- Only include events found in the search_events results
+- Explain the direct connection between the event and the specific project requirements
+- Highlight relevant workshops, sessions, or networking opportunities
+
+Formatting your response:
+- Start with "Based on the hackathon project idea, here are relevant events that I found:"
+- Only list events that were returned by the search_events function
+- For each event, include the exact event details as returned by search_events
+- Explain specifically how each event relates to the project technologies
+
+If no relevant events are found, acknowledge this and suggest trying different search terms instead of making up events.
+""")
 
-# Define the index schema
-fields = [
-    SimpleField(name="id", type=SearchFieldDataType.String, key=True),
-    SearchableField(name="content", type=SearchFieldDataType.String)
-]
-
-index = SearchIndex(name=index_name, fields=fields)
-
-# Check if index already exists if not, create it
-try:
-    existing_index = index_client.get_index(index_name)
-    print(f"Index '{index_name}' already exists, using the existing index.")
-except Exception as e:
-    # Create the index if it doesn't exist
-    print(f"Creating new index '{index_name}'...")
-    index_client.create_index(index)
-
-# Always read event descriptions from markdown file
-with open("event-descriptions.md", "r") as f:
-    markdown_content = f.read()
-
-# Split the markdown content into individual event descriptions
-event_descriptions = markdown_content.split("---")  # You can change the delimiter
-
-# Create documents for Azure Search
-documents = []
-for i, description in enumerate(event_descriptions):
-    description = description.strip()  # Remove leading/trailing whitespace
-    if description:  # Avoid empty descriptions
-        documents.append({"id": str(i + 1), "content": description})
-
-# Add documents to the index (only if we have documents)
-if documents:
-    # Delete existing documents first to avoid duplicates
-    try:
-        search_client.delete_documents(documents=[{"id": doc["id"]} for doc in documents])
-        print("Cleared existing documents")
-    except Exception as e:
-        print(f"Warning: Failed to clear existing documents: {str(e)}")
-    
-    # Upload new documents
-    search_client.upload_documents(documents)
-    print(f"Uploaded {len(documents)} documents to index")
 
 def flatten(xss):
     return [x for xs in xss for x in xs]
 
 
-@cl.on_mcp_connect
-async def on_mcp(connection, session: ClientSession):
+async def list_mcp_tools(session: ClientSession) -> List[dict]:
     result = await session.list_tools()
-    tools = [{
+    return [{
         "name": t.name,
         "description": t.description,
         "input_schema": t.inputSchema,
     } for t in result.tools]
 
+
+async def refresh_mcp_tools() -> Dict[str, List[dict]]:
+    """Re-list the tools of the MCP connections open in this session.
+
+    MCP connections live in the websocket session of one replica and are never
+    taken from a snapshot: on a new replica the browser connects its servers
+    again and each connection is listed here or in on_mcp.
+    """
+    mcp_tools = {}
+    for name, (session, _) in list(cl.context.session.mcp_sessions.items()):
+        try:
+            mcp_tools[name] = await list_mcp_tools(session)
+        except Exception as e:
+            print(f"Could not list the tools of MCP {name}: {str(e)}")
+    cl.user_session.set("mcp_tools", mcp_tools)
+    return mcp_tools
+
+
+@cl.on_mcp_connect
+async def on_mcp(connection, session: ClientSession):
     mcp_tools = cl.user_session.get("mcp_tools", {})
-    mcp_tools[connection.name] = tools
+    mcp_tools[connection.name] = await list_mcp_tools(session)
     cl.user_session.set("mcp_tools", mcp_tools)
 
 
+def find_mcp_connection(mcp_tools: Dict[str, List[dict]], tool_name: str) -> Optional[str]:
+    for connection_name, tools in mcp_tools.items():
+        if any(tool.get("name") == tool_name for tool in tools):
+            return connection_name
+    return None
+
+
 @cl.step(type="tool")
 async def call_tool(tool_use):
     tool_name = tool_use.name
@@ -144,21 +254,17 @@ async def call_tool(tool_use):
     current_step = cl.context.current_step
     current_step.name = tool_name
 
-    # Identify which mcp is used
-    mcp_tools = cl.user_session.get("mcp_tools", {})
-    mcp_name = None
-
-    for connection_name, tools in mcp_tools.items():
-        if any(tool.get("name") == tool_name for tool in tools):
-            mcp_name = connection_name
-            break
+    # Identify which mcp is used, listing the open connections again if the tool is unknown
+    mcp_name = find_mcp_connection(cl.user_session.get("mcp_tools", {}), tool_name)
+    if not mcp_name:
+        mcp_name = find_mcp_connection(await refresh_mcp_tools(), tool_name)
 
     if not mcp_name:
         current_step.output = json.dumps(
             {"error": f"Tool {tool_name} not found in any MCP connection"})
         return current_step.output
 
-    mcp_session, _ = cl.context.session.mcp_sessions.get(mcp_name)
+    mcp_session, _ = cl.context.session.mcp_sessions.get(mcp_name, (None, None))
 
     if not mcp_session:
         current_step.output = json.dumps(
@@ -166,7 +272,14 @@ async def call_tool(tool_use):
         return current_step.output
 
     try:
-        current_step.output = await mcp_session.call_tool(tool_name, tool_input)
+        # Read-only tools are served from the shared cache to spare the GitHub rate limit
+        current_step.output = await tool_cache.get_or_call(
+            mcp_name,
+            tool_name,
+            tool_input,
+            lambda: mcp_session.call_tool(tool_name, tool_input),
+            should_cache=lambda result: result is not None and not is_tool_error(result),
+        )
     except Exception as e:
         current_step.output = json.dumps({"error": str(e)})
 
@@ -175,7 +288,11 @@ async def call_tool(tool_use):
 
 @cl.on_chat_start
 async def on_chat_start():
- 
+    await build_session()
+    session_evictor.touch(cl.context.session.id, session_key_for(cl.context))
+
+
+async def build_session():
     # Create kernel
     kernel = Kernel()
 
@@ -191,7 +308,7 @@ async def on_chat_start():
 
     sk_filter = cl.SemanticKernelFilter(kernel=kernel)
 
-    kernel.add_service(AzureChatCompletion(service_id=service_id))
+    kernel.add_service(create_chat_completion(service_id=service_id))
     settings = kernel.get_prompt_execution_settings_from_service_id(
         service_id=service_id)
     settings.function_choice_behavior = FunctionChoiceBehavior.Auto()
@@ -199,7 +316,7 @@ async def on_chat_start():
  
 
     # Create a properly instantiated RAGPlugin
-    rag_plugin = RAGPlugin(search_client)
+    rag_plugin = RAGPlugin(search_client, embed=embed)
 
     # Add to kernel
     kernel.add_plugin(rag_plugin, plugin_name="RAG")
@@ -207,8 +324,12 @@ async def on_chat_start():
     # Store in session
     cl.user_session.set("rag_plugin", rag_plugin)
 
-    # Add GitHub MCP plugin
+    # Add GitHub MCP plugin, each one is a Node process so the replica caps how many run at once
+    github_plugin = None
     try:
+        await get_admission().acquire_mcp()
+        cl.user_session.set("mcp_admitted", True)
+
         # Create GitHub MCP plugin using MCPStdioPlugin
         github_plugin = MCPStdioPlugin(
             name="Github",
@@ -222,145 +343,139 @@ async def on_chat_start():
 
         # Add the plugin to the kernel
         kernel.add_plugin(github_plugin)
+        kernel.add_filter(FilterTypes.FUNCTION_INVOCATION, cache_tool_invocations)
 
         # Store the plugin in user session for cleanup later
         cl.user_session.set("github_plugin", github_plugin)
 
         print("GitHub plugin added successfully")
+    except AdmissionRejected:
+        await cl.Message(content="GitHub tools are unavailable right now because the server is busy, other features still work.").send()
     except Exception as e:
         print(f"Error adding GitHub plugin: {str(e)}")
+        github_plugin = None
+        if cl.user_session.get("mcp_admitted"):
+            get_admission().release_mcp()
+            cl.user_session.set("mcp_admitted", False)
 
-    GITHUB_INSTRUCTIONS = """
-You are an expert on GitHub repositories. When answering questions, you **must** use the provided GitHub username to find specific information about that user's repositories, including:
-
-*   Who created the repositories
-*   The programming languages used
-*   Information found in files and README.md files within those repositories
-*   Provide links to each repository referenfced in your answers
-
-**Important:** Never perform general searches for repositories. Always use the given GitHub username to find the relevant information. If a GitHub username is not provided, state that you need a username to proceed.
-    """
-
-    HACKATHON_AGENT = """
-You are an AI Agent Hackathon Strategist specializing in recommending winning project ideas.
-
-Your task:
-1. Analyze the GitHub activity of users to understand their technical skills
-2. Suggest creative AI Agent projects tailored to their expertise. 
-3. Focus on projects that align with Microsoft's AI Agent Hackathon prize categories
-
-When making recommendations:
-- Base your ideas strictly on the user's GitHub repositories, languages, and tools
-- Give suggestions on tools, languaghes and framweworks to use to build it. 
-- Provide detailed project descriptions including architecture and implementation approach
-- Explain why the project has potential to win in specific prize categories
-- Highlight technical feasibility given the user's demonstrated skills by referencing the specific repositories or languages used.
-
-Formatting your response:
-- Provide a clear and structured response that includes:
-    - Suggested Project Name
-    - Project Description 
-    - Potential languages and tools to use
-    - Link to each relevant GitHub repository you based your recommendation on
-
-Hackathon prize categories:
-- Best Overall Agent ($20,000)
-- Best Agent in Python ($5,000)
-- Best Agent in C# ($5,000)
-- Best Agent in Java ($5,000)
-- Best Agent in JavaScript/TypeScript ($5,000)
-- Best Copilot Agent using Microsoft Copilot Studio or Microsoft 365 Agents SDK ($5,000)
-- Best Azure AI Agent Service Usage ($5,000)
-        
-"""
-
-    EVENTS_AGENT = """
-You are an Event Recommendation Agent specializing in suggesting relevant tech events.
 
-Your task:
-1. Review the project idea recommended by the Hackathon Agent
-2. Use the search_events function to find relevant events based on the technologies mentioned.
-3. NEVER suggest and event that the where there is not a relevant technology that the user has used.
-3. ONLY recommend events that were returned by the search_events functionf
-
-When making recommendations:
-- IMPORTANT: You must first call the search_events function with appropriate technology keywords from the project
-- Only recommend events that were explicitly returned by the search_events function
-- Do not make up or suggest events that weren't in the search results
-- Construct search queries using specific technologies mentioned (e.g., "Python AI workshop" or "JavaScript hackathon")
-- Try multiple search queries if needed to find the most relevant events
-
-
-For each recommended event:
-- Only include events found in the search_events results
-- Explain the direct connection between the event and the specific project requirements
-- Highlight relevant workshops, sessions, or networking opportunities
-
-Formatting your response:
-- Start with "Based on the hackathon project idea, here are relevant events that I found:"
-- Only list events that were returned by the search_events function
-- For each event, include the exact event details as returned by search_events
-- Explain specifically how each event relates to the project technologies
-
-If no relevant events are found, acknowledge this and suggest trying different search terms instead of making up events.
-"""
+    # Restore the chat history if this session was started on another replica
+    snapshot = await get_session_state().load(session_key_for(cl.context))
+    if snapshot and snapshot.chat_history:
+        chat_history = ChatHistory.restore_chat_history(snapshot.chat_history)
+    else:
+        # Create a new chat history
+        chat_history = ChatHistory()
 
-    github_agent = ChatCompletionAgent(
-        service=AzureChatCompletion(),
+    # Transcript agents share the messages of the group chat instead of copying them
+    github_agent = TranscriptAgent(
+        service=create_chat_completion(),
         name="GithubAgent",
         instructions=GITHUB_INSTRUCTIONS,
-        plugins=[github_plugin]
+        plugins=[github_plugin] if github_plugin else []
     )
 
-    hackathon_agent = ChatCompletionAgent(
-        service=AzureChatCompletion(),
+    hackathon_agent = TranscriptAgent(
+        service=create_chat_completion(),
         name="HackathonAgent",
         instructions=HACKATHON_AGENT
     )
 
-    events_agent = ChatCompletionAgent(
-        service=AzureChatCompletion(),
+    events_agent = TranscriptAgent(
+        service=create_chat_completion(),
         name="EventsAgent",
         instructions=EVENTS_AGENT,
         plugins=[rag_plugin]  # Add the plugin here
     )
 
-    # Create the agent group chat
-    agent_group_chat = AgentGroupChat(
+    github_agent.kernel.add_filter(FilterTypes.FUNCTION_INVOCATION, cache_tool_invocations)
+
+    # Same tool order in every session so instructions + tool schemas form a cacheable prefix
+    for agent in (github_agent, hackathon_agent, events_agent):
+        prepare_agent(agent)
+    order_tools(kernel)
+
+    # Create the agent group chat, it records its messages in the session's chat history
+    agent_group_chat = create_group_chat(
+        chat_history,
         agents=[github_agent, hackathon_agent, events_agent],
         selection_strategy=SequentialSelectionStrategy(
             initial_agent=github_agent),
         termination_strategy=DefaultTerminationStrategy(maximum_iterations=3)
     )
 
-    # Create a new chat history
-    chat_history = ChatHistory()
-
     # Store in user session
     cl.user_session.set("kernel", kernel)
     cl.user_session.set("settings", settings)  # Store settings in session
-    cl.user_session.set("chat_completion_service", AzureChatCompletion())
+    cl.user_session.set("chat_completion_service", create_chat_completion())
     cl.user_session.set("chat_history", chat_history)
-    cl.user_session.set("mcp_tools", {})
+    await refresh_mcp_tools()
     # Store the agent group chat
     cl.user_session.set("agent_group_chat", agent_group_chat)
 
 
-# Add a cleanup handler for when the session ends
-@cl.on_chat_end
-async def on_chat_end():
+async def release_session_objects(objects: Dict):
     # Get the GitHub plugin if it exists
-    github_plugin = cl.user_session.get("github_plugin")
+    github_plugin = objects.get("github_plugin")
     if github_plugin:
         try:
             await github_plugin.close()
             print("GitHub plugin closed successfully")
         except Exception as e:
             print(f"Error closing GitHub plugin: {str(e)}")
+    if objects.get("mcp_admitted"):
+        get_admission().release_mcp()
+
+
+# Kernels, agents, the GitHub MCP process and the snapshot of idle chats are released, the session is rebuilt on its next message
+session_evictor = IdleSessionEvictor(
+    heavy_keys=["kernel", "settings", "chat_completion_service", "chat_history", "agent_group_chat", "rag_plugin", "github_plugin", "mcp_admitted"],
+    close=release_session_objects,
+    session_state=get_session_state(),
+)
+
+
+# Add a cleanup handler for when the session ends
+@cl.on_chat_end
+async def on_chat_end():
+    session_evictor.forget(cl.context.session.id)
+    await release_session_objects({
+        "github_plugin": cl.user_session.get("github_plugin"),
+        "mcp_admitted": cl.user_session.get("mcp_admitted"),
+    })
+    cl.user_session.set("mcp_admitted", False)
+    # The snapshot only matters while the session is open, don't keep it around until the TTL
+    await get_session_state().delete(session_key_for(cl.context))
+
+
+async def save_chat_history(chat_history: ChatHistory, agent_group_chat: Optional[AgentGroupChat] = None):
+    # Keep the history bounded, then persist it so any replica can continue the conversation
+    removed = cap_transcript(agent_group_chat) if agent_group_chat else cap_history(chat_history)
+    if removed:
+        print(f"Trimmed {removed} old messages from the chat history")
+    await get_session_state().update(session_key_for(cl.context), chat_history=chat_history.serialize())
+
+
+PROCESSING_MESSAGE = "Processing your request using GitHub, Hackathon and Events agents...\n\n"
 
 
 @cl.on_message
 async def on_message(message: cl.Message):
+    # Queue behind other runs on this replica and this user's previous message
+    notify = queued_notifier(lambda text: cl.Message(content=text).send())
+    try:
+        async with get_admission().run(user_key_for(cl.context), on_wait=notify):
+            await respond(message)
+    except AdmissionRejected:
+        await cl.ErrorMessage(content=BUSY_MESSAGE).send()
+
+
+async def respond(message: cl.Message):
+    if cl.user_session.get("kernel") is None:
+        # Evicted while idle, rebuild from the shared session state
+        await build_session()
+    session_evictor.touch(cl.context.session.id, session_key_for(cl.context))
+
     kernel = cl.user_session.get("kernel")
     chat_completion_service = cl.user_session.get("chat_completion_service")
     chat_history = cl.user_session.get("chat_history")
@@ -374,30 +489,22 @@ async def on_message(message: cl.Message):
     if "recommend" and "github" in user_input:
         sk_filter = cl.SemanticKernelFilter(kernel=kernel)
 
-        # Add user message to chat history
-        chat_history.add_user_message(message.content)
-
-        # Add user message to the agent group chat's channel
+        # The group chat records the user message and each agent's reply in chat_history
         await agent_group_chat.add_chat_message(message.content)
 
         # Create message for response stream - USE ONLY ONE MESSAGE OBJECT
-        answer = cl.Message(content="Processing your request using GitHub, Hackathon and Events agents...\n\n")
+        answer = cl.Message(content=PROCESSING_MESSAGE)
         await answer.send()
 
-        agent_responses = []
         async for content in agent_group_chat.invoke():
             agent_name = content.name or "Agent"
-            response = f"**{agent_name}**: {content.content}"
-            agent_responses.append(response)
-            await answer.stream_token(f"{response}\n\n")
-
-        # Add the full agent responses to chat history
-        full_response = "\n\n".join(agent_responses)
-        chat_history.add_assistant_message(full_response)
+            prompt_cache_stats.record(agent_name, content)
+            await answer.stream_token(f"**{agent_name}**: {content.content}\n\n")
 
-        # Update the message with all responses
-        answer.content = full_response
+        # Keep the streamed replies, without the progress line
+        answer.content = answer.content[len(PROCESSING_MESSAGE):].rstrip()
         await answer.update()
+        await save_chat_history(chat_history, agent_group_chat)
     else:
         # Regular processing for other messages
         # Add user message to history
@@ -414,6 +521,8 @@ async def on_message(message: cl.Message):
         ):
             if msg.content:
                 await answer.stream_token(msg.content)
+            # Usage arrives on the final chunk of the stream
+            prompt_cache_stats.record("Kernel", msg)
             # Handle function calls if they occur
             if isinstance(msg, FunctionCallContent):
                 function_name = msg.function_name
@@ -427,4 +536,5 @@ async def on_message(message: cl.Message):
         chat_history.add_assistant_message(answer.content)
 
         # Send the final message
-        await answer.send()
\ No newline at end of file
+        await answer.send()
+        await save_chat_history(chat_history)
\ No newline at end of file
@@ -0,0 +1,107 @@
+"""Memory of the multi-agent transcript over a long session, before and after transcript.py.
+
+Runs the hackathon group chat of app_mcp_server.py against a canned chat
+completion service, so no model is called:
+
+    python benchmark_transcript.py --turns 200 --reply-kb 3
+"""
+import gc
+import asyncio
+import argparse
+import tracemalloc
+from typing import List
+
+from semantic_kernel.agents import AgentGroupChat, ChatCompletionAgent
+from semantic_kernel.agents.strategies import DefaultTerminationStrategy, SequentialSelectionStrategy
+from semantic_kernel.connectors.ai.chat_completion_client_base import ChatCompletionClientBase
+from semantic_kernel.contents import AuthorRole, ChatHistory, ChatMessageContent
+
+from session_memory import cap_history
+from transcript import TranscriptAgent, cap_transcript, create_group_chat
+
+AGENTS = ["GithubAgent", "HackathonAgent", "EventsAgent"]
+
+
+class CannedCompletion(ChatCompletionClientBase):
+    """Answers every request with a distinct reply of a fixed size."""
+
+    reply_bytes: int = 3072
+    calls: int = 0
+    last_prompt_messages: int = 0
+
+    async def _inner_get_chat_message_contents(self, chat_history, settings) -> List[ChatMessageContent]:
+        self.calls += 1
+        self.last_prompt_messages = len(chat_history.messages)
+        text = f"Reply {self.calls}. " + "lorem ipsum " * (self.reply_bytes // 12)
+        return [ChatMessageContent(role=AuthorRole.ASSISTANT, content=text)]
+
+
+def _group(agent_class, service, chat_history=None) -> AgentGroupChat:
+    agents = [agent_class(service=service, name=name, instructions=f"You are {name}.") for name in AGENTS]
+    kwargs = dict(
+        agents=agents,
+        selection_strategy=SequentialSelectionStrategy(initial_agent=agents[0]),
+        termination_strategy=DefaultTerminationStrategy(maximum_iterations=3),
+    )
+    return create_group_chat(chat_history, **kwargs) if chat_history is not None else AgentGroupChat(**kwargs)
+
+
+async def previous_turn(chat_history: ChatHistory, group_chat: AgentGroupChat, question: str) -> None:
+    # The hackathon branch of on_message before transcript.py
+    chat_history.add_user_message(question)
+    await group_chat.add_chat_message(question)
+    content = "Processing your request using GitHub, Hackathon and Events agents...\n\n"
+    agent_responses = []
+    async for message in group_chat.invoke():
+        response = f"**{message.name}**: {message.content}"
+        agent_responses.append(response)
+        content += f"{response}\n\n"
+    full_response = "\n\n".join(agent_responses)
+    chat_history.add_assistant_message(full_response)
+    content = full_response
+    cap_history(chat_history)
+
+
+async def transcript_turn(chat_history: ChatHistory, group_chat: AgentGroupChat, question: str) -> None:
+    await group_chat.add_chat_message(question)
+    content = "Processing your request using GitHub, Hackathon and Events agents...\n\n"
+    async for message in group_chat.invoke():
+        content += f"**{message.name}**: {message.content}\n\n"
+    cap_transcript(group_chat)
+
+
+async def run(label: str, turns: int, reply_kb: float, checkpoints: List[int]) -> None:
+    service = CannedCompletion(ai_model_id="canned", reply_bytes=int(reply_kb * 1024))
+    chat_history = ChatHistory()
+    if label == "previous":
+        group_chat, turn = _group(ChatCompletionAgent, service), previous_turn
+    else:
+        group_chat, turn = _group(TranscriptAgent, service, chat_history), transcript_turn
+
+    gc.collect()
+    tracemalloc.start()
+    baseline = tracemalloc.get_traced_memory()[0]
+    for index in range(1, turns + 1):
+        await turn(chat_history, group_chat, f"Question {index}: recommend a project for github user octocat")
+        if index in checkpoints:
+            gc.collect()
+            current = tracemalloc.get_traced_memory()[0] - baseline
+            channel_messages = sum(len(channel.messages) for channel in group_chat.agent_channels.values())
+            print(f"  {label:<10} turn {index:>4}: {current / 1024:9.0f} KB   "
+                  f"{len(group_chat.history.messages):>4} group chat + {len(chat_history.messages):>4} session + "
+                  f"{channel_messages:>4} channel messages, last prompt {service.last_prompt_messages:>4} messages")
+    tracemalloc.stop()
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark the memory of the multi-agent transcript")
+    parser.add_argument("--turns", type=int, default=200)
+    parser.add_argument("--reply-kb", type=float, default=3, help="Size of each agent reply")
+    args = parser.parse_args()
+    checkpoints = sorted({t for t in (1, 10, 25, 50, 100, 200, 500, args.turns) if t <= args.turns})
+    for label in ("previous", "transcript"):
+        await run(label, args.turns, args.reply_kb, checkpoints)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
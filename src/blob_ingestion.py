@@ -0,0 +1,429 @@
+"""Keeps the product docs search index in sync with a blob container.
+
+    python blob_ingestion.py            # poll forever
+    python blob_ingestion.py --once     # one sync pass, e.g. after uploading docs
+    python blob_ingestion.py --dry-run  # extract and chunk only, print what would be indexed
+"""
+from dotenv import load_dotenv
+load_dotenv()
+
+import os
+import io
+import re
+import json
+import time
+import asyncio
+import hashlib
+import argparse
+from dataclasses import dataclass, field
+from html.parser import HTMLParser
+from typing import Dict, List, Optional
+
+from azure.core import MatchConditions
+from azure.core.credentials import AzureKeyCredential
+from azure.core.exceptions import ResourceNotFoundError
+from azure.storage.blob.aio import ContainerClient
+from azure.search.documents.aio import SearchClient
+from azure.search.documents.indexes.aio import SearchIndexClient
+from azure.search.documents.indexes.models import (
+    SearchIndex,
+    SimpleField,
+    SearchField,
+    SearchableField,
+    SearchFieldDataType,
+    VectorSearch,
+    VectorSearchProfile,
+    HnswAlgorithmConfiguration,
+)
+
+from rate_limiter import Priority, azure_client_options
+from element_storage import AZURITE_CONNECTION_STRING
+from event_index import (
+    EMBEDDING_DIMENSIONS,
+    EMBEDDING_BATCH_SIZE,
+    CHUNK_MAX_TOKENS,
+    CHUNK_OVERLAP_TOKENS,
+    _split_headings,
+    _split_token_window,
+    _batches,
+    create_embedder,
+)
+
+# PDF extraction is optional - PDFs are skipped when pypdf isn't installed
+try:
+    from pypdf import PdfReader
+except ImportError:
+    PdfReader = None
+
+BLOB_CONNECTION_STRING = os.getenv("BLOB_INGESTION_CONNECTION_STRING") or AZURITE_CONNECTION_STRING
+BLOB_CONTAINER = os.getenv("BLOB_INGESTION_CONTAINER", "my-container")
+# A dedicated index: azureblob-index is built by the portal's indexer, keyed and shaped differently
+INDEX_NAME = os.getenv("BLOB_INGESTION_INDEX", "product-docs")
+POLL_INTERVAL = float(os.getenv("BLOB_INGESTION_POLL_SECONDS", "5"))
+CONCURRENCY = int(os.getenv("BLOB_INGESTION_CONCURRENCY", "8"))
+INDEX_BATCH_SIZE = int(os.getenv("BLOB_INGESTION_BATCH_SIZE", "500"))
+MAX_BLOB_MB = int(os.getenv("BLOB_INGESTION_MAX_BLOB_MB", "50"))
+CURSOR_PATH = os.getenv("BLOB_INGESTION_CURSOR", ".blob-ingestion-cursor.json")
+
+VECTOR_FIELD = "content_vector"
+VECTOR_PROFILE = "docs-vector-profile"
+TEXT_EXTENSIONS = [".md", ".txt", ".json", ".csv"]
+HTML_EXTENSIONS = [".html", ".htm"]
+
+
+@dataclass
+class DocChunk:
+    id: str
+    source: str
+    title: str
+    content: str
+    url: str
+    last_modified: str
+    content_vector: Optional[List[float]] = None
+
+    def to_document(self) -> Dict:
+        document = {
+            "id": self.id,
+            "source": self.source,
+            "title": self.title,
+            "content": self.content,
+            "url": self.url,
+            "last_modified": self.last_modified,
+        }
+        if self.content_vector is not None:
+            document[VECTOR_FIELD] = self.content_vector
+        return document
+
+
+@dataclass
+class BlobChange:
+    name: str
+    etag: str
+    url: str
+    last_modified: str
+
+
+@dataclass
+class BlobUpdate:
+    """Index writes for one blob and the cursor entry they bring, committed together."""
+    uploads: List[Dict]
+    deletes: List[str]
+    # None when the blob was deleted
+    entry: Optional[Dict]
+
+
+@dataclass
+class Cursor:
+    """Last indexed etag and chunk ids per blob, persisted between passes."""
+    blobs: Dict[str, Dict] = field(default_factory=dict)
+
+    @classmethod
+    def load(cls, path: str) -> "Cursor":
+        if not os.path.exists(path):
+            return cls()
+        with open(path, "r", encoding="utf-8") as f:
+            return cls(blobs=json.load(f).get("blobs", {}))
+
+    def save(self, path: str) -> None:
+        # Write then rename so a crash never leaves a truncated cursor
+        temp_path = f"{path}.tmp"
+        with open(temp_path, "w", encoding="utf-8") as f:
+            json.dump({"blobs": self.blobs}, f)
+        os.replace(temp_path, path)
+
+
+class _TextExtractor(HTMLParser):
+    def __init__(self) -> None:
+        super().__init__()
+        self.parts: List[str] = []
+        self._skip = 0
+
+    def handle_starttag(self, tag, attrs):
+        if tag in ("script", "style"):
+            self._skip += 1
+        elif re.fullmatch(r"h[1-6]", tag):
+            self.parts.append("\n" + "#" * int(tag[1]) + " ")
+
+    def handle_endtag(self, tag):
+        if tag in ("script", "style") and self._skip:
+            self._skip -= 1
+        elif tag in ("p", "div", "li", "br", "tr") or re.fullmatch(r"h[1-6]", tag):
+            self.parts.append("\n")
+
+    def handle_data(self, data):
+        if not self._skip:
+            self.parts.append(data)
+
+
+def extract_text(name: str, data: bytes) -> Optional[str]:
+    """Plain text of a blob, None for formats we don't index."""
+    extension = os.path.splitext(name)[1].lower()
+    if extension in TEXT_EXTENSIONS:
+        return data.decode("utf-8", errors="replace")
+    if extension in HTML_EXTENSIONS:
+        parser = _TextExtractor()
+        parser.feed(data.decode("utf-8", errors="replace"))
+        return "".join(parser.parts)
+    if extension == ".pdf" and PdfReader:
+        reader = PdfReader(io.BytesIO(data))
+        return "\n\n".join(page.extract_text() or "" for page in reader.pages)
+    return None
+
+
+def chunk_document(change: BlobChange, text: str, max_tokens: int = CHUNK_MAX_TOKENS, overlap: int = CHUNK_OVERLAP_TOKENS) -> List[DocChunk]:
+    """Chunk by heading, then token window, the same way the events index is chunked."""
+    default_title = os.path.splitext(os.path.basename(change.name))[0]
+    chunks = []
+    for title, body in _split_headings(text):
+        for window in _split_token_window(body.strip(), max_tokens, overlap):
+            if not window:
+                continue
+            chunk_id = hashlib.sha1(f"{change.name}:{window}".encode("utf-8")).hexdigest()[:32]
+            chunks.append(DocChunk(
+                id=chunk_id,
+                source=change.name,
+                title=title or default_title,
+                content=window,
+                url=change.url,
+                last_modified=change.last_modified,
+            ))
+    return chunks
+
+
+def build_docs_index(index_name: str, dimensions: int = EMBEDDING_DIMENSIONS) -> SearchIndex:
+    fields = [
+        SimpleField(name="id", type=SearchFieldDataType.String, key=True),
+        SimpleField(name="source", type=SearchFieldDataType.String, filterable=True),
+        SearchableField(name="title", type=SearchFieldDataType.String),
+        SearchableField(name="content", type=SearchFieldDataType.String),
+        SimpleField(name="url", type=SearchFieldDataType.String),
+        SimpleField(name="last_modified", type=SearchFieldDataType.String, filterable=True, sortable=True),
+        SearchField(
+            name=VECTOR_FIELD,
+            type=SearchFieldDataType.Collection(SearchFieldDataType.Single),
+            searchable=True,
+            vector_search_dimensions=dimensions,
+            vector_search_profile_name=VECTOR_PROFILE,
+        ),
+    ]
+    vector_search = VectorSearch(
+        algorithms=[HnswAlgorithmConfiguration(name="docs-hnsw")],
+        profiles=[VectorSearchProfile(name=VECTOR_PROFILE, algorithm_configuration_name="docs-hnsw")],
+    )
+    return SearchIndex(name=index_name, fields=fields, vector_search=vector_search)
+
+
+class BlobIngestionWorker:
+    """Polls a container, re-indexes new or changed blobs and removes deleted ones.
+
+    Blob etags in the cursor are the change marker, so each pass only downloads
+    what changed since the last one. Index writes are batched across blobs, and
+    a blob's new etag only reaches the cursor once its writes succeeded.
+    """
+
+    def __init__(self, container_client: ContainerClient, search_client: Optional[SearchClient], embed=None, cursor_path: str = CURSOR_PATH, concurrency: int = CONCURRENCY) -> None:
+        self.container_client = container_client
+        self.search_client = search_client
+        self.embed = embed
+        self.cursor_path = cursor_path
+        self.cursor = Cursor.load(cursor_path)
+        self.semaphore = asyncio.Semaphore(concurrency)
+        # Blobs whose index writes haven't been sent yet
+        self._staged: Dict[str, BlobUpdate] = {}
+
+    async def list_changes(self):
+        changed, seen = [], set()
+        async for blob in self.container_client.list_blobs():
+            seen.add(blob.name)
+            known = self.cursor.blobs.get(blob.name)
+            if known and known["etag"] == blob.etag:
+                continue
+            if blob.size > MAX_BLOB_MB * 1024 * 1024:
+                print(f"Skipping {blob.name}: {blob.size} bytes is over the {MAX_BLOB_MB} MB limit")
+                continue
+            changed.append(BlobChange(
+                name=blob.name,
+                etag=blob.etag,
+                url=f"{self.container_client.url}/{blob.name}",
+                last_modified=blob.last_modified.isoformat() if blob.last_modified else "",
+            ))
+        deleted = [name for name in self.cursor.blobs if name not in seen]
+        return changed, deleted
+
+    async def process(self, change: BlobChange) -> None:
+        async with self.semaphore:
+            # Pin the listed version, if it changed meanwhile the next pass picks up the new one
+            downloader = await self.container_client.download_blob(
+                change.name, etag=change.etag, match_condition=MatchConditions.IfNotModified
+            )
+            data = await downloader.readall()
+            text = await asyncio.to_thread(extract_text, change.name, data)
+            chunks = await asyncio.to_thread(chunk_document, change, text) if text else []
+            if chunks and self.embed:
+                vectors = []
+                for batch in _batches(chunks, EMBEDDING_BATCH_SIZE):
+                    vectors += await asyncio.to_thread(self.embed, [f"{chunk.title}\n{chunk.content}" for chunk in batch])
+                for chunk, vector in zip(chunks, vectors):
+                    chunk.content_vector = vector
+
+        # Chunk ids are content hashes, only chunks that changed need writing or deleting
+        previous = set(self.cursor.blobs.get(change.name, {}).get("chunks", []))
+        current = {chunk.id for chunk in chunks}
+        self._staged[change.name] = BlobUpdate(
+            uploads=[chunk.to_document() for chunk in chunks if chunk.id not in previous],
+            deletes=list(previous - current),
+            entry={"etag": change.etag, "chunks": sorted(current)},
+        )
+        if text is None:
+            print(f"Skipping {change.name}: unsupported format")
+        await self.flush(partial=True)
+
+    async def flush(self, partial: bool = False) -> None:
+        """Push buffered index updates, waiting for a full batch unless `partial` is False.
+
+        The cursor takes the blobs' new etags only after their writes went
+        through. If a write fails the updates stay buffered for the next flush,
+        and as the cursor still has the old etags the blobs are listed again
+        on the next pass.
+        """
+        pending = sum(len(update.uploads) + len(update.deletes) for update in self._staged.values())
+        if partial and pending < INDEX_BATCH_SIZE:
+            return
+        staged, self._staged = self._staged, {}
+        uploads = [document for update in staged.values() for document in update.uploads]
+        deletes = [doc_id for update in staged.values() for doc_id in update.deletes]
+        try:
+            if self.search_client is None:
+                for document in uploads:
+                    print(f"[dry run] {document['source']}: {document['title']} ({len(document['content'])} chars)")
+            else:
+                # Deleting or re-uploading the same ids again is harmless, so a retry after a partial write is safe
+                for batch in _batches(deletes, INDEX_BATCH_SIZE):
+                    await self.search_client.delete_documents(documents=[{"id": doc_id} for doc_id in batch])
+                for batch in _batches(uploads, INDEX_BATCH_SIZE):
+                    await self.search_client.merge_or_upload_documents(documents=batch)
+        except BaseException:
+            # A blob processed again meanwhile has newer updates, keep those
+            for name, update in staged.items():
+                self._staged.setdefault(name, update)
+            raise
+        for name, update in staged.items():
+            if update.entry is None:
+                self.cursor.blobs.pop(name, None)
+            else:
+                self.cursor.blobs[name] = update.entry
+
+    async def sync_once(self) -> Dict:
+        start = time.perf_counter()
+        changed, deleted = await self.list_changes()
+        for name in deleted:
+            self._staged[name] = BlobUpdate(uploads=[], deletes=self.cursor.blobs[name].get("chunks", []), entry=None)
+
+        results = await asyncio.gather(*[self.process(change) for change in changed], return_exceptions=True)
+        failed = 0
+        for change, result in zip(changed, results):
+            if isinstance(result, Exception):
+                failed += 1
+                # Nothing of the blob reached the cursor, so it is listed as changed again on the next pass
+                print(f"Failed to ingest {change.name}: {str(result)}")
+
+        try:
+            await self.flush()
+        finally:
+            # Blobs from the batches that did go through stay done
+            if self.search_client is not None:
+                self.cursor.save(self.cursor_path)
+        stats = {
+            "changed": len(changed) - failed,
+            "deleted": len(deleted),
+            "failed": failed,
+            "seconds": round(time.perf_counter() - start, 2),
+        }
+        if changed or deleted:
+            print(f"Blob ingestion pass: {stats}")
+        return stats
+
+    async def run(self, poll_interval: float = POLL_INTERVAL) -> None:
+        print(f"Watching container {self.container_client.container_name} every {poll_interval}s")
+        while True:
+            try:
+                await self.sync_once()
+            except Exception as e:
+                print(f"Blob ingestion pass failed: {str(e)}")
+            await asyncio.sleep(poll_interval)
+
+
+async def ensure_index(index_client: SearchIndexClient, index_name: str) -> None:
+    """Create the index, or add the fields the worker writes to an existing one."""
+    wanted = build_docs_index(index_name)
+    try:
+        index = await index_client.get_index(index_name)
+    except ResourceNotFoundError:
+        await index_client.create_index(wanted)
+        print(f"Created index {index_name}")
+        return
+
+    # Fields can be added to an index, never re-keyed or retyped
+    key = next((existing for existing in index.fields if existing.key), None)
+    if key is None or key.name != "id":
+        raise ValueError(
+            f"Index {index_name} is keyed on {key.name if key else None!r}, not 'id' - it was probably built by an "
+            "indexer. Set BLOB_INGESTION_INDEX to an index of its own."
+        )
+    existing = {field.name: field for field in index.fields}
+    for field in wanted.fields:
+        if field.name in existing and existing[field.name].type != field.type:
+            raise ValueError(f"Field {field.name} of index {index_name} is {existing[field.name].type}, expected {field.type}")
+    missing = [field for field in wanted.fields if field.name not in existing]
+    if not missing:
+        return
+    index.fields.extend(missing)
+    if any(field.name == VECTOR_FIELD for field in missing):
+        if index.vector_search is None:
+            index.vector_search = wanted.vector_search
+        else:
+            algorithms = index.vector_search.algorithms = index.vector_search.algorithms or []
+            profiles = index.vector_search.profiles = index.vector_search.profiles or []
+            known = {config.name for config in algorithms + profiles}
+            algorithms += [config for config in wanted.vector_search.algorithms if config.name not in known]
+            profiles += [config for config in wanted.vector_search.profiles if config.name not in known]
+    await index_client.create_or_update_index(index)
+    print(f"Added {', '.join(field.name for field in missing)} to index {index_name}")
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser(description="Sync a blob container into the product docs search index")
+    parser.add_argument("--once", action="store_true", help="Run a single sync pass and exit")
+    parser.add_argument("--dry-run", action="store_true", help="Extract and chunk without touching the index")
+    parser.add_argument("--container", default=BLOB_CONTAINER)
+    parser.add_argument("--index", default=INDEX_NAME)
+    args = parser.parse_args()
+
+    container_client = ContainerClient.from_connection_string(BLOB_CONNECTION_STRING, args.container)
+    search_client = index_client = None
+    if not args.dry_run:
+        endpoint = os.environ["AZURE_SEARCH_SERVICE_ENDPOINT"]
+        credential = AzureKeyCredential(os.environ["AZURE_SEARCH_API_KEY"])
+        # Batch priority leaves search and embedding quota for live chat traffic
+        search_client = SearchClient(endpoint, args.index, credential, **azure_client_options("search", Priority.BATCH))
+        index_client = SearchIndexClient(endpoint, credential, **azure_client_options("search", Priority.BATCH))
+        await ensure_index(index_client, args.index)
+
+    embed = None if args.dry_run else create_embedder(priority=Priority.BATCH)
+    worker = BlobIngestionWorker(container_client, search_client, embed=embed)
+    try:
+        if args.once or args.dry_run:
+            await worker.sync_once()
+        else:
+            await worker.run()
+    finally:
+        await container_client.close()
+        if search_client:
+            await search_client.close()
+            await index_client.close()
+        if embed:
+            embed.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,219 @@
+import os
+import json
+import time
+import random
+import inspect
+import functools
+import contextvars
+from dataclasses import dataclass
+from typing import Dict, Iterable, List, Optional, Tuple
+
+# Share of runs profiled without being asked to, 0 disables sampling
+CALLBACK_PROFILE_SAMPLE_RATE = float(os.getenv("CALLBACK_PROFILE_SAMPLE_RATE", "0"))
+CALLBACK_PROFILE_DIR = os.getenv("CALLBACK_PROFILE_DIR", "profiles")
+
+HANDLER_CALLBACKS = (
+    "on_text_created",
+    "on_text_delta",
+    "on_text_done",
+    "on_tool_call_created",
+    "on_tool_call_delta",
+    "on_tool_call_done",
+    "on_image_file_done",
+    "on_run_step_created",
+    "on_event",
+)
+# Where the SDK parses a server-sent event and dispatches it to the callbacks
+SDK_DISPATCH = "_process_event"
+# Chainlit emitter calls that end up as socket.io messages
+EMITTER_CALLS = ("send_step", "update_step", "delete_step", "send_token", "stream_start", "emit")
+
+WAIT_FRAME = "stream_wait"
+
+
+@dataclass
+class CallStats:
+    count: int = 0
+    total: float = 0.0
+    max: float = 0.0
+
+    def add(self, elapsed: float) -> None:
+        self.count += 1
+        self.total += elapsed
+        self.max = max(self.max, elapsed)
+
+
+class _Frame:
+    __slots__ = ("stack", "started", "children")
+
+    def __init__(self, stack: Tuple[str, ...]) -> None:
+        self.stack = stack
+        self.started = time.perf_counter()
+        self.children = 0.0
+
+
+class CallbackProfiler:
+    """Times event handler callbacks and the calls they await, for one streamed run.
+
+    Each instrumented call is a frame; time is attributed to the innermost
+    frame so the output can be rendered as a flamegraph (collapsed stacks,
+    microseconds). Nothing is wrapped unless a profiler is attached, so
+    unprofiled runs pay nothing.
+    """
+
+    def __init__(self, label: str) -> None:
+        self.label = label
+        self.started = time.perf_counter()
+        self.calls: Dict[str, CallStats] = {}
+        self.self_time: Dict[Tuple[str, ...], float] = {}
+        self._current: contextvars.ContextVar[Optional[_Frame]] = contextvars.ContextVar(f"profile_{id(self)}", default=None)
+        self._patched: List[Tuple[object, str, bool, object]] = []
+        self._last_dispatch_end: Optional[float] = None
+
+    def _enter(self, name: str) -> Tuple[_Frame, contextvars.Token]:
+        parent = self._current.get()
+        frame = _Frame((parent.stack if parent else ("handler",)) + (name,))
+        return frame, self._current.set(frame)
+
+    def _exit(self, name: str, frame: _Frame, token: contextvars.Token) -> None:
+        elapsed = time.perf_counter() - frame.started
+        self._current.reset(token)
+        parent = self._current.get()
+        if parent:
+            parent.children += elapsed
+        self.self_time[frame.stack] = self.self_time.get(frame.stack, 0.0) + elapsed - frame.children
+        self.calls.setdefault(name, CallStats()).add(elapsed)
+
+    def _wrap(self, name: str, function):
+        if inspect.iscoroutinefunction(function):
+            @functools.wraps(function)
+            async def timed(*args, **kwargs):
+                frame, token = self._enter(name)
+                try:
+                    return await function(*args, **kwargs)
+                finally:
+                    self._exit(name, frame, token)
+        else:
+            @functools.wraps(function)
+            def timed(*args, **kwargs):
+                frame, token = self._enter(name)
+                try:
+                    return function(*args, **kwargs)
+                finally:
+                    self._exit(name, frame, token)
+        return timed
+
+    def _wrap_dispatch(self, function):
+        timed = self._wrap(SDK_DISPATCH, function)
+
+        def record_wait() -> None:
+            # The gap between two events is time spent waiting on the service and the network
+            now = time.perf_counter()
+            if self._last_dispatch_end is not None:
+                waited = now - self._last_dispatch_end
+                self.self_time[("handler", WAIT_FRAME)] = self.self_time.get(("handler", WAIT_FRAME), 0.0) + waited
+                self.calls.setdefault(WAIT_FRAME, CallStats()).add(waited)
+
+        if inspect.iscoroutinefunction(function):
+            @functools.wraps(function)
+            async def dispatch(*args, **kwargs):
+                record_wait()
+                try:
+                    return await timed(*args, **kwargs)
+                finally:
+                    self._last_dispatch_end = time.perf_counter()
+        else:
+            @functools.wraps(function)
+            def dispatch(*args, **kwargs):
+                record_wait()
+                try:
+                    return timed(*args, **kwargs)
+                finally:
+                    self._last_dispatch_end = time.perf_counter()
+        return dispatch
+
+    def instrument(self, target, names: Iterable[str]) -> None:
+        """Replace the given methods on `target` (an instance) with timed versions until `detach`."""
+        for name in names:
+            function = getattr(target, name, None)
+            if function is None or not callable(function):
+                continue
+            own = name in getattr(target, "__dict__", {})
+            self._patched.append((target, name, own, function))
+            wrapped = self._wrap_dispatch(function) if name == SDK_DISPATCH else self._wrap(name, function)
+            setattr(target, name, wrapped)
+
+    def attach(self, handler, emitter=None) -> "CallbackProfiler":
+        self.instrument(handler, HANDLER_CALLBACKS + (SDK_DISPATCH,))
+        if emitter is not None:
+            self.instrument(emitter, EMITTER_CALLS)
+        return self
+
+    def detach(self) -> None:
+        for target, name, own, function in reversed(self._patched):
+            if own:
+                setattr(target, name, function)
+            else:
+                try:
+                    delattr(target, name)
+                except AttributeError:
+                    pass
+        self._patched = []
+
+    def collapsed(self) -> str:
+        """Stacks in the folded format read by flamegraph.pl, speedscope and inferno."""
+        lines = [
+            f"{';'.join(stack)} {int(seconds * 1_000_000)}"
+            for stack, seconds in sorted(self.self_time.items())
+            if seconds > 0
+        ]
+        return "\n".join(lines) + "\n"
+
+    def summary(self) -> Dict:
+        def bucket(matches) -> float:
+            return sum(seconds for stack, seconds in self.self_time.items() if matches(stack[-1]))
+
+        return {
+            "label": self.label,
+            "wall_ms": round((time.perf_counter() - self.started) * 1000, 1),
+            # Self time, so the four add up to the time spent inside the stream
+            "breakdown_ms": {
+                "network_wait": round(bucket(lambda name: name == WAIT_FRAME) * 1000, 1),
+                "sdk_parsing": round(bucket(lambda name: name == SDK_DISPATCH) * 1000, 1),
+                "socket_emit": round(bucket(lambda name: name in EMITTER_CALLS) * 1000, 1),
+                "callbacks": round(bucket(lambda name: name in HANDLER_CALLBACKS) * 1000, 1),
+            },
+            "calls": {
+                name: {
+                    "count": stats.count,
+                    "total_ms": round(stats.total * 1000, 2),
+                    "mean_ms": round(stats.total * 1000 / stats.count, 3),
+                    "max_ms": round(stats.max * 1000, 2),
+                }
+                for name, stats in sorted(self.calls.items(), key=lambda item: -item[1].total)
+            },
+        }
+
+    def dump(self, directory: str = CALLBACK_PROFILE_DIR) -> str:
+        """Write <label>.folded and <label>.json to `directory`, returns the path prefix."""
+        os.makedirs(directory, exist_ok=True)
+        safe_label = "".join(c if c.isalnum() or c in "-_" else "_" for c in self.label)
+        prefix = os.path.join(directory, f"{safe_label}-{time.strftime('%Y%m%d-%H%M%S')}")
+        with open(f"{prefix}.folded", "w") as f:
+            f.write(self.collapsed())
+        summary = self.summary()
+        with open(f"{prefix}.json", "w") as f:
+            json.dump(summary, f, indent=2)
+        print(f"Callback profile {self.label}: {summary['breakdown_ms']} -> {prefix}.folded")
+        return prefix
+
+
+def should_profile(requested: bool = False, sample_rate: float = CALLBACK_PROFILE_SAMPLE_RATE) -> bool:
+    return requested or (sample_rate > 0 and random.random() < sample_rate)
+
+
+def start_profiling(handler, emitter=None, label: str = "run", requested: bool = False) -> Optional[CallbackProfiler]:
+    """Attach a profiler to `handler` if this session asked for one or the run is sampled."""
+    if not should_profile(requested):
+        return None
+    return CallbackProfiler(label).attach(handler, emitter)
@@ -0,0 +1,173 @@
+import os
+import time
+import asyncio
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from azure.ai.agents.models import MessageTextFileCitationAnnotation, MessageTextUrlCitationAnnotation
+
+# Index the AzureAISearchTool of app_aura.py queries, and how its documents are keyed
+CITATION_INDEX_NAME = os.getenv("CITATION_INDEX_NAME", "azureblob-index")
+CITATION_KEY_FIELD = os.getenv("CITATION_KEY_FIELD", "id")
+CITATION_TITLE_FIELD = os.getenv("CITATION_TITLE_FIELD", "title")
+CITATION_URL_FIELD = os.getenv("CITATION_URL_FIELD", "url")
+# Document titles and links rarely change, keep them for an hour
+CITATION_CACHE_TTL = int(os.getenv("CITATION_CACHE_TTL", "3600"))
+CITATION_CACHE_MAX_ENTRIES = int(os.getenv("CITATION_CACHE_MAX_ENTRIES", "5000"))
+
+
+@dataclass
+class DocMetadata:
+    id: str
+    title: str
+    url: Optional[str] = None
+
+
+@dataclass
+class Citation:
+    number: int
+    title: str
+    url: Optional[str] = None
+    quote: Optional[str] = None
+    markers: List[str] = field(default_factory=list)
+
+    @property
+    def label(self) -> str:
+        # Chainlit links an element to the message wherever its name appears in the text
+        return f"Source {self.number}"
+
+
+class MetadataCache:
+    """TTL-bounded LRU of document metadata keyed by document or file id."""
+
+    def __init__(self, ttl: int = CITATION_CACHE_TTL, max_entries: int = CITATION_CACHE_MAX_ENTRIES) -> None:
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._entries: "OrderedDict[str, Tuple[float, DocMetadata]]" = OrderedDict()
+
+    def get(self, key: str) -> Optional[DocMetadata]:
+        entry = self._entries.get(key)
+        if entry is None or entry[0] < time.monotonic():
+            self._entries.pop(key, None)
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry[1]
+
+    def put(self, key: str, metadata: DocMetadata) -> None:
+        self._entries[key] = (time.monotonic() + self.ttl, metadata)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+
+def _is_link(value: Optional[str]) -> bool:
+    return bool(value) and value.startswith(("http://", "https://"))
+
+
+def _title_from_url(url: str) -> str:
+    return url.rstrip("/").rsplit("/", 1)[-1] or url
+
+
+def search_in_filter(field_name: str, ids: Iterable[str]) -> str:
+    # search.in with a delimiter that can't appear in our keys, quotes doubled per OData
+    values = "|".join(value.replace("'", "''") for value in ids)
+    return f"search.in({field_name}, '{values}', '|')"
+
+
+class CitationResolver:
+    """Turn the url/file citation annotations of an agent message into numbered sources.
+
+    Unknown document ids are looked up in one search.in query and unknown files
+    in one concurrent batch, per message. Results are cached across sessions.
+    """
+
+    def __init__(self, agents_client, search_client=None, cache: Optional[MetadataCache] = None) -> None:
+        self.agents_client = agents_client
+        self.search_client = search_client
+        self.cache = cache or MetadataCache()
+
+    async def _lookup_docs(self, ids: List[str]) -> None:
+        if not ids or self.search_client is None:
+            return
+        try:
+            results = await self.search_client.search(
+                search_text="*",
+                filter=search_in_filter(CITATION_KEY_FIELD, ids),
+                select=[CITATION_KEY_FIELD, CITATION_TITLE_FIELD, CITATION_URL_FIELD],
+                top=len(ids),
+            )
+            async for document in results:
+                doc_id = document[CITATION_KEY_FIELD]
+                self.cache.put(f"doc:{doc_id}", DocMetadata(
+                    id=doc_id,
+                    title=document.get(CITATION_TITLE_FIELD) or doc_id,
+                    url=document.get(CITATION_URL_FIELD),
+                ))
+        except Exception as e:
+            print(f"Could not resolve {len(ids)} cited documents: {str(e)}")
+
+    async def _lookup_file(self, file_id: str) -> None:
+        try:
+            file = await self.agents_client.files.get(file_id)
+            self.cache.put(f"file:{file_id}", DocMetadata(id=file_id, title=file.filename or file_id))
+        except Exception as e:
+            print(f"Could not resolve cited file {file_id}: {str(e)}")
+
+    async def resolve(self, message) -> Tuple[str, List[Citation]]:
+        """Return the message text with citation markers replaced by [n], and the sources."""
+        text = "".join(content.text.value for content in message.text_messages)
+        annotations = [annotation for content in message.text_messages for annotation in content.text.annotations or []]
+
+        # Collect what the cache doesn't know yet and fetch it in one round
+        doc_ids, file_ids = set(), set()
+        for annotation in annotations:
+            if isinstance(annotation, MessageTextUrlCitationAnnotation):
+                ref = annotation.url_citation.url
+                if not _is_link(ref) and self.cache.get(f"doc:{ref}") is None:
+                    doc_ids.add(ref)
+            elif isinstance(annotation, MessageTextFileCitationAnnotation):
+                if self.cache.get(f"file:{annotation.file_citation.file_id}") is None:
+                    file_ids.add(annotation.file_citation.file_id)
+        if doc_ids or file_ids:
+            await asyncio.gather(self._lookup_docs(sorted(doc_ids)), *(self._lookup_file(file_id) for file_id in file_ids))
+
+        citations: Dict[str, Citation] = {}
+        for annotation in annotations:
+            if isinstance(annotation, MessageTextUrlCitationAnnotation):
+                ref = annotation.url_citation.url
+                if _is_link(ref):
+                    metadata = DocMetadata(id=ref, title=annotation.url_citation.title or _title_from_url(ref), url=ref)
+                else:
+                    metadata = self.cache.get(f"doc:{ref}") or DocMetadata(id=ref, title=annotation.url_citation.title or ref)
+                quote = None
+            elif isinstance(annotation, MessageTextFileCitationAnnotation):
+                file_id = annotation.file_citation.file_id
+                metadata = self.cache.get(f"file:{file_id}") or DocMetadata(id=file_id, title=file_id)
+                quote = annotation.file_citation.quote
+            else:
+                continue
+            # Several chunks of the same document become one source
+            key = metadata.url or metadata.id
+            citation = citations.get(key)
+            if citation is None:
+                citation = citations[key] = Citation(number=len(citations) + 1, title=metadata.title, url=metadata.url, quote=quote)
+            if annotation.text and annotation.text not in citation.markers:
+                citation.markers.append(annotation.text)
+
+        for citation in citations.values():
+            for marker in citation.markers:
+                text = text.replace(marker, f" [{citation.number}]")
+        return text, list(citations.values())
+
+
+def sources_markdown(citations: List[Citation]) -> str:
+    lines = [
+        f"{citation.label}: [{citation.title}]({citation.url})" if citation.url else f"{citation.label}: {citation.title}"
+        for citation in citations
+    ]
+    return "\n\n**Sources**\n\n" + "\n\n".join(lines) if lines else ""
@@ -5,6 +5,9 @@ import os
 from azure.ai.projects import AIProjectClient
 from azure.identity import DefaultAzureCredential
 
+from upload_preprocessing import preprocess_table, remove_preprocessed
+from streaming_upload import upload_streaming_sync, upload_agent_file
+
 # Initialize Azure AI Project Client
 project_endpoint = os.environ.get("PROJECT_ENDPOINT")
 if not project_endpoint:
@@ -21,20 +24,27 @@ agents_client = project_client.agents
 instructions = """You are an assistant running data analysis on CSV files.
 
 You will use code interpreter to run the analysis.
+Tabular files are provided as Parquet with a .summary.json file describing the columns, read the summary first.
 
 However, instead of rendering the charts as images, you will generate a plotly figure and turn it into json.
 You will create a file for each json that I can download through annotations.
 """
 
-# Upload the CSV file for the assistant
-# Use the correct client and method to upload file resources
-# For CSVs you’ll typically use project_file_type="Table" (you can change this if needed)
-with open("../data/sku1.csv", "rb") as f:
-    uploaded_file = project_client.file_resources.create(
-        file=f,
-        name="sku1.csv",
-        project_file_type="Table"  # e.g. "Table" for CSV; or "Document"/other as appropriate
-    )
+# Convert the CSV to Parquet + a summary sidecar so code interpreter loads it faster
+preprocessed = preprocess_table("../data/sku1.csv")
+
+# Upload the converted files for the assistant
+uploaded_file_ids = []
+try:
+    for file_path in [path for result in preprocessed for path in result.paths]:
+        # Streamed in chunks as a multipart body and retried on transient failures
+        uploaded_file, _ = upload_streaming_sync(
+            lambda reader: upload_agent_file(agents_client, reader),
+            file_path,
+        )
+        uploaded_file_ids.append(uploaded_file.id)
+finally:
+    remove_preprocessed(preprocessed)
 
 # Create the agent with tools and file resources
 agent = agents_client.create_agent(
@@ -47,7 +57,7 @@ agent = agents_client.create_agent(
     ],
     tool_resources={
         "code_interpreter": {
-            "file_ids": [uploaded_file.id]
+            "file_ids": uploaded_file_ids
         }
     }
 )
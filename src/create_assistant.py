@@ -4,12 +4,15 @@ load_dotenv()
 import os
 from openai import OpenAI
 
+from upload_preprocessing import preprocess_table, remove_preprocessed
+
 openai_client = OpenAI(api_key=os.environ.get("OPENAI_API_KEY"))
 
 
 instructions = """You are an assistant running data analysis on CSV files.
 
 You will use code interpreter to run the analysis.
+Tabular files are provided as Parquet with a .summary.json file describing the columns, read the summary first.
 
 However, instead of rendering the charts as images, you will generate a plotly figure and turn it into json.
 You will create a file for each json that I can download through annotations.
@@ -20,10 +23,17 @@ tools = [
     {"type": "file_search"}
 ]
 
-file = openai_client.files.create(
-  file=open("tesla-stock-price.csv", "rb"),
-  purpose='assistants'
-)
+# Convert the CSV to Parquet + a summary sidecar so code interpreter loads it faster
+file_ids = []
+preprocessed = preprocess_table("tesla-stock-price.csv")
+try:
+    for result in preprocessed:
+        for file_path in result.paths:
+            with open(file_path, "rb") as f:
+                file = openai_client.files.create(file=f, purpose='assistants')
+            file_ids.append(file.id)
+finally:
+    remove_preprocessed(preprocessed)
 
 
 assistant = openai_client.beta.assistants.create(
@@ -34,7 +44,7 @@ assistant = openai_client.beta.assistants.create(
     tools=tools,
     tool_resources={
         "code_interpreter": {
-        "file_ids": [file.id]
+        "file_ids": file_ids
         }
     }
 )
@@ -0,0 +1,412 @@
+import os
+import json
+import asyncio
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+import asyncpg
+import chainlit as cl
+from chainlit.data.chainlit_data_layer import ChainlitDataLayer, ISO_FORMAT
+from chainlit.data.utils import queue_until_user_message
+from chainlit.types import PageInfo, PaginatedResponse, Pagination, ThreadDict, ThreadFilter
+
+from thread_archive import create_archiver
+
+# Each replica holds at most this many connections; writes are batched so few are needed
+DATA_LAYER_POOL_MIN_SIZE = int(os.getenv("DATA_LAYER_POOL_MIN_SIZE", "1"))
+DATA_LAYER_POOL_MAX_SIZE = int(os.getenv("DATA_LAYER_POOL_MAX_SIZE", "10"))
+# Step writes are buffered this long (or until this many are pending) and sent as one batch
+DATA_LAYER_FLUSH_MS = int(os.getenv("DATA_LAYER_FLUSH_MS", "50"))
+DATA_LAYER_BATCH_SIZE = int(os.getenv("DATA_LAYER_BATCH_SIZE", "200"))
+# A batch that fails is retried, backing off up to this long between attempts
+FLUSH_MAX_BACKOFF_SECONDS = 5
+POOL_IDLE_SECONDS = 300
+STATEMENT_CACHE_SIZE = 256
+
+# Statement texts never vary, so asyncpg's per-connection cache of prepared
+# statements serves every call after the first on a connection.
+ENSURE_THREAD = """INSERT INTO "Thread" (id, metadata) VALUES ($1, '{}') ON CONFLICT (id) DO NOTHING"""
+
+# Placeholder for a parent that hasn't been written yet, as ChainlitDataLayer.create_step does
+ENSURE_PARENT = """
+INSERT INTO "Step" (id, metadata, type, "startTime", "endTime", "showInput", "isError")
+VALUES ($1, '{}', 'run', $2, $2, 'json', false)
+ON CONFLICT (id) DO NOTHING
+"""
+
+# Same upsert as ChainlitDataLayer.create_step
+UPSERT_STEP = """
+INSERT INTO "Step" (
+    id, "threadId", "parentId", input, metadata, name, output,
+    type, "startTime", "endTime", "showInput", "isError"
+) VALUES (
+    $1, $2, $3, $4, $5, $6, $7, $8, $9, $10, $11, $12
+)
+ON CONFLICT (id) DO UPDATE SET
+    "parentId" = COALESCE(EXCLUDED."parentId", "Step"."parentId"),
+    input = COALESCE(EXCLUDED.input, "Step".input),
+    metadata = CASE
+        WHEN EXCLUDED.metadata <> '{}' THEN EXCLUDED.metadata
+        ELSE "Step".metadata
+    END,
+    name = COALESCE(EXCLUDED.name, "Step".name),
+    output = COALESCE(EXCLUDED.output, "Step".output),
+    type = CASE
+        WHEN EXCLUDED.type = 'run' THEN "Step".type
+        ELSE EXCLUDED.type
+    END,
+    "threadId" = COALESCE(EXCLUDED."threadId", "Step"."threadId"),
+    "endTime" = COALESCE(EXCLUDED."endTime", "Step"."endTime"),
+    "startTime" = LEAST(EXCLUDED."startTime", "Step"."startTime"),
+    "showInput" = COALESCE(EXCLUDED."showInput", "Step"."showInput"),
+    "isError" = COALESCE(EXCLUDED."isError", "Step"."isError")
+"""
+
+GET_THREAD = """
+SELECT t.*, u.identifier AS user_identifier
+FROM "Thread" t
+LEFT JOIN "User" u ON t."userId" = u.id
+WHERE t.id = $1 AND t."deletedAt" IS NULL
+"""
+GET_STEPS = 'SELECT * FROM "Step" WHERE "threadId" = $1 ORDER BY "startTime"'
+GET_ELEMENTS = 'SELECT * FROM "Element" WHERE "threadId" = $1'
+
+# Unlike ChainlitDataLayer, no per-row COUNT of the user's threads (it was never returned).
+# Served by the Thread (userId, createdAt) index.
+LIST_THREADS = """
+SELECT t.id, t."createdAt", t.name, t."userId", t.metadata, u.identifier AS user_identifier
+FROM "Thread" t
+LEFT JOIN "User" u ON t."userId" = u.id
+WHERE t."deletedAt" IS NULL
+"""
+
+# Run checkpoints of app_azure.py (run_checkpoint.py). Ages come from the database
+# clock so replicas with skewed clocks agree on which checkpoints are stale.
+SAVE_RUN_CHECKPOINT = """
+INSERT INTO "RunCheckpoint" (
+    "threadId", "agentThreadId", "runId", "lastEventId", "messageId", "messagesDone", content, "replicaId", "updatedAt"
+)
+SELECT $1, $2, $3, $4, $5, $6, $7, $8, now()
+WHERE EXISTS (SELECT 1 FROM "Thread" WHERE id = $1)
+ON CONFLICT ("threadId") DO UPDATE SET
+    "agentThreadId" = EXCLUDED."agentThreadId",
+    "runId" = EXCLUDED."runId",
+    "lastEventId" = EXCLUDED."lastEventId",
+    "messageId" = EXCLUDED."messageId",
+    "messagesDone" = EXCLUDED."messagesDone",
+    content = EXCLUDED.content,
+    "replicaId" = EXCLUDED."replicaId",
+    "updatedAt" = EXCLUDED."updatedAt"
+"""
+GET_RUN_CHECKPOINT = """
+SELECT *, EXTRACT(EPOCH FROM now() - "updatedAt")::float8 AS age FROM "RunCheckpoint" WHERE "threadId" = $1
+"""
+# Only one replica wins a stale checkpoint, it becomes the owner and heartbeats it from then on
+CLAIM_RUN_CHECKPOINT = """
+UPDATE "RunCheckpoint" SET "replicaId" = $3, "updatedAt" = now()
+WHERE "threadId" = $1 AND "runId" = $2 AND "updatedAt" < now() - make_interval(secs => $4)
+RETURNING "threadId"
+"""
+DELETE_RUN_CHECKPOINT = """DELETE FROM "RunCheckpoint" WHERE "threadId" = $1 AND "runId" = $2"""
+
+
+class PooledDataLayer(ChainlitDataLayer):
+    """ChainlitDataLayer with a sized pool, batched step writes and fewer round trips.
+
+    create_step/update_step are buffered and written every DATA_LAYER_FLUSH_MS
+    in one transaction, as pipelined executemany calls, instead of three
+    queries on three pooled connections per call. Anything that reads steps
+    or references them (threads, elements, feedback, deletes) flushes first.
+    """
+
+    def __init__(self, database_url: str, storage_client=None) -> None:
+        super().__init__(database_url=database_url, storage_client=storage_client)
+        self._connect_lock = asyncio.Lock()
+        self._flush_lock = asyncio.Lock()
+        self._pending: List[Tuple[Optional[str], Optional[Tuple], Tuple]] = []
+        self._writing: set = set()
+        self._flush_task: Optional[asyncio.Task] = None
+        self._flush_failures = 0
+
+    async def connect(self):
+        async with self._connect_lock:
+            if not self.pool:
+                self.pool = await asyncpg.create_pool(
+                    self.database_url,
+                    min_size=DATA_LAYER_POOL_MIN_SIZE,
+                    max_size=DATA_LAYER_POOL_MAX_SIZE,
+                    max_inactive_connection_lifetime=POOL_IDLE_SECONDS,
+                    statement_cache_size=STATEMENT_CACHE_SIZE,
+                    # JIT compilation only slows down these short queries
+                    server_settings={"application_name": "chainlit", "jit": "off"},
+                )
+
+    async def _pool(self) -> asyncpg.Pool:
+        if not self.pool:
+            await self.connect()
+        return self.pool
+
+    def _step_args(self, step_dict) -> Tuple:
+        timestamp = datetime.now()
+        created_at = step_dict.get("createdAt")
+        if created_at:
+            timestamp = datetime.strptime(created_at, ISO_FORMAT)
+        return (
+            step_dict["id"],
+            step_dict.get("threadId"),
+            step_dict.get("parentId"),
+            step_dict.get("input"),
+            json.dumps(step_dict.get("metadata", {})),
+            step_dict.get("name"),
+            step_dict.get("output"),
+            step_dict["type"],
+            timestamp,
+            timestamp,
+            step_dict.get("showInput", "json"),
+            step_dict.get("isError", False),
+        )
+
+    @queue_until_user_message()
+    async def create_step(self, step_dict):
+        args = self._step_args(step_dict)
+        parent = (step_dict["parentId"], args[8]) if step_dict.get("parentId") else None
+        self._pending.append((step_dict.get("threadId"), parent, args))
+        if len(self._pending) >= DATA_LAYER_BATCH_SIZE:
+            await self.flush()
+        elif self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.create_task(self._flush_later())
+
+    @queue_until_user_message()
+    async def update_step(self, step_dict):
+        await self.create_step(step_dict)
+
+    async def _flush_later(self) -> None:
+        # Runs until nothing is pending: steps added while a batch is being written
+        # don't start a task of their own, this one picks them up
+        while self._pending:
+            delay = DATA_LAYER_FLUSH_MS / 1000
+            if self._flush_failures:
+                delay = min(delay * 2 ** self._flush_failures, FLUSH_MAX_BACKOFF_SECONDS)
+            await asyncio.sleep(delay)
+            try:
+                await self.flush()
+            except Exception as e:
+                print(f"Could not write {len(self._pending)} steps, retrying: {str(e)}")
+
+    async def flush(self) -> None:
+        """Write the buffered steps. Batches are written one at a time, in order.
+
+        A batch that fails goes back to the front of the buffer, so it's
+        retried (before anything written after it) rather than lost.
+        """
+        async with self._flush_lock:
+            if not self._pending:
+                return
+            pending, self._pending = self._pending, []
+            threads = list(dict.fromkeys(thread_id for thread_id, _, _ in pending if thread_id))
+            parents = [parent for _, parent, _ in pending if parent]
+            self._writing = set(threads)
+            try:
+                pool = await self._pool()
+                async with pool.acquire() as connection:
+                    async with connection.transaction():
+                        if threads:
+                            await connection.executemany(ENSURE_THREAD, [(thread_id,) for thread_id in threads])
+                        if parents:
+                            await connection.executemany(ENSURE_PARENT, parents)
+                        await connection.executemany(UPSERT_STEP, [args for _, _, args in pending])
+                self._flush_failures = 0
+            except BaseException:
+                self._pending[:0] = pending
+                self._flush_failures += 1
+                if self._flush_task is None or self._flush_task.done():
+                    self._flush_task = asyncio.create_task(self._flush_later())
+                raise
+            finally:
+                self._writing = set()
+
+    async def flush_thread(self, thread_id: str) -> None:
+        # Reads of one thread only wait for that thread's writes
+        if thread_id in self._writing or any(pending[0] == thread_id for pending in self._pending):
+            await self.flush()
+
+    @queue_until_user_message()
+    async def delete_step(self, step_id: str):
+        await self.flush()
+        await super().delete_step(step_id)
+
+    @queue_until_user_message()
+    async def create_element(self, element):
+        await self.flush()
+        await super().create_element(element)
+
+    async def upsert_feedback(self, feedback) -> str:
+        await self.flush()
+        return await super().upsert_feedback(feedback)
+
+    async def delete_thread(self, thread_id: str):
+        await self.flush_thread(thread_id)
+        await super().delete_thread(thread_id)
+
+    async def get_thread(self, thread_id: str) -> Optional[ThreadDict]:
+        await self.flush_thread(thread_id)
+        pool = await self._pool()
+        # One connection for the three reads instead of one each
+        async with pool.acquire() as connection:
+            thread = await connection.fetchrow(GET_THREAD, thread_id)
+            if not thread:
+                return None
+            steps = await connection.fetch(GET_STEPS, thread_id)
+            elements = [dict(row) for row in await connection.fetch(GET_ELEMENTS, thread_id)]
+
+        if self.storage_client is not None:
+            for elem in elements:
+                if not elem["url"] and elem["objectKey"]:
+                    elem["url"] = await self.storage_client.get_read_url(object_key=elem["objectKey"])
+
+        return ThreadDict(
+            id=str(thread["id"]),
+            createdAt=thread["createdAt"].isoformat(),
+            name=thread["name"],
+            userId=str(thread["userId"]) if thread["userId"] else None,
+            userIdentifier=thread["user_identifier"],
+            metadata=json.loads(thread["metadata"]),
+            steps=[self._convert_step_row_to_dict(dict(step)) for step in steps],
+            elements=[self._convert_element_row_to_dict(elem) for elem in elements],
+            tags=[],
+        )
+
+    async def list_threads(self, pagination: Pagination, filters: ThreadFilter) -> PaginatedResponse[ThreadDict]:
+        # Fragments are appended in a fixed order, so there are only a few distinct statements
+        query = LIST_THREADS
+        params: List[Any] = []
+        if filters.search:
+            params.append(f"%{filters.search}%")
+            query += f" AND t.name ILIKE ${len(params)}"
+        if filters.userId:
+            params.append(filters.userId)
+            query += f' AND t."userId" = ${len(params)}'
+        if pagination.cursor:
+            params.append(pagination.cursor)
+            query += f' AND t."createdAt" < (SELECT "createdAt" FROM "Thread" WHERE id = ${len(params)})'
+        params.append(pagination.first + 1)
+        query += f' ORDER BY t."createdAt" DESC LIMIT ${len(params)}'
+
+        pool = await self._pool()
+        async with pool.acquire() as connection:
+            threads = await connection.fetch(query, *params)
+
+        has_next_page = len(threads) > pagination.first
+        if has_next_page:
+            threads = threads[:-1]
+        thread_dicts = [
+            ThreadDict(
+                id=str(thread["id"]),
+                createdAt=thread["createdAt"].isoformat(),
+                name=thread["name"],
+                userId=str(thread["userId"]) if thread["userId"] else None,
+                userIdentifier=thread["user_identifier"],
+                metadata=json.loads(thread["metadata"]),
+                steps=[],
+                elements=[],
+                tags=[],
+            )
+            for thread in threads
+        ]
+        return PaginatedResponse(
+            pageInfo=PageInfo(
+                hasNextPage=has_next_page,
+                startCursor=thread_dicts[0]["id"] if thread_dicts else None,
+                endCursor=thread_dicts[-1]["id"] if thread_dicts else None,
+            ),
+            data=thread_dicts,
+        )
+
+    async def save_run_checkpoint(self, checkpoint: Dict) -> bool:
+        """Upsert the checkpoint of the run streaming into a thread, False if the thread isn't stored."""
+        await self.flush_thread(checkpoint["thread_id"])
+        pool = await self._pool()
+        async with pool.acquire() as connection:
+            status = await connection.execute(
+                SAVE_RUN_CHECKPOINT,
+                checkpoint["thread_id"],
+                checkpoint["agent_thread_id"],
+                checkpoint["run_id"],
+                checkpoint.get("last_event_id"),
+                checkpoint.get("message_id"),
+                checkpoint.get("messages_done", 0),
+                checkpoint.get("content", ""),
+                checkpoint["replica_id"],
+            )
+        return status != "INSERT 0 0"
+
+    async def get_run_checkpoint(self, thread_id: str) -> Optional[Dict]:
+        pool = await self._pool()
+        async with pool.acquire() as connection:
+            row = await connection.fetchrow(GET_RUN_CHECKPOINT, thread_id)
+        return dict(row) if row else None
+
+    async def claim_run_checkpoint(self, thread_id: str, run_id: str, replica_id: str, stale_seconds: float) -> bool:
+        pool = await self._pool()
+        async with pool.acquire() as connection:
+            return await connection.fetchval(CLAIM_RUN_CHECKPOINT, thread_id, run_id, replica_id, stale_seconds) is not None
+
+    async def delete_run_checkpoint(self, thread_id: str, run_id: str) -> None:
+        pool = await self._pool()
+        async with pool.acquire() as connection:
+            await connection.execute(DELETE_RUN_CHECKPOINT, thread_id, run_id)
+
+    async def cleanup(self):
+        try:
+            await self.flush()
+        finally:
+            await super().cleanup()
+
+
+def _storage_client():
+    # Same settings Chainlit reads when it builds its default data layer
+    account = os.getenv("APP_AZURE_STORAGE_ACCOUNT")
+    key = os.getenv("APP_AZURE_STORAGE_ACCESS_KEY")
+    if not (account and key):
+        return None
+    from chainlit.data.storage_clients.azure_blob import AzureBlobStorageClient
+
+    return AzureBlobStorageClient(container_name=os.getenv("BUCKET_NAME"), storage_account=account, storage_key=key)
+
+
+class ArchiveAwareDataLayer(PooledDataLayer):
+    """Restores threads moved out by thread_archive.py when they're opened."""
+
+    def __init__(self, database_url: str, storage_client=None) -> None:
+        super().__init__(database_url=database_url, storage_client=storage_client)
+        self.archiver = None
+
+    async def connect(self):
+        await super().connect()
+        if self.archiver is None:
+            self.archiver = create_archiver(self.pool)
+
+    async def get_thread(self, thread_id: str):
+        await self.connect()
+        try:
+            await self.archiver.rehydrate(thread_id)
+        except Exception as e:
+            # Still show the thread, without its history
+            print(f"Could not rehydrate thread {thread_id}: {str(e)}")
+        return await super().get_thread(thread_id)
+
+    async def cleanup(self):
+        if self.archiver:
+            await self.archiver.container_client.close()
+        await super().cleanup()
+
+
+def register_data_layer(database_url: Optional[str] = None) -> None:
+    """Use ArchiveAwareDataLayer instead of Chainlit's default when DATABASE_URL is set."""
+    database_url = database_url or os.getenv("DATABASE_URL")
+    if not database_url:
+        return
+
+    @cl.data_layer
+    def archive_aware_data_layer():
+        return ArchiveAwareDataLayer(database_url, _storage_client())
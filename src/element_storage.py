@@ -0,0 +1,160 @@
+import os
+import re
+import hashlib
+import mimetypes
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Optional
+from urllib.parse import quote
+
+from azure.core.exceptions import ResourceExistsError
+from azure.storage.blob import BlobSasPermissions, ContentSettings, generate_blob_sas
+from azure.storage.blob.aio import ContainerClient
+
+# Azurite's well-known development account, as used by init_azure_storage.py
+AZURITE_CONNECTION_STRING = (
+    "DefaultEndpointsProtocol=http;"
+    "AccountName=devstoreaccount1;"
+    "AccountKey=Eby8vdM02xNOcqFlqUwJPLlmEtlCDXJ1OUzFT50uSRZ6IFsuFq2UVErCz4I6tq/K1SZFPTOtr/KBHBeksoGMGw==;"
+    "BlobEndpoint=http://localhost:10000/devstoreaccount1"
+)
+
+# Generated files and images are offloaded only when a storage account is configured,
+# e.g. Azurite's connection string after running init_azure_storage.py
+ELEMENT_STORAGE_CONNECTION_STRING = os.getenv("ELEMENT_STORAGE_CONNECTION_STRING")
+ELEMENT_STORAGE_CONTAINER = os.getenv("ELEMENT_STORAGE_CONTAINER", "my-container")
+ELEMENT_URL_TTL_SECONDS = int(os.getenv("ELEMENT_URL_TTL_SECONDS", "3600"))
+ELEMENT_ROUTE = "/blobs"
+KEY_PREFIX = "elements"
+# Only content-addressed element blobs are ever signed, never anything else in the container
+KEY_PATTERN = re.compile(rf"^{KEY_PREFIX}/[0-9a-f]{{2}}/[0-9a-f]{{64}}(\.[A-Za-z0-9]{{1,10}})?$")
+KNOWN_KEYS_MAX = 10000
+
+
+def parse_connection_string(connection_string: str) -> Dict[str, str]:
+    return dict(part.split("=", 1) for part in connection_string.split(";") if "=" in part)
+
+
+def _safe_filename(name: str) -> str:
+    return re.sub(r'[\x00-\x1f"\\]', "", name)[:200]
+
+
+def content_key(data: bytes, name: str) -> str:
+    """Blob name derived from the content, so the same bytes are stored once."""
+    digest = hashlib.sha256(data).hexdigest()
+    extension = os.path.splitext(name)[1].lower()
+    if not re.fullmatch(r"\.[a-z0-9]{1,10}", extension):
+        extension = ""
+    return f"{KEY_PREFIX}/{digest[:2]}/{digest}{extension}"
+
+
+class ElementStorage:
+    """Content-addressed blob storage for Chainlit element payloads.
+
+    Elements reference `/blobs/<key>`, which redirects to a short-lived
+    signed URL, so the bytes go straight from blob storage to the browser and
+    links persisted with a thread keep working after the signature expires.
+    """
+
+    def __init__(
+        self,
+        connection_string: str,
+        container: str = ELEMENT_STORAGE_CONTAINER,
+        url_ttl: int = ELEMENT_URL_TTL_SECONDS,
+    ) -> None:
+        settings = parse_connection_string(connection_string)
+        self.account_name = settings.get("AccountName")
+        self.account_key = settings.get("AccountKey")
+        if not self.account_key:
+            raise ValueError("The element storage connection string needs an AccountKey to sign URLs.")
+        self.container = container
+        self.url_ttl = url_ttl
+        self.container_client = ContainerClient.from_connection_string(connection_string, container)
+        self.uploaded = 0
+        self.deduplicated = 0
+        self._known: "OrderedDict[str, None]" = OrderedDict()
+
+    def _remember(self, key: str) -> None:
+        self._known[key] = None
+        self._known.move_to_end(key)
+        while len(self._known) > KNOWN_KEYS_MAX:
+            self._known.popitem(last=False)
+
+    async def put(self, data, name: str, mime: Optional[str] = None) -> str:
+        """Store `data` under its content key unless it's already there, returns the key."""
+        if not isinstance(data, (bytes, bytearray)):
+            # The agents SDK hands file content back as an iterator of chunks
+            data = b"".join(data)
+        key = content_key(data, name)
+        if key in self._known:
+            self.deduplicated += 1
+            return key
+        content_type = mime or mimetypes.guess_type(name)[0] or "application/octet-stream"
+        try:
+            await self.container_client.upload_blob(
+                key,
+                bytes(data),
+                overwrite=False,
+                content_settings=ContentSettings(content_type=content_type, cache_control="private, max-age=31536000, immutable"),
+            )
+            self.uploaded += 1
+        except ResourceExistsError:
+            self.deduplicated += 1
+        self._remember(key)
+        return key
+
+    async def upload(self, data, name: str, mime: Optional[str] = None) -> str:
+        """Store the content and return the URL an element should reference."""
+        return self.element_url(await self.put(data, name, mime), name)
+
+    def element_url(self, key: str, name: Optional[str] = None) -> str:
+        url = f"{ELEMENT_ROUTE}/{key}"
+        return f"{url}?name={quote(name)}" if name else url
+
+    def signed_url(self, key: str, name: Optional[str] = None) -> str:
+        if not KEY_PATTERN.match(key):
+            raise ValueError(f"Not an element key: {key}")
+        now = datetime.now(timezone.utc)
+        sas = generate_blob_sas(
+            account_name=self.account_name,
+            container_name=self.container,
+            blob_name=key,
+            account_key=self.account_key,
+            permission=BlobSasPermissions(read=True),
+            # Allow for clock skew between us and the storage service
+            start=now - timedelta(minutes=5),
+            expiry=now + timedelta(seconds=self.url_ttl),
+            content_disposition=f'inline; filename="{_safe_filename(name)}"' if name else None,
+        )
+        return f"{self.container_client.url}/{key}?{sas}"
+
+    async def close(self) -> None:
+        await self.container_client.close()
+
+
+def mount_element_route(app, storage: ElementStorage) -> None:
+    """Serve ELEMENT_ROUTE on the Chainlit FastAPI app as redirects to signed blob URLs."""
+    from fastapi import Depends, HTTPException
+    from fastapi.responses import RedirectResponse
+    from chainlit.auth import get_current_user
+
+    # Like Chainlit's own file routes, links are only signed for a logged-in user when the app has authentication
+    @app.get(ELEMENT_ROUTE + "/{key:path}")
+    async def element_redirect(key: str, name: Optional[str] = None, current_user=Depends(get_current_user)):
+        try:
+            url = storage.signed_url(key, name)
+        except ValueError:
+            raise HTTPException(status_code=404)
+        # Browsers may reuse the redirect while the signature is still valid
+        return RedirectResponse(url, status_code=307, headers={"Cache-Control": f"private, max-age={storage.url_ttl // 2}"})
+
+
+_storage: Optional[ElementStorage] = None
+
+
+def get_element_storage() -> Optional[ElementStorage]:
+    global _storage
+    if _storage is None and ELEMENT_STORAGE_CONNECTION_STRING:
+        _storage = ElementStorage(ELEMENT_STORAGE_CONNECTION_STRING)
+        print(f"Element storage: {_storage.container_client.url}")
+    return _storage
@@ -0,0 +1,263 @@
+"""Batch evaluation of the AURA agent against the starters and extra cases.
+
+    python evaluate_agent.py run --label baseline
+    python evaluate_agent.py run --label v2 --instructions ../data/ASSISTANT-INSTRUCTIONS.MD
+    python evaluate_agent.py run --label dry-run --fake
+    python evaluate_agent.py diff eval-results/baseline.jsonl eval-results/v2.jsonl
+"""
+from dotenv import load_dotenv
+load_dotenv()
+
+import os
+import json
+import time
+import random
+import asyncio
+import hashlib
+import argparse
+from dataclasses import dataclass, field, asdict
+from typing import Dict, List, Optional
+
+import yaml
+
+from rate_limiter import Priority, azure_client_options
+
+DATA_DIR = os.path.join(os.path.dirname(__file__), "../data")
+STARTERS_PATH = os.path.join(os.path.dirname(__file__), "starters.yaml")
+CASES_PATH = os.path.join(DATA_DIR, "eval-cases.yaml")
+RESULTS_DIR = "eval-results"
+
+
+@dataclass
+class EvalCase:
+    id: str
+    message: str
+    expect: Dict = field(default_factory=dict)
+
+
+@dataclass
+class EvalResult:
+    case_id: str
+    label: str
+    instructions_hash: Optional[str]
+    status: str
+    latency_ms: int
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    tool_calls: List[str] = field(default_factory=list)
+    citations: List[str] = field(default_factory=list)
+    answer: str = ""
+    passed: bool = False
+    failures: List[str] = field(default_factory=list)
+
+
+def load_cases(paths: List[str]) -> List[EvalCase]:
+    cases = []
+    for path in paths:
+        with open(path, "r", encoding="utf-8") as f:
+            for entry in yaml.safe_load(f) or []:
+                cases.append(EvalCase(id=entry["id"], message=entry["message"], expect=entry.get("expect", {})))
+    return cases
+
+
+def check_expectations(case: EvalCase, result: EvalResult) -> None:
+    failures = []
+    if result.status != "completed":
+        failures.append(f"run {result.status}")
+    for phrase in case.expect.get("contains", []):
+        if phrase.lower() not in result.answer.lower():
+            failures.append(f"missing '{phrase}'")
+    wants_citations = case.expect.get("citations")
+    if wants_citations is True and not result.citations:
+        failures.append("no citations")
+    if wants_citations is False and result.citations:
+        failures.append("unexpected citations")
+    result.failures = failures
+    result.passed = not failures
+
+
+class AgentTarget:
+    """Runs each case on a fresh thread of the deployed agent."""
+
+    def __init__(self, agents_client, agent_id: str, instructions: Optional[str] = None) -> None:
+        self.agents_client = agents_client
+        self.agent_id = agent_id
+        # Passed as a run override, so the deployed agent isn't modified
+        self.instructions = instructions
+
+    async def run(self, case: EvalCase) -> Dict:
+        thread = await self.agents_client.threads.create()
+        try:
+            await self.agents_client.messages.create(thread_id=thread.id, role="user", content=case.message)
+            run = await self.agents_client.runs.create_and_process(
+                thread_id=thread.id, agent_id=self.agent_id, instructions=self.instructions
+            )
+            tool_calls = []
+            async for run_step in self.agents_client.run_steps.list(thread_id=thread.id, run_id=run.id):
+                for tool_call in getattr(run_step.step_details, "tool_calls", None) or []:
+                    tool_calls.append(tool_call.type)
+            answer, citations = "", []
+            async for message in self.agents_client.messages.list(thread_id=thread.id, run_id=run.id):
+                if message.role != "user":
+                    answer += "".join(content.text.value for content in message.text_messages)
+                    citations += [
+                        annotation.url_citation.title or annotation.url_citation.url
+                        for annotation in message.url_citation_annotations
+                    ]
+                    citations += [annotation.file_citation.file_id for annotation in message.file_citation_annotations]
+            return {
+                "status": run.status,
+                "prompt_tokens": run.usage.prompt_tokens if run.usage else 0,
+                "completion_tokens": run.usage.completion_tokens if run.usage else 0,
+                "tool_calls": tool_calls,
+                "citations": citations,
+                "answer": answer,
+            }
+        finally:
+            await self.agents_client.threads.delete(thread.id)
+
+
+class FakeTarget:
+    """Local stand-in for the agent, for dry runs of the runner and the diff output."""
+
+    def __init__(self, instructions: Optional[str] = None) -> None:
+        self.instructions = instructions or ""
+
+    async def run(self, case: EvalCase) -> Dict:
+        seed = int(hashlib.sha256((self.instructions + case.id).encode("utf-8")).hexdigest(), 16)
+        rng = random.Random(seed)
+        await asyncio.sleep(rng.uniform(0.05, 0.2))
+        return {
+            "status": "completed",
+            "prompt_tokens": len(self.instructions.split()) + len(case.message.split()),
+            "completion_tokens": rng.randint(50, 400),
+            "tool_calls": ["azure_ai_search"] if rng.random() > 0.2 else [],
+            "citations": [f"doc-{rng.randint(1, 20)}"] if rng.random() > 0.3 else [],
+            "answer": f"Fake answer to: {case.message}",
+        }
+
+
+async def run_cases(target, cases: List[EvalCase], label: str, instructions: Optional[str], concurrency: int) -> List[EvalResult]:
+    semaphore = asyncio.Semaphore(concurrency)
+    instructions_hash = hashlib.sha256(instructions.encode("utf-8")).hexdigest()[:12] if instructions else None
+
+    async def run_case(case: EvalCase) -> EvalResult:
+        async with semaphore:
+            start = time.perf_counter()
+            try:
+                outcome = await target.run(case)
+            except Exception as e:
+                outcome = {"status": "error", "answer": str(e)}
+            result = EvalResult(
+                case_id=case.id,
+                label=label,
+                instructions_hash=instructions_hash,
+                latency_ms=int((time.perf_counter() - start) * 1000),
+                **outcome,
+            )
+            check_expectations(case, result)
+            print(f"{'PASS' if result.passed else 'FAIL'} {case.id} ({result.latency_ms} ms) {', '.join(result.failures)}")
+            return result
+
+    return await asyncio.gather(*[run_case(case) for case in cases])
+
+
+def summarize(results: List[EvalResult]) -> Dict:
+    latencies = sorted(result.latency_ms for result in results)
+    return {
+        "cases": len(results),
+        "passed": sum(result.passed for result in results),
+        "p50_latency_ms": latencies[len(latencies) // 2] if latencies else 0,
+        "p95_latency_ms": latencies[min(int(len(latencies) * 0.95), len(latencies) - 1)] if latencies else 0,
+        "prompt_tokens": sum(result.prompt_tokens for result in results),
+        "completion_tokens": sum(result.completion_tokens for result in results),
+        "tool_calls": sum(len(result.tool_calls) for result in results),
+        "citations": sum(len(result.citations) for result in results),
+    }
+
+
+def write_results(results: List[EvalResult], label: str, output_dir: str = RESULTS_DIR) -> str:
+    os.makedirs(output_dir, exist_ok=True)
+    path = os.path.join(output_dir, f"{label}.jsonl")
+    with open(path, "w", encoding="utf-8") as f:
+        for result in results:
+            f.write(json.dumps(asdict(result)) + "\n")
+    return path
+
+
+def read_results(path: str) -> Dict[str, Dict]:
+    with open(path, "r", encoding="utf-8") as f:
+        return {entry["case_id"]: entry for entry in map(json.loads, f)}
+
+
+def diff_results(before_path: str, after_path: str) -> None:
+    before, after = read_results(before_path), read_results(after_path)
+    print(f"{'case':<28}{'pass':>12}{'latency ms':>18}{'tokens':>18}{'tools':>10}{'cites':>10}")
+    for case_id in sorted(set(before) | set(after)):
+        old, new = before.get(case_id), after.get(case_id)
+        if not old or not new:
+            print(f"{case_id:<28}{'only in ' + ('after' if new else 'before'):>12}")
+            continue
+        old_tokens = old["prompt_tokens"] + old["completion_tokens"]
+        new_tokens = new["prompt_tokens"] + new["completion_tokens"]
+        passed = f"{'y' if old['passed'] else 'n'}->{'y' if new['passed'] else 'n'}"
+        print(
+            f"{case_id:<28}{passed:>12}"
+            f"{old['latency_ms']:>9}{new['latency_ms'] - old['latency_ms']:>+9}"
+            f"{old_tokens:>9}{new_tokens - old_tokens:>+9}"
+            f"{len(new['tool_calls']) - len(old['tool_calls']):>+10}"
+            f"{len(new['citations']) - len(old['citations']):>+10}"
+        )
+
+
+async def run_evaluation(args) -> None:
+    instructions = None
+    if args.instructions:
+        with open(args.instructions, "r", encoding="utf-8") as f:
+            instructions = f.read()
+    cases = load_cases(args.cases)
+
+    if args.fake:
+        results = await run_cases(FakeTarget(instructions), cases, args.label, instructions, args.concurrency)
+    else:
+        from azure.ai.agents.aio import AgentsClient
+        from azure.identity.aio import DefaultAzureCredential
+
+        # Batch priority leaves headroom for live chat traffic on the same deployment
+        async with DefaultAzureCredential() as credential, AgentsClient(
+            endpoint=os.environ["AIPROJECT_ENDPOINT"],
+            credential=credential,
+            **azure_client_options(priority=Priority.BATCH),
+        ) as agents_client:
+            target = AgentTarget(agents_client, os.environ["ASSISTANT_ID"], instructions)
+            results = await run_cases(target, cases, args.label, instructions, args.concurrency)
+
+    path = write_results(results, args.label)
+    print(json.dumps(summarize(results), indent=2))
+    print(f"Results written to {path}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Batch evaluation for the AURA agent")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = subparsers.add_parser("run", help="Run the cases against the agent")
+    run_parser.add_argument("--label", required=True, help="Name of this run, used for the results file")
+    run_parser.add_argument("--instructions", help="Instructions file to use instead of the agent's current ones")
+    run_parser.add_argument("--cases", nargs="+", default=[STARTERS_PATH, CASES_PATH])
+    run_parser.add_argument("--concurrency", type=int, default=int(os.getenv("EVAL_CONCURRENCY", "8")))
+    run_parser.add_argument("--fake", action="store_true", help="Use a local fake instead of the deployed agent")
+
+    diff_parser = subparsers.add_parser("diff", help="Compare two result files")
+    diff_parser.add_argument("before")
+    diff_parser.add_argument("after")
+
+    args = parser.parse_args()
+    if args.command == "run":
+        asyncio.run(run_evaluation(args))
+    else:
+        diff_results(args.before, args.after)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,405 @@
+"""Chunking, indexing and hybrid search of the event descriptions the EventsAgent answers from.
+
+    python event_index.py                     # index event-descriptions.md
+    python event_index.py events.md --dry-run # chunk only, print what would be indexed
+"""
+import os
+import re
+import hashlib
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Callable, Dict, Iterable, List, Optional
+
+from dotenv import load_dotenv
+from openai import AzureOpenAI
+
+from rate_limiter import Priority, azure_client_options, openai_http_client
+
+from azure.core.credentials import AzureKeyCredential
+from azure.search.documents import SearchClient
+from azure.search.documents.indexes import SearchIndexClient
+from azure.search.documents.models import VectorizedQuery
+from azure.search.documents.indexes.models import (
+    SearchIndex,
+    SimpleField,
+    SearchField,
+    SearchableField,
+    SearchFieldDataType,
+    VectorSearch,
+    VectorSearchProfile,
+    HnswAlgorithmConfiguration,
+)
+
+# Load environment variables
+load_dotenv()
+
+EVENT_INDEX_NAME = "event-descriptions"
+EMBEDDING_DEPLOYMENT = os.getenv("AZURE_OPENAI_EMBEDDING_DEPLOYMENT_NAME")
+EMBEDDING_DIMENSIONS = int(os.getenv("AZURE_OPENAI_EMBEDDING_DIMENSIONS", "1536"))
+EMBEDDING_BATCH_SIZE = int(os.getenv("EVENT_INDEX_EMBEDDING_BATCH_SIZE", "16"))
+CHUNK_MAX_TOKENS = int(os.getenv("EVENT_INDEX_CHUNK_MAX_TOKENS", "300"))
+CHUNK_OVERLAP_TOKENS = int(os.getenv("EVENT_INDEX_CHUNK_OVERLAP_TOKENS", "40"))
+# Searches run in parallel for one search_events_many call, extra queries beyond the cap are dropped
+MULTI_QUERY_CONCURRENCY = int(os.getenv("EVENT_SEARCH_CONCURRENCY", "4"))
+MULTI_QUERY_MAX_QUERIES = int(os.getenv("EVENT_SEARCH_MAX_QUERIES", "8"))
+# Damping constant of reciprocal rank fusion, 60 as in the original paper and Azure AI Search's own hybrid ranking
+RRF_K = 60
+
+VECTOR_FIELD = "content_vector"
+VECTOR_PROFILE = "events-vector-profile"
+SELECT_FIELDS = ["id", "title", "date", "location", "tags", "content"]
+
+# Technologies we tag chunks with so the EventsAgent can filter on them
+TECHNOLOGY_TAGS = [
+    "AI", "Agents", "Azure", "C#", ".NET", "Copilot", "Docker", "GitHub", "Java",
+    "JavaScript", "Kubernetes", "LLM", "Machine Learning", "OpenAI", "Python",
+    "React", "Rust", "Semantic Kernel", "TypeScript",
+]
+
+DATE_PATTERN = re.compile(
+    r"\b(\d{4}-\d{2}-\d{2}"
+    r"|(?:Jan|Feb|Mar|Apr|May|Jun|Jul|Aug|Sep|Oct|Nov|Dec)[a-z]*\.? \d{1,2}(?:\s*[-–]\s*\d{1,2})?,? \d{4})"
+)
+LOCATION_PATTERN = re.compile(r"(?:Location|Where|Venue)\s*[:\-]\s*\**\s*(.{1,100})", re.IGNORECASE)
+HEADING_PATTERN = re.compile(r"^#{1,6}\s+(.*)$", re.MULTILINE)
+
+EmbedFunction = Callable[[List[str]], List[List[float]]]
+
+
+@dataclass
+class EventChunk:
+    id: str
+    parent_id: str
+    title: str
+    content: str
+    date: Optional[str] = None
+    location: Optional[str] = None
+    tags: List[str] = field(default_factory=list)
+    content_vector: Optional[List[float]] = None
+
+    def to_document(self) -> Dict:
+        document = {
+            "id": self.id,
+            "parent_id": self.parent_id,
+            "title": self.title,
+            "content": self.content,
+            "date": self.date,
+            "location": self.location,
+            "tags": self.tags,
+        }
+        if self.content_vector is not None:
+            document[VECTOR_FIELD] = self.content_vector
+        return document
+
+
+def _split_token_window(text: str, max_tokens: int, overlap: int) -> List[str]:
+    # Whitespace tokens are close enough to model tokens for sizing chunks
+    words = text.split()
+    if len(words) <= max_tokens:
+        return [text]
+    windows = []
+    step = max(max_tokens - overlap, 1)
+    for start in range(0, len(words), step):
+        windows.append(" ".join(words[start:start + max_tokens]))
+        if start + max_tokens >= len(words):
+            break
+    return windows
+
+
+def _split_headings(section: str) -> List[tuple]:
+    """Split a section on markdown headings, returning (title, body) pairs."""
+    matches = list(HEADING_PATTERN.finditer(section))
+    if not matches:
+        return [("", section)]
+    parts = []
+    if matches[0].start() > 0 and section[:matches[0].start()].strip():
+        parts.append(("", section[:matches[0].start()]))
+    for i, match in enumerate(matches):
+        end = matches[i + 1].start() if i + 1 < len(matches) else len(section)
+        parts.append((match.group(1).strip(), section[match.start():end]))
+    return parts
+
+
+def extract_metadata(text: str) -> Dict:
+    """Pull the structured fields (date, location, technology tags) out of an event description."""
+    date_match = DATE_PATTERN.search(text)
+    location_match = LOCATION_PATTERN.search(text)
+    lowered = text.lower()
+    tags = [
+        tag for tag in TECHNOLOGY_TAGS
+        if re.search(rf"(?<![\w.#]){re.escape(tag.lower())}(?![\w#])", lowered)
+    ]
+    return {
+        "date": date_match.group(1) if date_match else None,
+        "location": location_match.group(1).strip().strip("*").strip() if location_match else None,
+        "tags": tags,
+    }
+
+
+def chunk_events(
+    markdown_content: str,
+    source: str = "event-descriptions.md",
+    max_tokens: int = CHUNK_MAX_TOKENS,
+    overlap: int = CHUNK_OVERLAP_TOKENS,
+) -> List[EventChunk]:
+    """Chunk the events markdown by event (---), then heading, then token window."""
+    chunks = []
+    for section_index, section in enumerate(markdown_content.split("---")):
+        section = section.strip()
+        if not section:
+            continue
+        parent_id = hashlib.sha1(f"{source}:{section_index}".encode("utf-8")).hexdigest()[:16]
+        # Metadata usually sits at the top of the event, share it with every chunk
+        section_metadata = extract_metadata(section)
+        section_title = next((m.group(1).strip() for m in HEADING_PATTERN.finditer(section)), "")
+        for title, body in _split_headings(section):
+            for window in _split_token_window(body.strip(), max_tokens, overlap):
+                if not window:
+                    continue
+                metadata = extract_metadata(window)
+                chunk_id = hashlib.sha1(f"{parent_id}:{window}".encode("utf-8")).hexdigest()[:32]
+                chunks.append(EventChunk(
+                    id=chunk_id,
+                    parent_id=parent_id,
+                    title=title or section_title,
+                    content=window,
+                    date=metadata["date"] or section_metadata["date"],
+                    location=metadata["location"] or section_metadata["location"],
+                    tags=sorted(set(metadata["tags"]) | set(section_metadata["tags"])),
+                ))
+    return chunks
+
+
+def _batches(items: List, size: int) -> Iterable[List]:
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+class Embedder:
+    """Batch embedding function; close() releases the client when create_embedder opened it."""
+
+    def __init__(self, client: AzureOpenAI, deployment: str, owns_client: bool = False) -> None:
+        self.client = client
+        self.deployment = deployment
+        self.owns_client = owns_client
+
+    def __call__(self, texts: List[str]) -> List[List[float]]:
+        response = self.client.embeddings.create(model=self.deployment, input=texts)
+        return [item.embedding for item in sorted(response.data, key=lambda item: item.index)]
+
+    def close(self) -> None:
+        if self.owns_client:
+            self.client.close()
+
+
+def create_embedder(
+    client: Optional[AzureOpenAI] = None,
+    deployment: Optional[str] = EMBEDDING_DEPLOYMENT,
+    priority: Priority = Priority.INTERACTIVE,
+) -> Optional[Embedder]:
+    """Return a batch embedding function, or None when no embedding deployment is configured."""
+    if not deployment:
+        return None
+    if client is not None:
+        return Embedder(client, deployment)
+    client = AzureOpenAI(
+        azure_endpoint=os.getenv("AZURE_OPENAI_ENDPOINT"),
+        api_key=os.getenv("AZURE_OPENAI_API_KEY"),
+        api_version=os.getenv("AZURE_OPENAI_API_VERSION", "2024-06-01"),
+        http_client=openai_http_client(priority, sync=True),
+    )
+    return Embedder(client, deployment, owns_client=True)
+
+
+def embed_chunks(chunks: List[EventChunk], embed: EmbedFunction, batch_size: int = EMBEDDING_BATCH_SIZE) -> None:
+    """Fill in content vectors, one embeddings request per batch of chunks."""
+    for batch in _batches(chunks, batch_size):
+        vectors = embed([f"{chunk.title}\n{chunk.content}" for chunk in batch])
+        for chunk, vector in zip(batch, vectors):
+            chunk.content_vector = vector
+
+
+def build_event_index(index_name: str, dimensions: int = EMBEDDING_DIMENSIONS) -> SearchIndex:
+    fields = [
+        SimpleField(name="id", type=SearchFieldDataType.String, key=True),
+        SimpleField(name="parent_id", type=SearchFieldDataType.String, filterable=True),
+        SearchableField(name="title", type=SearchFieldDataType.String),
+        SearchableField(name="content", type=SearchFieldDataType.String),
+        SimpleField(name="date", type=SearchFieldDataType.String, filterable=True, sortable=True),
+        SearchableField(name="location", type=SearchFieldDataType.String, filterable=True),
+        SearchableField(
+            name="tags",
+            type=SearchFieldDataType.Collection(SearchFieldDataType.String),
+            filterable=True,
+            facetable=True,
+        ),
+        SearchField(
+            name=VECTOR_FIELD,
+            type=SearchFieldDataType.Collection(SearchFieldDataType.Single),
+            searchable=True,
+            vector_search_dimensions=dimensions,
+            vector_search_profile_name=VECTOR_PROFILE,
+        ),
+    ]
+    vector_search = VectorSearch(
+        algorithms=[HnswAlgorithmConfiguration(name="events-hnsw")],
+        profiles=[VectorSearchProfile(name=VECTOR_PROFILE, algorithm_configuration_name="events-hnsw")],
+    )
+    return SearchIndex(name=index_name, fields=fields, vector_search=vector_search)
+
+
+def ingest_events(
+    markdown_path: str,
+    index_name: str,
+    search_client: SearchClient,
+    index_client: SearchIndexClient,
+    embed: Optional[EmbedFunction] = None,
+) -> List[EventChunk]:
+    """Chunk, embed and upload the events markdown, removing chunks that no longer exist."""
+    index_client.create_or_update_index(build_event_index(index_name))
+
+    with open(markdown_path, "r") as f:
+        chunks = chunk_events(f.read(), source=os.path.basename(markdown_path))
+    if embed:
+        embed_chunks(chunks, embed)
+    else:
+        print("No embedding deployment configured, indexing events for keyword search only")
+
+    # Chunk ids are content hashes, so only stale chunks need deleting
+    current_ids = {chunk.id for chunk in chunks}
+    try:
+        existing_ids = {doc["id"] for doc in search_client.search("*", select=["id"])}
+        stale_ids = existing_ids - current_ids
+        if stale_ids:
+            search_client.delete_documents(documents=[{"id": doc_id} for doc_id in stale_ids])
+            print(f"Removed {len(stale_ids)} stale event chunks")
+    except Exception as e:
+        print(f"Warning: Failed to clear stale event chunks: {str(e)}")
+
+    for batch in _batches(chunks, 500):
+        search_client.merge_or_upload_documents(documents=[chunk.to_document() for chunk in batch])
+    print(f"Uploaded {len(chunks)} event chunks to index")
+    return chunks
+
+
+def hybrid_search(
+    search_client: SearchClient,
+    query: str,
+    embed: Optional[EmbedFunction] = None,
+    top: int = 5,
+    filter: Optional[str] = None,
+    vector: Optional[List[float]] = None,
+) -> List[Dict]:
+    """BM25 + vector search over the event chunks, returning only the projected fields."""
+    if vector is None and embed:
+        vector = embed([query])[0]
+    vector_queries = None
+    if vector is not None:
+        vector_queries = [VectorizedQuery(vector=vector, k_nearest_neighbors=top, fields=VECTOR_FIELD)]
+    results = search_client.search(
+        search_text=query,
+        vector_queries=vector_queries,
+        select=SELECT_FIELDS,
+        filter=filter,
+        top=top,
+    )
+    return [dict(result) for result in results]
+
+
+def reciprocal_rank_fusion(result_lists: Iterable[List[Dict]], k: int = RRF_K) -> List[Dict]:
+    """Merge ranked result lists into one, deduplicated by document id.
+
+    Each document scores 1 / (k + rank) for every list it appears in, so
+    chunks several queries agree on rise above any single query's top hit.
+    """
+    scores: Dict[str, float] = {}
+    documents: Dict[str, Dict] = {}
+    for results in result_lists:
+        for rank, result in enumerate(results, start=1):
+            scores[result["id"]] = scores.get(result["id"], 0.0) + 1.0 / (k + rank)
+            documents.setdefault(result["id"], result)
+    # sorted is stable, ties keep the order they were first found in
+    return sorted(documents.values(), key=lambda result: scores[result["id"]], reverse=True)
+
+
+_search_pool: Optional[ThreadPoolExecutor] = None
+
+
+def multi_query_search(
+    search_client: SearchClient,
+    queries: List[str],
+    embed: Optional[EmbedFunction] = None,
+    top: int = 5,
+    limit: int = 10,
+) -> List[Dict]:
+    """Run several hybrid searches at once and fuse their results with reciprocal rank fusion."""
+    global _search_pool
+    unique = list(dict.fromkeys(query.strip() for query in queries if query and query.strip()))[:MULTI_QUERY_MAX_QUERIES]
+    if not unique:
+        return []
+    # One embeddings request for every query instead of one per search
+    vectors = embed(unique) if embed else [None] * len(unique)
+    if _search_pool is None:
+        _search_pool = ThreadPoolExecutor(max_workers=MULTI_QUERY_CONCURRENCY, thread_name_prefix="event-search")
+    futures = [
+        _search_pool.submit(hybrid_search, search_client, query, top=top, vector=vector)
+        for query, vector in zip(unique, vectors)
+    ]
+    result_lists, errors = [], []
+    for query, future in zip(unique, futures):
+        try:
+            result_lists.append(future.result())
+        except Exception as e:
+            print(f"Event search failed for {query!r}: {str(e)}")
+            errors.append(e)
+    # A failed query only loses its own hits, unless every query failed
+    if errors and not result_lists:
+        raise errors[0]
+    return reciprocal_rank_fusion(result_lists)[:limit]
+
+
+def format_event(result: Dict) -> str:
+    details = [f"Event: {result.get('title') or 'Untitled'}"]
+    if result.get("date"):
+        details.append(f"Date: {result['date']}")
+    if result.get("location"):
+        details.append(f"Location: {result['location']}")
+    if result.get("tags"):
+        details.append(f"Technologies: {', '.join(result['tags'])}")
+    details.append(result.get("content", ""))
+    return "\n".join(details)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Chunk, embed and index the event descriptions")
+    parser.add_argument("path", nargs="?", default="event-descriptions.md")
+    parser.add_argument("--index", default=EVENT_INDEX_NAME)
+    parser.add_argument("--dry-run", action="store_true", help="Chunk without touching the index")
+    args = parser.parse_args()
+
+    if args.dry_run:
+        with open(args.path, "r") as f:
+            chunks = chunk_events(f.read(), source=os.path.basename(args.path))
+        for chunk in chunks:
+            print(f"{chunk.id} {chunk.title!r} date={chunk.date} location={chunk.location} tags={chunk.tags}")
+        print(f"{len(chunks)} chunks")
+        return
+
+    endpoint = os.environ["AZURE_SEARCH_SERVICE_ENDPOINT"]
+    credential = AzureKeyCredential(os.environ["AZURE_SEARCH_API_KEY"])
+    # Batch priority leaves search and embedding quota for live chat traffic
+    search_client = SearchClient(endpoint, args.index, credential, **azure_client_options("search", Priority.BATCH, sync=True))
+    index_client = SearchIndexClient(endpoint, credential, **azure_client_options("search", Priority.BATCH, sync=True))
+    embed = create_embedder(priority=Priority.BATCH)
+    try:
+        ingest_events(args.path, args.index, search_client, index_client, embed=embed)
+    finally:
+        search_client.close()
+        index_client.close()
+        if embed:
+            embed.close()
+
+
+if __name__ == "__main__":
+    main()
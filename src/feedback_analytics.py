@@ -0,0 +1,139 @@
+"""Feedback dashboard queries, and the job that keeps their rollups current.
+
+    python feedback_analytics.py          # refresh the dirty days every FEEDBACK_ROLLUP_REFRESH_SECONDS
+    python feedback_analytics.py --once   # one refresh, e.g. from cron
+"""
+from dotenv import load_dotenv
+load_dotenv()
+
+import os
+import asyncio
+import argparse
+from datetime import date, timedelta
+from typing import Dict, List, Optional
+
+import asyncpg
+
+DATABASE_URL = os.getenv("DATABASE_URL")
+# The rollups lag Feedback writes by at most this long
+FEEDBACK_ROLLUP_REFRESH_SECONDS = int(os.getenv("FEEDBACK_ROLLUP_REFRESH_SECONDS", "60"))
+
+# All dashboard queries read "FeedbackRollup" (see the feedback_rollups migration),
+# never Feedback joined to Step and Thread.
+RATE_BY_AGENT = """
+SELECT "agentName" AS agent,
+       SUM("count")::INT AS feedback,
+       SUM("positive")::INT AS positive,
+       SUM("negative")::INT AS negative,
+       SUM("positive")::FLOAT / NULLIF(SUM("count"), 0) AS thumbs_up_rate
+FROM "FeedbackRollup"
+WHERE "day" >= $1 AND "day" < $2 AND ($3::TEXT IS NULL OR "feedbackName" = $3)
+GROUP BY "agentName"
+ORDER BY feedback DESC
+"""
+
+DAILY = """
+SELECT "day",
+       SUM("count")::INT AS feedback,
+       SUM("positive")::INT AS positive,
+       SUM("positive")::FLOAT / NULLIF(SUM("count"), 0) AS thumbs_up_rate
+FROM "FeedbackRollup"
+WHERE "day" >= $1 AND "day" < $2 AND ($3::TEXT IS NULL OR "agentName" = $3)
+GROUP BY "day"
+ORDER BY "day"
+"""
+
+RATE_BY_STEP_TYPE = """
+SELECT "stepType"::TEXT AS step_type,
+       SUM("count")::INT AS feedback,
+       SUM("positive")::FLOAT / NULLIF(SUM("count"), 0) AS thumbs_up_rate,
+       SUM("commented")::INT AS commented
+FROM "FeedbackRollup"
+WHERE "day" >= $1 AND "day" < $2
+GROUP BY "stepType"
+ORDER BY feedback DESC
+"""
+
+
+def _window(since: Optional[date], until: Optional[date], days: int = 30):
+    until = until or date.today() + timedelta(days=1)
+    return since or until - timedelta(days=days), until
+
+
+class FeedbackAnalytics:
+    """Dashboard queries over the feedback rollups.
+
+    Rows are grouped by the name of the rated step, which is the agent that
+    wrote the message. Renaming a step after it was rated only shows up once
+    a new feedback on that day marks the day dirty again.
+    """
+
+    def __init__(self, pool: asyncpg.Pool) -> None:
+        self.pool = pool
+        self._task: Optional[asyncio.Task] = None
+
+    @classmethod
+    async def connect(cls, database_url: Optional[str] = DATABASE_URL) -> "FeedbackAnalytics":
+        if not database_url:
+            raise ValueError("DATABASE_URL environment variable is not set.")
+        return cls(await asyncpg.create_pool(database_url, min_size=1, max_size=4))
+
+    async def refresh(self) -> int:
+        """Recompute the days with new, changed or deleted feedback. Returns the number of days."""
+        async with self.pool.acquire() as connection:
+            return await connection.fetchval('SELECT "refresh_feedback_rollup"()')
+
+    def start_refresher(self, interval: int = FEEDBACK_ROLLUP_REFRESH_SECONDS) -> None:
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run(interval))
+
+    async def _run(self, interval: int) -> None:
+        while True:
+            try:
+                days = await self.refresh()
+                if days:
+                    print(f"Refreshed feedback rollups for {days} days")
+            except Exception as e:
+                print(f"Could not refresh feedback rollups: {str(e)}")
+            await asyncio.sleep(interval)
+
+    async def _fetch(self, query: str, *args) -> List[Dict]:
+        async with self.pool.acquire() as connection:
+            return [dict(row) for row in await connection.fetch(query, *args)]
+
+    async def rate_by_agent(self, since: Optional[date] = None, until: Optional[date] = None, feedback_name: Optional[str] = None) -> List[Dict]:
+        return await self._fetch(RATE_BY_AGENT, *_window(since, until), feedback_name)
+
+    async def daily(self, since: Optional[date] = None, until: Optional[date] = None, agent: Optional[str] = None) -> List[Dict]:
+        return await self._fetch(DAILY, *_window(since, until), agent)
+
+    async def rate_by_step_type(self, since: Optional[date] = None, until: Optional[date] = None) -> List[Dict]:
+        return await self._fetch(RATE_BY_STEP_TYPE, *_window(since, until))
+
+    async def close(self) -> None:
+        if self._task:
+            self._task.cancel()
+            self._task = None
+        await self.pool.close()
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser(description="Refresh the feedback rollups the dashboard queries read")
+    parser.add_argument("--database-url", default=DATABASE_URL)
+    parser.add_argument("--once", action="store_true", help="Refresh once and exit")
+    parser.add_argument("--interval", type=int, default=FEEDBACK_ROLLUP_REFRESH_SECONDS, help="Seconds between refreshes")
+    args = parser.parse_args()
+
+    analytics = await FeedbackAnalytics.connect(args.database_url)
+    try:
+        if args.once:
+            print(f"Refreshed feedback rollups for {await analytics.refresh()} days")
+            return
+        analytics.start_refresher(args.interval)
+        await analytics._task
+    finally:
+        await analytics.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,204 @@
+import os
+import json
+import base64
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+import plotly
+
+MAX_POINTS_PER_TRACE = int(os.getenv("PLOTLY_MAX_POINTS_PER_TRACE", "4000"))
+CACHE_SIZE = int(os.getenv("PLOTLY_FIGURE_CACHE_SIZE", "64"))
+# Line-like traces keep their shape best with LTTB, markers with min/max per bucket
+LTTB_MODES = ("lines", "lines+markers")
+DOWNSAMPLED_TYPES = ("scatter", "scattergl")
+# Per-point trace attributes that must be sliced along with x and y
+PER_POINT_KEYS = ("text", "hovertext", "customdata", "ids")
+PER_POINT_MARKER_KEYS = ("color", "size", "symbol", "opacity")
+
+# file_id -> (reduced figure JSON, report)
+_figure_cache: "OrderedDict[str, Tuple[str, Dict]]" = OrderedDict()
+
+
+def _decode_array(value):
+    """Plotly 6 writes numeric arrays as base64 typed arrays, turn them back into numpy."""
+    if isinstance(value, dict) and "bdata" in value:
+        array = np.frombuffer(base64.b64decode(value["bdata"]), dtype=np.dtype(value["dtype"]))
+        if "shape" in value:
+            array = array.reshape([int(n) for n in str(value["shape"]).split(",")])
+        return array
+    return value
+
+
+def _numeric_x(x, length: int) -> np.ndarray:
+    """X positions as float64 - numbers as-is, dates as epoch ns, categories as their index."""
+    if x is None:
+        return np.arange(length, dtype=np.float64)
+    array = np.asarray(x)
+    if np.issubdtype(array.dtype, np.number):
+        return array.astype(np.float64)
+    try:
+        return array.astype("datetime64[ns]").astype(np.int64).astype(np.float64)
+    except (ValueError, TypeError):
+        return np.arange(length, dtype=np.float64)
+
+
+def _numeric_y(values) -> Optional[np.ndarray]:
+    """Y values as float64 with gaps as NaN, None when they aren't numbers (e.g. a categorical axis)."""
+    array = np.asarray(values)
+    if array.ndim != 1:
+        return None
+    if array.dtype.kind in "biuf":
+        return array.astype(np.float64)
+    if array.dtype == object and all(value is None or isinstance(value, (int, float)) for value in array):
+        return np.array([np.nan if value is None else value for value in array], dtype=np.float64)
+    return None
+
+
+def _implicit_x(trace: Dict, indices: np.ndarray):
+    """Positions of the kept points of a trace without x, which plotly places at x0 + i * dx."""
+    x0, dx = trace.get("x0", 0), trace.get("dx", 1)
+    if isinstance(x0, (int, float)):
+        return (x0 + indices * dx).tolist()
+    try:
+        # Date axes take x0 as a date and dx in milliseconds
+        start = np.datetime64(x0, "ms")
+    except (ValueError, TypeError):
+        return None
+    return [str(value) for value in start + (indices * dx).astype("timedelta64[ms]")]
+
+
+def minmax_indices(y: np.ndarray, n_out: int) -> np.ndarray:
+    """Keep the min and max of each bucket, fully vectorized over a reshaped array."""
+    n = len(y)
+    buckets = max(n_out // 2, 1)
+    size = int(np.ceil(n / buckets))
+    padded = np.full(buckets * size, np.nan)
+    padded[:n] = y
+    grid = padded.reshape(buckets, size)
+    offsets = np.arange(buckets) * size
+    # All-NaN buckets (only possible in the padding) fall back to the bucket start
+    filled = np.where(np.isnan(grid), np.inf, grid)
+    low = np.argmin(filled, axis=1) + offsets
+    filled = np.where(np.isnan(grid), -np.inf, grid)
+    high = np.argmax(filled, axis=1) + offsets
+    indices = np.unique(np.concatenate([[0, n - 1], low, high]))
+    return indices[indices < n]
+
+
+def lttb_indices(x: np.ndarray, y: np.ndarray, n_out: int) -> np.ndarray:
+    """Largest-Triangle-Three-Buckets. Bucket means come from cumulative sums and each
+    bucket's triangle areas are a single NumPy expression."""
+    n = len(y)
+    if n_out >= n or n_out < 3:
+        return np.arange(n)
+    y = np.nan_to_num(y)
+    edges = np.floor(np.linspace(1, n - 1, n_out - 1)).astype(np.int64)
+    counts = np.diff(edges)
+    sum_x = np.concatenate([[0.0], np.cumsum(x)])
+    sum_y = np.concatenate([[0.0], np.cumsum(y)])
+    mean_x = (sum_x[edges[1:]] - sum_x[edges[:-1]]) / counts
+    mean_y = (sum_y[edges[1:]] - sum_y[edges[:-1]]) / counts
+    # Each bucket is compared against the mean of the next one, the last against the final point
+    next_x = np.append(mean_x[1:], x[-1])
+    next_y = np.append(mean_y[1:], y[-1])
+
+    selected = np.empty(n_out, dtype=np.int64)
+    selected[0], selected[-1] = 0, n - 1
+    anchor = 0
+    for i in range(n_out - 2):
+        start, end = edges[i], edges[i + 1]
+        areas = np.abs(
+            (x[anchor] - next_x[i]) * (y[start:end] - y[anchor])
+            - (x[anchor] - x[start:end]) * (next_y[i] - y[anchor])
+        )
+        anchor = start + int(np.argmax(areas))
+        selected[i + 1] = anchor
+    return selected
+
+
+def _slice(value, indices: np.ndarray, length: int):
+    value = _decode_array(value)
+    if isinstance(value, (list, np.ndarray)) and len(value) == length:
+        return np.asarray(value, dtype=object if isinstance(value, list) else None)[indices].tolist()
+    return value
+
+
+def downsample_trace(trace: Dict, max_points: int = MAX_POINTS_PER_TRACE) -> bool:
+    """Downsample a scatter trace in place. Returns True if it was reduced."""
+    if trace.get("type", "scatter") not in DOWNSAMPLED_TYPES or "y" not in trace:
+        return False
+    y_values = _decode_array(trace["y"])
+    length = len(y_values)
+    if length <= max_points:
+        return False
+    y = _numeric_y(y_values)
+    if y is None:
+        return False
+    x_values = _decode_array(trace.get("x"))
+    if trace.get("mode", "lines") in LTTB_MODES:
+        indices = lttb_indices(_numeric_x(x_values, length), y, max_points)
+    else:
+        indices = minmax_indices(y, max_points)
+
+    if x_values is not None:
+        x = np.asarray(x_values)[indices].tolist()
+    else:
+        # Dropping points would shift the rest along an implicit x, so the kept positions are spelled out
+        x = _implicit_x(trace, indices)
+        if x is None:
+            return False
+        trace.pop("x0", None)
+        trace.pop("dx", None)
+    trace["x"] = x
+    trace["y"] = y[indices].tolist()
+    for key in PER_POINT_KEYS:
+        if key in trace:
+            trace[key] = _slice(trace[key], indices, length)
+    marker = trace.get("marker")
+    if isinstance(marker, dict):
+        for key in PER_POINT_MARKER_KEYS:
+            if key in marker:
+                marker[key] = _slice(marker[key], indices, length)
+    # WebGL renders the remaining points far faster than SVG
+    trace["type"] = "scattergl"
+    return True
+
+
+def downsample_figure(figure: Dict, max_points: int = MAX_POINTS_PER_TRACE) -> int:
+    """Downsample every large trace of a figure dict in place, returning how many were reduced."""
+    return sum(downsample_trace(trace, max_points) for trace in figure.get("data", []))
+
+
+def _as_text(file_content) -> str:
+    if isinstance(file_content, (bytes, bytearray)):
+        return file_content.decode("utf-8")
+    if isinstance(file_content, str):
+        return file_content
+    # Streamed downloads arrive as an iterator of byte chunks
+    return b"".join(file_content).decode("utf-8")
+
+
+def reduce_figure(file_id: str, file_content, max_points: int = MAX_POINTS_PER_TRACE):
+    """Return a browser-friendly plotly Figure for a code interpreter file, cached by file_id."""
+    if file_id in _figure_cache:
+        _figure_cache.move_to_end(file_id)
+        reduced_json, report = _figure_cache[file_id]
+        return plotly.io.from_json(reduced_json), report
+
+    original_json = _as_text(file_content)
+    figure = json.loads(original_json)
+    reduced_traces = downsample_figure(figure, max_points)
+    reduced_json = json.dumps(figure) if reduced_traces else original_json
+    report = {
+        "file_id": file_id,
+        "traces_reduced": reduced_traces,
+        "bytes_before": len(original_json.encode("utf-8")),
+        "bytes_after": len(reduced_json.encode("utf-8")),
+    }
+    print(f"Figure {file_id}: {reduced_traces} traces reduced, {report['bytes_before']} -> {report['bytes_after']} bytes")
+
+    _figure_cache[file_id] = (reduced_json, report)
+    if len(_figure_cache) > CACHE_SIZE:
+        _figure_cache.popitem(last=False)
+    return plotly.io.from_json(reduced_json), report
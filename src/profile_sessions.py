@@ -0,0 +1,103 @@
+"""Memory profile of simulated chat sessions, the way app_mcp_server.py holds them.
+
+    python profile_sessions.py --sessions 200 --turns 30
+    python profile_sessions.py --sessions 200 --turns 30 --no-cap
+"""
+import gc
+import json
+import random
+import asyncio
+import argparse
+import tracemalloc
+from typing import Dict, List
+
+from semantic_kernel.contents import ChatHistory, ChatMessageContent, AuthorRole
+from semantic_kernel.contents.function_call_content import FunctionCallContent
+from semantic_kernel.contents.function_result_content import FunctionResultContent
+
+from session_state import InMemorySessionState
+from session_memory import cap_history, rss_bytes
+
+WORDS = "agent azure python repository event hackathon search index kernel plugin github language".split()
+
+
+def _text(rng: random.Random, size: int) -> str:
+    words = []
+    while sum(len(word) + 1 for word in words) < size:
+        words.append(rng.choice(WORDS))
+    return " ".join(words)
+
+
+def simulate_turn(chat_history: ChatHistory, rng: random.Random, turn: int) -> None:
+    chat_history.add_user_message(_text(rng, 200))
+    call_id = f"call_{turn}"
+    chat_history.add_message(ChatMessageContent(
+        role=AuthorRole.ASSISTANT,
+        items=[FunctionCallContent(id=call_id, name="search_repositories", plugin_name="Github", arguments=json.dumps({"query": "user:octocat"}))],
+    ))
+    # Tool results (repo listings, READMEs) are the bulk of a real history
+    chat_history.add_message(ChatMessageContent(
+        role=AuthorRole.TOOL,
+        items=[FunctionResultContent(id=call_id, name="search_repositories", plugin_name="Github", result=_text(rng, 4000))],
+    ))
+    chat_history.add_assistant_message(_text(rng, 1500))
+
+
+async def build_sessions(state: InMemorySessionState, count: int, turns: int, cap: bool) -> List[Dict]:
+    sessions = []
+    for index in range(count):
+        rng = random.Random(index)
+        chat_history = ChatHistory()
+        session_key = f"session-{index}"
+        for turn in range(turns):
+            simulate_turn(chat_history, rng, turn)
+            if cap:
+                cap_history(chat_history)
+            await state.update(session_key, chat_history=chat_history.serialize())
+        sessions.append({"chat_history": chat_history, "session_key": session_key})
+    return sessions
+
+
+def report(label: str, before: tracemalloc.Snapshot, after: tracemalloc.Snapshot, sessions: int, top: int) -> None:
+    stats = after.compare_to(before, "lineno")
+    total = sum(stat.size_diff for stat in stats)
+    print(f"\n{label}: {total / 1024 / 1024:.1f} MB traced, {total / 1024 / max(sessions, 1):.1f} KB per session")
+    for stat in stats[:top]:
+        print(f"  {stat.size_diff / 1024:>10.1f} KB  {stat.traceback}")
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser(description="Memory profile of simulated chat sessions")
+    parser.add_argument("--sessions", type=int, default=100)
+    parser.add_argument("--turns", type=int, default=20)
+    parser.add_argument("--no-cap", action="store_true", help="Keep full histories, for a baseline")
+    parser.add_argument("--evict", type=float, default=0.5, help="Share of sessions to evict as idle")
+    parser.add_argument("--top", type=int, default=10)
+    args = parser.parse_args()
+
+    gc.collect()
+    rss_start = rss_bytes()
+    tracemalloc.start()
+    baseline = tracemalloc.take_snapshot()
+
+    # The in-memory snapshots are part of what a replica holds per session
+    state = InMemorySessionState()
+    sessions = await build_sessions(state, args.sessions, args.turns, cap=not args.no_cap)
+    gc.collect()
+    loaded = tracemalloc.take_snapshot()
+    rss_loaded = rss_bytes()
+    report("Live sessions", baseline, loaded, len(sessions), args.top)
+    print(f"  RSS {(rss_loaded - rss_start) / 1024 / max(len(sessions), 1):.1f} KB per session")
+
+    # What IdleSessionEvictor does: drop the live objects and the session's snapshot
+    evicted = int(len(sessions) * args.evict)
+    for session in sessions[:evicted]:
+        session.pop("chat_history")
+        await state.delete(session["session_key"])
+    gc.collect()
+    report(f"After evicting {evicted} idle sessions", baseline, tracemalloc.take_snapshot(), len(sessions), args.top)
+    tracemalloc.stop()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,106 @@
+import json
+import hashlib
+import textwrap
+from dataclasses import dataclass
+from typing import Dict, Optional
+
+
+def stable_text(text: str) -> str:
+    """Normalize a static prompt block so every session sends exactly the same bytes."""
+    # Line endings first, dedent doesn't see a common margin across lines ending in \r
+    lines = textwrap.dedent(text.replace("\r\n", "\n")).split("\n")
+    return "\n".join(line.rstrip() for line in lines).strip() + "\n"
+
+
+def order_tools(kernel) -> None:
+    """Sort plugins and their functions by name.
+
+    The tool list is part of the cached prefix, and MCP servers don't promise a
+    stable tool order across connections.
+    """
+    for plugin in kernel.plugins.values():
+        plugin.functions = dict(sorted(plugin.functions.items()))
+    kernel.plugins = dict(sorted(kernel.plugins.items()))
+
+
+def prefix_fingerprint(instructions: Optional[str], kernel) -> str:
+    """Hash of what precedes the conversation in each request: instructions, then tool schemas."""
+    tools = [
+        {
+            "name": metadata.fully_qualified_name,
+            "description": metadata.description,
+            "parameters": [(parameter.name, parameter.type_, parameter.is_required) for parameter in metadata.parameters],
+        }
+        for metadata in kernel.get_full_list_of_function_metadata()
+    ]
+    payload = json.dumps({"instructions": instructions or "", "tools": tools}, sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()[:12]
+
+
+def prepare_agent(agent) -> str:
+    """Fix the tool order of a ChatCompletionAgent and log its prefix fingerprint.
+
+    The fingerprint should be identical across sessions and replicas, if it
+    changes the provider can't reuse the cached prefix.
+    """
+    order_tools(agent.kernel)
+    fingerprint = prefix_fingerprint(agent.instructions, agent.kernel)
+    print(f"Prompt prefix {agent.name}: {fingerprint}")
+    return fingerprint
+
+
+@dataclass
+class CacheUsage:
+    requests: int = 0
+    prompt_tokens: int = 0
+    cached_tokens: int = 0
+    completion_tokens: int = 0
+
+    @property
+    def hit_ratio(self) -> float:
+        return self.cached_tokens / self.prompt_tokens if self.prompt_tokens else 0.0
+
+
+def _usage_of(content):
+    # The raw OpenAI response or stream chunk carries the usage with prompt_tokens_details
+    inner = getattr(content, "inner_content", None)
+    return getattr(inner, "usage", None)
+
+
+class PromptCacheStats:
+    """Cached vs. uncached input tokens per agent, read from the completion usage."""
+
+    def __init__(self) -> None:
+        self.agents: Dict[str, CacheUsage] = {}
+
+    def record(self, name: str, content) -> bool:
+        usage = _usage_of(content)
+        if not usage or not usage.prompt_tokens:
+            return False
+        details = getattr(usage, "prompt_tokens_details", None)
+        cached = (getattr(details, "cached_tokens", None) or 0) if details else 0
+        stats = self.agents.setdefault(name, CacheUsage())
+        stats.requests += 1
+        stats.prompt_tokens += usage.prompt_tokens
+        stats.cached_tokens += cached
+        stats.completion_tokens += usage.completion_tokens or 0
+        print(
+            f"Prompt cache {name}: {cached}/{usage.prompt_tokens} input tokens cached "
+            f"({stats.hit_ratio:.0%} over {stats.requests} requests)"
+        )
+        return True
+
+    def summary(self) -> Dict:
+        return {
+            name: {
+                "requests": stats.requests,
+                "prompt_tokens": stats.prompt_tokens,
+                "cached_tokens": stats.cached_tokens,
+                "uncached_tokens": stats.prompt_tokens - stats.cached_tokens,
+                "hit_ratio": round(stats.hit_ratio, 3),
+            }
+            for name, stats in self.agents.items()
+        }
+
+
+prompt_cache_stats = PromptCacheStats()
@@ -0,0 +1,355 @@
+import os
+import re
+import time
+import random
+import asyncio
+import threading
+from enum import IntEnum
+from typing import Callable, Dict, Optional
+
+import httpx
+from azure.core.exceptions import HttpResponseError
+from azure.core.pipeline.policies import AsyncRetryPolicy, RetryPolicy
+
+# Deployment quota. Azure OpenAI grants 6 RPM per 1000 TPM when RPM isn't set explicitly
+AZURE_OPENAI_TPM = int(os.getenv("AZURE_OPENAI_TPM", "30000"))
+AZURE_OPENAI_RPM = int(os.getenv("AZURE_OPENAI_RPM", str(max(AZURE_OPENAI_TPM * 6 // 1000, 1))))
+AZURE_SEARCH_RPM = int(os.getenv("AZURE_SEARCH_RPM", "600"))
+# Share of each bucket that batch work (ingestion, evaluation) may not dip into
+BATCH_RESERVE = float(os.getenv("RATE_LIMIT_BATCH_RESERVE", "0.3"))
+MAX_RETRIES = int(os.getenv("RATE_LIMIT_MAX_RETRIES", "6"))
+BACKOFF_BASE = 1.0
+BACKOFF_MAX = 60.0
+# An agent run's request is a few bytes of JSON, but the model reads the instructions and the whole thread
+AGENT_RUN_TOKENS = int(os.getenv("RATE_LIMIT_AGENT_RUN_TOKENS", "4000"))
+# Requests that make the model run: agent runs (and tool outputs resuming one) and direct inference.
+# Thread, message, run polling and file calls are control plane with quotas of their own.
+AGENT_RUN_PATH = re.compile(r"/threads(/[^/]+)?/runs(/[^/]+/submit_tool_outputs)?$")
+INFERENCE_PATH = re.compile(
+    AGENT_RUN_PATH.pattern + r"|/(chat/)?completions$|/embeddings$|/audio/\w+$|/responses$"
+)
+
+
+def is_inference_request(method: str, url: str) -> bool:
+    return method.upper() == "POST" and INFERENCE_PATH.search(url.split("?", 1)[0]) is not None
+
+
+def _on_event_loop() -> bool:
+    try:
+        asyncio.get_running_loop()
+        return True
+    except RuntimeError:
+        return False
+
+
+class Priority(IntEnum):
+    INTERACTIVE = 0
+    BATCH = 1
+
+
+class TokenBucket:
+    """Classic token bucket refilled continuously at `per_minute` tokens per minute."""
+
+    def __init__(self, per_minute: float, capacity: Optional[float] = None) -> None:
+        self.rate = per_minute / 60.0
+        self.capacity = capacity or per_minute
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+    def refill(self, now: float) -> None:
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount: float, floor: float = 0.0) -> float:
+        """Seconds until `amount` can be taken while leaving at least `floor` tokens."""
+        amount = min(amount, self.capacity - floor)
+        missing = amount + floor - self.tokens
+        return 0.0 if missing <= 0 else missing / self.rate
+
+
+class RateLimiter:
+    """Request and token buckets shared by every client talking to one deployment.
+
+    Interactive calls may drain the buckets, batch calls leave BATCH_RESERVE of
+    them for interactive traffic. A 429 pauses everyone until its retry-after.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        rpm: int,
+        tpm: Optional[int] = None,
+        batch_reserve: float = BATCH_RESERVE,
+        applies_to: Optional[Callable[[str, str], bool]] = None,
+    ) -> None:
+        self.name = name
+        # Which requests (method, url) draw from the buckets, None for all of them
+        self.applies_to = applies_to
+        self.requests = TokenBucket(rpm)
+        self.tokens = TokenBucket(tpm) if tpm else None
+        self.batch_reserve = batch_reserve
+        self.blocked_until = 0.0
+        self.throttled = 0
+        self.waited = 0.0
+        self._lock = threading.Lock()
+
+    def _reserve(self, tokens: int, priority: Priority) -> float:
+        """Take capacity if available and return 0, otherwise return how long to wait."""
+        with self._lock:
+            now = time.monotonic()
+            if now < self.blocked_until:
+                return self.blocked_until - now
+            buckets = [(self.requests, 1)]
+            if self.tokens:
+                buckets.append((self.tokens, tokens))
+            wait = 0.0
+            for bucket, amount in buckets:
+                bucket.refill(now)
+                floor = bucket.capacity * self.batch_reserve if priority == Priority.BATCH else 0.0
+                wait = max(wait, bucket.wait_time(amount, floor))
+            if wait > 0:
+                return wait
+            for bucket, amount in buckets:
+                bucket.tokens -= min(amount, bucket.capacity)
+            return 0.0
+
+    def limits(self, method: str, url: str) -> bool:
+        return self.applies_to is None or self.applies_to(method, url)
+
+    def _charge(self, tokens: int) -> None:
+        """Take capacity without waiting, the buckets may go negative."""
+        with self._lock:
+            now = time.monotonic()
+            self.requests.refill(now)
+            self.requests.tokens -= 1
+            if self.tokens:
+                self.tokens.refill(now)
+                self.tokens.tokens -= min(tokens, self.tokens.capacity)
+
+    async def acquire(self, tokens: int = 1, priority: Priority = Priority.INTERACTIVE) -> None:
+        while (wait := self._reserve(tokens, priority)) > 0:
+            self.waited += wait
+            await asyncio.sleep(wait)
+
+    def acquire_sync(self, tokens: int = 1, priority: Priority = Priority.INTERACTIVE) -> None:
+        if _on_event_loop():
+            # A sync client called from a coroutine: sleeping here would stall every session on the loop.
+            # The request goes ahead and its cost is charged, so the async callers wait it off instead.
+            self._charge(tokens)
+            return
+        while (wait := self._reserve(tokens, priority)) > 0:
+            self.waited += wait
+            time.sleep(wait)
+
+    def penalize(self, retry_after: Optional[float]) -> None:
+        """Pause all callers after a 429, with jitter so they don't return in lockstep."""
+        delay = (retry_after or BACKOFF_BASE) + random.uniform(0, min(retry_after or BACKOFF_BASE, 5.0))
+        with self._lock:
+            self.throttled += 1
+            self.blocked_until = max(self.blocked_until, time.monotonic() + delay)
+        print(f"Rate limiter {self.name}: throttled, pausing {delay:.1f}s")
+
+    def observe(self, headers) -> None:
+        """Align the buckets with the remaining quota the service reports."""
+        with self._lock:
+            remaining_requests = headers.get("x-ratelimit-remaining-requests")
+            if remaining_requests is not None:
+                self.requests.tokens = min(self.requests.tokens, float(remaining_requests))
+            remaining_tokens = headers.get("x-ratelimit-remaining-tokens")
+            if self.tokens and remaining_tokens is not None:
+                self.tokens.tokens = min(self.tokens.tokens, float(remaining_tokens))
+
+    def stats(self) -> Dict:
+        return {"name": self.name, "throttled": self.throttled, "waited_seconds": round(self.waited, 2)}
+
+
+def retry_after_seconds(headers) -> Optional[float]:
+    """Read the retry delay from the headers Azure OpenAI, Agents and Search send back."""
+    if headers.get("retry-after-ms"):
+        return float(headers["retry-after-ms"]) / 1000
+    for name in ("retry-after", "x-ms-retry-after-ms"):
+        value = headers.get(name)
+        if value:
+            try:
+                seconds = float(value)
+            except ValueError:
+                # HTTP date form, fall back to backoff
+                return None
+            return seconds / 1000 if name.endswith("-ms") else seconds
+    return None
+
+
+def backoff_delay(attempt: int, retry_after: Optional[float] = None) -> float:
+    """Full-jitter exponential backoff, never shorter than what the service asked for."""
+    delay = random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * (2 ** attempt)))
+    return max(delay, retry_after or 0.0)
+
+
+def estimate_tokens(body, url: str = "") -> int:
+    # Roughly four bytes per token for the prompt we're sending, streamed bodies count as one.
+    # Agent runs carry their prompt server side (the thread), so they're charged AGENT_RUN_TOKENS at least.
+    tokens = max(len(body) // 4, 1) if isinstance(body, (bytes, str)) else 1
+    if AGENT_RUN_PATH.search(url.split("?", 1)[0]):
+        return max(tokens, AGENT_RUN_TOKENS)
+    return tokens
+
+
+def _request_tokens(http_request) -> int:
+    # azure.core.rest requests expose .content, the legacy transport requests .body
+    body = getattr(http_request, "content", None) or getattr(http_request, "body", None)
+    return estimate_tokens(body, http_request.url)
+
+
+def is_throttled(error: Exception) -> bool:
+    if isinstance(error, HttpResponseError):
+        return error.status_code == 429
+    return getattr(error, "status_code", None) == 429
+
+
+THROTTLED_MESSAGE = "The service is busy right now, please try again in a moment."
+
+
+class RateLimitedAsyncRetryPolicy(AsyncRetryPolicy):
+    """Azure SDK retry policy that admits every attempt through a shared RateLimiter."""
+
+    def __init__(self, limiter: RateLimiter, priority: Priority = Priority.INTERACTIVE, **kwargs) -> None:
+        kwargs.setdefault("retry_total", MAX_RETRIES)
+        super().__init__(**kwargs)
+        self.limiter = limiter
+        self.priority = priority
+
+    async def send(self, request):
+        http_request = request.http_request
+        if not self.limiter.limits(http_request.method, http_request.url):
+            return await super().send(request)
+        await self.limiter.acquire(_request_tokens(http_request), self.priority)
+        response = await super().send(request)
+        self.limiter.observe(response.http_response.headers)
+        return response
+
+    async def sleep(self, settings, transport, response=None):
+        retry_after = None
+        limited = response is None or self.limiter.limits(response.http_request.method, response.http_request.url)
+        if response is not None:
+            retry_after = retry_after_seconds(response.http_response.headers)
+            if limited and response.http_response.status_code == 429:
+                self.limiter.penalize(retry_after)
+        await transport.sleep(backoff_delay(len(settings["history"]), retry_after))
+        if limited:
+            await self.limiter.acquire(_request_tokens(response.http_request) if response is not None else 1, self.priority)
+
+
+class RateLimitedRetryPolicy(RetryPolicy):
+    """Sync variant for the search clients.
+
+    Called on an event loop thread it never waits: the limiter charges the
+    request without sleeping, and failures (429, 5xx, connection errors) are
+    raised to the caller instead of being retried, since there's no way to
+    back off without blocking the loop.
+    """
+
+    def __init__(self, limiter: RateLimiter, priority: Priority = Priority.INTERACTIVE, **kwargs) -> None:
+        kwargs.setdefault("retry_total", MAX_RETRIES)
+        super().__init__(**kwargs)
+        self.limiter = limiter
+        self.priority = priority
+
+    def send(self, request):
+        http_request = request.http_request
+        if not self.limiter.limits(http_request.method, http_request.url):
+            return super().send(request)
+        self.limiter.acquire_sync(_request_tokens(http_request), self.priority)
+        response = super().send(request)
+        self.limiter.observe(response.http_response.headers)
+        return response
+
+    def is_retry(self, settings, response):
+        if not _on_event_loop():
+            return super().is_retry(settings, response)
+        if response.http_response.status_code == 429 and self.limiter.limits(response.http_request.method, response.http_request.url):
+            # Not retried, but the other callers still back off
+            self.limiter.penalize(retry_after_seconds(response.http_response.headers))
+        return False
+
+    def increment(self, settings, response=None, error=None):
+        # Connection errors don't go through is_retry, they're not retried on the loop either
+        if error is not None and _on_event_loop():
+            return False
+        return super().increment(settings, response, error)
+
+    def sleep(self, settings, transport, response=None):
+        retry_after = None
+        limited = response is None or self.limiter.limits(response.http_request.method, response.http_request.url)
+        if response is not None:
+            retry_after = retry_after_seconds(response.http_response.headers)
+            if limited and response.http_response.status_code == 429:
+                self.limiter.penalize(retry_after)
+        transport.sleep(backoff_delay(len(settings["history"]), retry_after))
+        if limited:
+            self.limiter.acquire_sync(_request_tokens(response.http_request) if response is not None else 1, self.priority)
+
+
+class RateLimitedAsyncTransport(httpx.AsyncHTTPTransport):
+    """httpx transport for the openai clients, which retry on their own with jitter."""
+
+    def __init__(self, limiter: RateLimiter, priority: Priority = Priority.INTERACTIVE, **kwargs) -> None:
+        super().__init__(**kwargs)
+        self.limiter = limiter
+        self.priority = priority
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        if not self.limiter.limits(request.method, str(request.url)):
+            return await super().handle_async_request(request)
+        await self.limiter.acquire(estimate_tokens(request.content, str(request.url)), self.priority)
+        response = await super().handle_async_request(request)
+        self.limiter.observe(response.headers)
+        if response.status_code == 429:
+            self.limiter.penalize(retry_after_seconds(response.headers))
+        return response
+
+
+class RateLimitedTransport(httpx.HTTPTransport):
+    def __init__(self, limiter: RateLimiter, priority: Priority = Priority.INTERACTIVE, **kwargs) -> None:
+        super().__init__(**kwargs)
+        self.limiter = limiter
+        self.priority = priority
+
+    def handle_request(self, request: httpx.Request) -> httpx.Response:
+        if not self.limiter.limits(request.method, str(request.url)):
+            return super().handle_request(request)
+        self.limiter.acquire_sync(estimate_tokens(request.content, str(request.url)), self.priority)
+        response = super().handle_request(request)
+        self.limiter.observe(response.headers)
+        if response.status_code == 429:
+            self.limiter.penalize(retry_after_seconds(response.headers))
+        return response
+
+
+_limiters: Dict[str, RateLimiter] = {}
+
+
+def get_rate_limiter(name: str = "openai") -> RateLimiter:
+    """Process wide limiters: "openai" for model inference (agent runs included), "search" for AI Search."""
+    if name not in _limiters:
+        if name == "search":
+            _limiters[name] = RateLimiter(name, rpm=AZURE_SEARCH_RPM)
+        else:
+            _limiters[name] = RateLimiter(name, rpm=AZURE_OPENAI_RPM, tpm=AZURE_OPENAI_TPM, applies_to=is_inference_request)
+    return _limiters[name]
+
+
+def azure_client_options(name: str = "openai", priority: Priority = Priority.INTERACTIVE, sync: bool = False) -> Dict:
+    """Keyword arguments that route an Azure SDK client through the shared limiter."""
+    policy_class = RateLimitedRetryPolicy if sync else RateLimitedAsyncRetryPolicy
+    return {"retry_policy": policy_class(get_rate_limiter(name), priority)}
+
+
+def openai_http_client(priority: Priority = Priority.INTERACTIVE, sync: bool = False):
+    """httpx client for AzureOpenAI/AsyncAzureOpenAI that goes through the shared limiter.
+
+    Each call opens a new connection pool: close it, or the OpenAI client wrapping it, when done.
+    """
+    limiter = get_rate_limiter("openai")
+    if sync:
+        return httpx.Client(transport=RateLimitedTransport(limiter, priority))
+    return httpx.AsyncClient(transport=RateLimitedAsyncTransport(limiter, priority))
@@ -0,0 +1,144 @@
+import os
+import asyncio
+from dataclasses import dataclass, asdict
+from typing import Optional
+
+from chainlit.data import get_data_layer
+
+from session_state import REPLICA_ID
+
+# The streaming replica writes the checkpoint at most this often, and at least this often as a heartbeat
+RUN_CHECKPOINT_INTERVAL = float(os.getenv("RUN_CHECKPOINT_INTERVAL_SECONDS", "5"))
+# A checkpoint nobody has written for this long belongs to a replica that's gone
+RUN_CHECKPOINT_STALE_SECONDS = float(os.getenv("RUN_CHECKPOINT_STALE_SECONDS", "20"))
+
+ACTIVE_RUN_STATUSES = ["queued", "in_progress", "requires_action", "cancelling"]
+
+
+@dataclass
+class RunCheckpoint:
+    """Where the run streaming into a Chainlit thread had got to."""
+    thread_id: str
+    agent_thread_id: str
+    run_id: str
+    # Last run step seen, and the Chainlit message the unfinished text was streaming into
+    last_event_id: Optional[str] = None
+    message_id: Optional[str] = None
+    # Agent messages of the run already shown in full
+    messages_done: int = 0
+    content: str = ""
+    replica_id: str = REPLICA_ID
+    age: float = 0.0
+
+    @property
+    def stale(self) -> bool:
+        return self.age > RUN_CHECKPOINT_STALE_SECONDS
+
+
+def checkpoint_store():
+    # Checkpoints need the Postgres data layer (DATABASE_URL), without it runs aren't resumable
+    data_layer = get_data_layer()
+    return data_layer if hasattr(data_layer, "save_run_checkpoint") else None
+
+
+async def load_checkpoint(thread_id: str) -> Optional[RunCheckpoint]:
+    store = checkpoint_store()
+    if not store or not thread_id:
+        return None
+    row = await store.get_run_checkpoint(thread_id)
+    if not row:
+        return None
+    return RunCheckpoint(
+        thread_id=row["threadId"],
+        agent_thread_id=row["agentThreadId"],
+        run_id=row["runId"],
+        last_event_id=row["lastEventId"],
+        message_id=row["messageId"],
+        messages_done=row["messagesDone"],
+        content=row["content"],
+        replica_id=row["replicaId"],
+        age=row["age"],
+    )
+
+
+class RunCheckpointer:
+    """Keeps the checkpoint of one run up to date while this replica owns it.
+
+    Stream callbacks only update the fields; a background task writes them
+    every RUN_CHECKPOINT_INTERVAL, so a long answer costs one write per
+    interval rather than one per token. save() writes right away, for the
+    points a resume must not miss (a new run step, a finished message).
+    """
+
+    def __init__(self, store, checkpoint: RunCheckpoint) -> None:
+        self.store = store
+        self.checkpoint = checkpoint
+        self._task: Optional[asyncio.Task] = None
+        # A save still in flight when the run ends would otherwise recreate the deleted checkpoint
+        self._lock = asyncio.Lock()
+        self._finished = False
+
+    def update(self, **changes) -> None:
+        for name, value in changes.items():
+            setattr(self.checkpoint, name, value)
+
+    async def save(self) -> None:
+        async with self._lock:
+            if self._finished:
+                return
+            try:
+                await self.store.save_run_checkpoint(asdict(self.checkpoint))
+            except Exception as e:
+                # Losing a checkpoint only loses the resume, never the run
+                print(f"Could not checkpoint run {self.checkpoint.run_id}: {str(e)}")
+
+    async def _heartbeat(self) -> None:
+        while not self._finished:
+            await asyncio.sleep(RUN_CHECKPOINT_INTERVAL)
+            await self.save()
+
+    async def start(self) -> None:
+        await self.save()
+        if self._task is None:
+            self._task = asyncio.create_task(self._heartbeat())
+
+    async def finish(self, delete: bool = True) -> None:
+        """Stop the heartbeat. A kept checkpoint goes stale, for the next message to resume the run."""
+        async with self._lock:
+            self._finished = True
+            if delete:
+                try:
+                    await self.store.delete_run_checkpoint(self.checkpoint.thread_id, self.checkpoint.run_id)
+                except Exception as e:
+                    print(f"Could not delete the checkpoint of run {self.checkpoint.run_id}: {str(e)}")
+        if self._task:
+            self._task.cancel()
+            self._task = None
+
+
+def create_checkpointer(thread_id: str, agent_thread_id: str, run_id: str) -> Optional[RunCheckpointer]:
+    store = checkpoint_store()
+    if not store or not thread_id:
+        return None
+    return RunCheckpointer(store, RunCheckpoint(thread_id=thread_id, agent_thread_id=agent_thread_id, run_id=run_id))
+
+
+async def claim_orphaned_run(thread_id: str) -> Optional[RunCheckpointer]:
+    """Take over the checkpoint of a run whose replica went away, waiting out one that may still be alive.
+
+    Returns None when there's nothing to resume: no checkpoint, the owner
+    finished meanwhile, or another replica claimed it first.
+    """
+    store = checkpoint_store()
+    checkpoint = await load_checkpoint(thread_id)
+    while checkpoint and not checkpoint.stale:
+        await asyncio.sleep(RUN_CHECKPOINT_INTERVAL)
+        checkpoint = await load_checkpoint(thread_id)
+    if not checkpoint:
+        return None
+    if not await store.claim_run_checkpoint(thread_id, checkpoint.run_id, REPLICA_ID, RUN_CHECKPOINT_STALE_SECONDS):
+        return None
+    print(f"Resuming run {checkpoint.run_id} of thread {thread_id}, last checkpointed on {checkpoint.replica_id}")
+    checkpoint.replica_id = REPLICA_ID
+    checkpoint.age = 0.0
+    return RunCheckpointer(store, checkpoint)
@@ -0,0 +1,112 @@
+import ast
+import json
+from dataclasses import dataclass
+from typing import Awaitable, Callable, Dict, List, Optional
+
+from azure.ai.agents.models import ListSortOrder, RunStepMessageCreationDetails, RunStepToolCallDetails
+
+FINISHED_STEP_STATUSES = ("completed", "failed", "cancelled", "expired")
+
+
+@dataclass
+class ToolProgress:
+    id: str
+    type: str
+    status: str
+    query: Optional[str] = None
+    documents: Optional[int] = None
+
+    @property
+    def done(self) -> bool:
+        return self.status in FINISHED_STEP_STATUSES
+
+    def describe(self) -> str:
+        if not self.done:
+            return "Running..."
+        if self.status != "completed":
+            return f"Tool call {self.status}"
+        if self.documents is not None:
+            return f"Retrieved {self.documents} document{'s' if self.documents != 1 else ''}"
+        return "Done"
+
+
+def _count_documents(output) -> Optional[int]:
+    # The AI Search tool reports its hits as a JSON or Python literal string
+    if not output:
+        return None
+    for parse in (json.loads, ast.literal_eval):
+        try:
+            value = parse(output)
+        except (ValueError, SyntaxError):
+            continue
+        if isinstance(value, dict):
+            value = value.get("documents", value.get("results", value.get("value")))
+        return len(value) if isinstance(value, list) else None
+    return None
+
+
+def tool_progress(tool_call, status: str) -> ToolProgress:
+    progress = ToolProgress(id=tool_call.id, type=tool_call.type, status=status)
+    if tool_call.type == "azure_ai_search":
+        data = tool_call.azure_ai_search or {}
+        progress.query = data.get("input")
+        progress.documents = _count_documents(data.get("output"))
+    elif tool_call.type == "file_search":
+        results = tool_call.file_search.results if tool_call.file_search else None
+        progress.documents = len(results) if results is not None else None
+    elif tool_call.type == "function":
+        progress.query = tool_call.function.arguments
+    elif tool_call.type == "code_interpreter":
+        progress.query = tool_call.code_interpreter.input
+    return progress
+
+
+class RunStepWatcher:
+    """Reports the steps of a run as they happen, without the streaming API.
+
+    Each `poll` lists the run's steps once: tool calls are reported when they
+    start and when they finish, and messages are fetched by id as soon as the
+    step that creates them completes.
+    """
+
+    def __init__(
+        self,
+        agents_client,
+        thread_id: str,
+        run_id: str,
+        on_tool: Callable[[ToolProgress], Awaitable[None]],
+        on_message: Callable[[object], Awaitable[None]],
+    ) -> None:
+        self.agents_client = agents_client
+        self.thread_id = thread_id
+        self.run_id = run_id
+        self.on_tool = on_tool
+        self.on_message = on_message
+        self.message_ids: List[str] = []
+        self._tool_status: Dict[str, str] = {}
+        self._finished_steps: set = set()
+
+    async def poll(self) -> None:
+        steps = self.agents_client.run_steps.list(
+            thread_id=self.thread_id,
+            run_id=self.run_id,
+            order=ListSortOrder.ASCENDING,
+        )
+        async for step in steps:
+            if step.id in self._finished_steps:
+                continue
+            if step.status in FINISHED_STEP_STATUSES:
+                self._finished_steps.add(step.id)
+            details = step.step_details
+            if isinstance(details, RunStepToolCallDetails):
+                for tool_call in details.tool_calls or []:
+                    if self._tool_status.get(tool_call.id) == step.status:
+                        continue
+                    self._tool_status[tool_call.id] = step.status
+                    await self.on_tool(tool_progress(tool_call, step.status))
+            elif isinstance(details, RunStepMessageCreationDetails) and step.status == "completed":
+                message_id = details.message_creation.message_id
+                if message_id not in self.message_ids:
+                    self.message_ids.append(message_id)
+                    message = await self.agents_client.messages.get(thread_id=self.thread_id, message_id=message_id)
+                    await self.on_message(message)
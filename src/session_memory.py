@@ -0,0 +1,144 @@
+import os
+import sys
+import time
+import asyncio
+from typing import Awaitable, Callable, Dict, Iterable, Optional, Tuple
+
+from session_state import SessionStateBackend
+
+# Chat histories are trimmed from the oldest end once they pass this size
+SESSION_HISTORY_MAX_KB = int(os.getenv("SESSION_HISTORY_MAX_KB", "256"))
+# Kernels, agents and MCP plugins of sessions idle this long are dropped and rebuilt on the next message
+SESSION_IDLE_EVICT_SECONDS = int(os.getenv("SESSION_IDLE_EVICT_SECONDS", "1800"))
+SWEEP_INTERVAL = 60
+
+
+def rss_bytes() -> int:
+    """Resident set size of this process."""
+    try:
+        with open("/proc/self/statm", "r") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        import resource
+
+        # Peak rather than current RSS, but the best macOS/BSD offer without psutil
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == "darwin" else peak * 1024
+
+
+def memory_report(sessions: int) -> Dict:
+    rss = rss_bytes()
+    return {
+        "rss_mb": round(rss / 1024 / 1024, 1),
+        "sessions": sessions,
+        "rss_per_session_kb": round(rss / 1024 / sessions, 1) if sessions else None,
+    }
+
+
+def _message_size(message) -> int:
+    size = len((message.content or "").encode("utf-8"))
+    for item in getattr(message, "items", None) or []:
+        # Function calls and results aren't part of .content but can dominate the size
+        for attribute in ("arguments", "result"):
+            value = getattr(item, attribute, None)
+            if value is not None:
+                size += len(str(value))
+    return size
+
+
+def cap_history(chat_history, max_bytes: int = SESSION_HISTORY_MAX_KB * 1024) -> int:
+    """Drop the oldest non-system messages of a ChatHistory until it fits in `max_bytes`.
+
+    Trimming continues up to the next user message so a tool result is never
+    left without the call that produced it. Returns the number of messages removed.
+    """
+    messages = chat_history.messages
+    sizes = [_message_size(message) for message in messages]
+    total = sum(sizes)
+    if total <= max_bytes:
+        return 0
+
+    keep = [message.role == "system" for message in messages]
+    removed = 0
+    index = 0
+    while index < len(messages) and total > max_bytes:
+        if not keep[index]:
+            total -= sizes[index]
+            removed += 1
+        index += 1
+    # Resume at a user turn
+    while index < len(messages) and not keep[index] and messages[index].role != "user":
+        removed += 1
+        index += 1
+    chat_history.messages = [message for position, message in enumerate(messages) if keep[position] or position >= index]
+    return removed
+
+
+class IdleSessionEvictor:
+    """Drops the heavy per-session objects of chats that have gone quiet.
+
+    Chainlit keeps user sessions around for `user_session_timeout`, this
+    releases kernels, agents and MCP processes long before that. When given
+    the session state, the session's snapshot (and the chat history in it)
+    is deleted as well, so an evicted chat starts a new conversation.
+    """
+
+    def __init__(
+        self,
+        heavy_keys: Iterable[str],
+        close: Optional[Callable[[Dict], Awaitable[None]]] = None,
+        idle_seconds: int = SESSION_IDLE_EVICT_SECONDS,
+        session_state: Optional[SessionStateBackend] = None,
+    ) -> None:
+        self.heavy_keys = list(heavy_keys)
+        self.close = close
+        self.idle_seconds = idle_seconds
+        self.session_state = session_state
+        self.evicted = 0
+        # Session id -> (last seen, session state key)
+        self._last_seen: Dict[str, Tuple[float, Optional[str]]] = {}
+        self._task: Optional[asyncio.Task] = None
+
+    def touch(self, session_id: str, session_key: Optional[str] = None) -> None:
+        self._last_seen[session_id] = (time.monotonic(), session_key)
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    def forget(self, session_id: str) -> None:
+        self._last_seen.pop(session_id, None)
+
+    @property
+    def active_sessions(self) -> int:
+        return len(self._last_seen)
+
+    async def sweep(self) -> int:
+        from chainlit.user_session import user_sessions
+
+        cutoff = time.monotonic() - self.idle_seconds
+        evicted = 0
+        for session_id, (last_seen, session_key) in list(self._last_seen.items()):
+            if last_seen > cutoff:
+                continue
+            self._last_seen.pop(session_id, None)
+            session = user_sessions.get(session_id)
+            if not session:
+                continue
+            heavy = {key: session.pop(key) for key in self.heavy_keys if key in session}
+            try:
+                if self.close and heavy:
+                    await self.close(heavy)
+                if self.session_state and session_key:
+                    await self.session_state.delete(session_key)
+            except Exception as e:
+                print(f"Error releasing idle session {session_id}: {str(e)}")
+            evicted += 1
+        self.evicted += evicted
+        if evicted:
+            print(f"Evicted {evicted} idle sessions {memory_report(self.active_sessions)}")
+        return evicted
+
+    async def _run(self) -> None:
+        while self._last_seen:
+            await asyncio.sleep(SWEEP_INTERVAL)
+            await self.sweep()
+            print(f"Session memory {memory_report(self.active_sessions)}")
@@ -0,0 +1,307 @@
+import os
+import json
+import time
+import zlib
+import socket
+import asyncio
+from abc import ABC, abstractmethod
+from contextlib import asynccontextmanager
+from dataclasses import dataclass, field, asdict
+from typing import AsyncIterator, Awaitable, Callable, Dict, Optional, Tuple
+
+from dotenv import load_dotenv
+
+# Load environment variables
+load_dotenv()
+
+# Redis is optional - the in-memory backend is used when it isn't installed
+try:
+    import redis.asyncio as redis
+except ImportError:
+    redis = None
+
+REDIS_URL = os.getenv("REDIS_URL")
+SESSION_STATE_BACKEND = os.getenv("SESSION_STATE_BACKEND", "redis" if REDIS_URL else "memory")
+# Keep snapshots around as long as Chainlit keeps the user session (15 days)
+SESSION_STATE_TTL = int(os.getenv("SESSION_STATE_TTL", str(15 * 24 * 3600)))
+CANCEL_SIGNAL_TTL = int(os.getenv("CANCEL_SIGNAL_TTL", "600"))
+# Azure Container Apps exposes the replica name, fall back to the hostname elsewhere
+REPLICA_ID = os.getenv("CONTAINER_APP_REPLICA_NAME") or socket.gethostname()
+
+KEY_PREFIX = "chainlit"
+
+
+@dataclass(slots=True)
+class SessionSnapshot:
+    """Serializable part of a chat session that must survive a replica switch.
+
+    Clients, kernels and plugins are never stored here - they are rebuilt on
+    the replica that picks up the session.
+    """
+    session_key: str
+    thread_id: Optional[str] = None
+    run_id: Optional[str] = None
+    run_thread_id: Optional[str] = None
+    # Route of the agent that answered last, so follow-ups stay with it on any replica
+    agent_key: Optional[str] = None
+    chat_history: Optional[str] = None
+    replica_id: str = REPLICA_ID
+    updated_at: float = field(default_factory=time.time)
+
+    def to_json(self) -> str:
+        return json.dumps(asdict(self))
+
+    @classmethod
+    def from_json(cls, data) -> "SessionSnapshot":
+        if isinstance(data, bytes):
+            data = data.decode("utf-8")
+        values = json.loads(data)
+        # Ignore fields written by a newer replica during a rolling deploy
+        return cls(**{name: value for name, value in values.items() if name in cls.__dataclass_fields__})
+
+
+CancelWait = Callable[[float], Awaitable[bool]]
+
+
+class SessionStateBackend(ABC):
+    """Base class for the session state stores shared by all replicas."""
+
+    @abstractmethod
+    async def load(self, session_key: str) -> Optional[SessionSnapshot]:
+        ...
+
+    @abstractmethod
+    async def save(self, snapshot: SessionSnapshot) -> None:
+        ...
+
+    @abstractmethod
+    async def delete(self, session_key: str) -> None:
+        ...
+
+    @abstractmethod
+    async def request_cancel(self, run_id: str) -> None:
+        """Ask whichever replica owns the run to cancel it."""
+
+    @abstractmethod
+    async def cancel_requested(self, run_id: str) -> bool:
+        ...
+
+    @abstractmethod
+    async def clear_cancel(self, run_id: str) -> None:
+        ...
+
+    @abstractmethod
+    async def wait_for_cancel(self, run_id: str, timeout: float) -> bool:
+        """Block up to `timeout` seconds until a cancel is requested for the run."""
+
+    @asynccontextmanager
+    async def watch_cancel(self, run_id: str) -> AsyncIterator[CancelWait]:
+        """Yield a wait(timeout) for loops that poll a run for cancels until it ends.
+
+        Backends that need a subscription keep one open for the whole run
+        instead of subscribing on every wait.
+        """
+        yield lambda timeout: self.wait_for_cancel(run_id, timeout)
+
+    async def route_hint(self, session_key: str) -> Optional[str]:
+        """Return the replica that last served the session, if any."""
+        snapshot = await self.load(session_key)
+        return snapshot.replica_id if snapshot else None
+
+    async def close(self) -> None:
+        pass
+
+    async def update(self, session_key: str, **changes) -> SessionSnapshot:
+        """Load (or create) a snapshot, apply `changes` and save it back."""
+        snapshot = await self.load(session_key) or SessionSnapshot(session_key=session_key)
+        for name, value in changes.items():
+            setattr(snapshot, name, value)
+        snapshot.replica_id = REPLICA_ID
+        snapshot.updated_at = time.time()
+        await self.save(snapshot)
+        return snapshot
+
+
+class InMemorySessionState(SessionStateBackend):
+    """Process-local backend. Used for single replica runs and in tests.
+
+    Snapshots and cancel signals expire like their Redis keys do, expired
+    entries are swept at most once a minute when something is written.
+    """
+
+    SWEEP_INTERVAL = 60
+
+    def __init__(self, ttl: int = SESSION_STATE_TTL) -> None:
+        self.ttl = ttl
+        # zlib keeps idle sessions' histories small, they are mostly repetitive text
+        self._snapshots: Dict[str, Tuple[float, bytes]] = {}
+        self._cancels: Dict[str, asyncio.Event] = {}
+        self._cancel_expires: Dict[str, float] = {}
+        self._waiters: Dict[str, int] = {}
+        self._next_sweep = 0.0
+
+    def _sweep(self) -> None:
+        now = time.monotonic()
+        if now < self._next_sweep:
+            return
+        self._next_sweep = now + self.SWEEP_INTERVAL
+        for session_key in [key for key, (expires, _) in self._snapshots.items() if expires <= now]:
+            del self._snapshots[session_key]
+        for run_id in [key for key, expires in self._cancel_expires.items() if expires <= now]:
+            self._drop_cancel(run_id)
+
+    def _drop_cancel(self, run_id: str) -> None:
+        self._cancel_expires.pop(run_id, None)
+        if not self._waiters.get(run_id):
+            self._cancels.pop(run_id, None)
+
+    def _cancel_event(self, run_id: str) -> asyncio.Event:
+        if run_id not in self._cancels:
+            self._cancels[run_id] = asyncio.Event()
+        return self._cancels[run_id]
+
+    async def load(self, session_key: str) -> Optional[SessionSnapshot]:
+        expires, data = self._snapshots.get(session_key, (0.0, None))
+        if data is None or expires <= time.monotonic():
+            return None
+        return SessionSnapshot.from_json(zlib.decompress(data).decode("utf-8"))
+
+    async def save(self, snapshot: SessionSnapshot) -> None:
+        self._sweep()
+        # Store the serialized form so the fake behaves like Redis
+        data = zlib.compress(snapshot.to_json().encode("utf-8"))
+        self._snapshots[snapshot.session_key] = (time.monotonic() + self.ttl, data)
+
+    async def delete(self, session_key: str) -> None:
+        self._snapshots.pop(session_key, None)
+
+    async def request_cancel(self, run_id: str) -> None:
+        self._sweep()
+        self._cancel_event(run_id).set()
+        self._cancel_expires[run_id] = time.monotonic() + CANCEL_SIGNAL_TTL
+
+    async def cancel_requested(self, run_id: str) -> bool:
+        return run_id in self._cancel_expires and self._cancel_expires[run_id] > time.monotonic()
+
+    async def clear_cancel(self, run_id: str) -> None:
+        self._drop_cancel(run_id)
+
+    async def wait_for_cancel(self, run_id: str, timeout: float) -> bool:
+        if await self.cancel_requested(run_id):
+            return True
+        event = self._cancel_event(run_id)
+        self._waiters[run_id] = self._waiters.get(run_id, 0) + 1
+        try:
+            await asyncio.wait_for(event.wait(), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+        finally:
+            self._waiters[run_id] -= 1
+            if not self._waiters[run_id]:
+                del self._waiters[run_id]
+                # Nobody is waiting and no cancel is pending, the event isn't needed anymore
+                if run_id not in self._cancel_expires:
+                    self._cancels.pop(run_id, None)
+
+
+class RedisSessionState(SessionStateBackend):
+    """Redis backend so any replica can resume a session or cancel its run."""
+
+    def __init__(self, url: str, ttl: int = SESSION_STATE_TTL) -> None:
+        if redis is None:
+            raise ImportError("The redis package is required for the Redis session state backend.")
+        self.client = redis.from_url(url)
+        self.ttl = ttl
+
+    def _session_key(self, session_key: str) -> str:
+        return f"{KEY_PREFIX}:session:{session_key}"
+
+    def _cancel_key(self, run_id: str) -> str:
+        return f"{KEY_PREFIX}:cancel:{run_id}"
+
+    async def load(self, session_key: str) -> Optional[SessionSnapshot]:
+        data = await self.client.get(self._session_key(session_key))
+        return SessionSnapshot.from_json(data) if data else None
+
+    async def save(self, snapshot: SessionSnapshot) -> None:
+        await self.client.set(self._session_key(snapshot.session_key), snapshot.to_json(), ex=self.ttl)
+
+    async def delete(self, session_key: str) -> None:
+        await self.client.delete(self._session_key(session_key))
+
+    async def request_cancel(self, run_id: str) -> None:
+        # The key covers replicas that poll, the publish wakes up the ones waiting
+        await self.client.set(self._cancel_key(run_id), REPLICA_ID, ex=CANCEL_SIGNAL_TTL)
+        await self.client.publish(self._cancel_key(run_id), REPLICA_ID)
+
+    async def cancel_requested(self, run_id: str) -> bool:
+        return bool(await self.client.exists(self._cancel_key(run_id)))
+
+    async def clear_cancel(self, run_id: str) -> None:
+        await self.client.delete(self._cancel_key(run_id))
+
+    async def wait_for_cancel(self, run_id: str, timeout: float) -> bool:
+        async with self.watch_cancel(run_id) as wait:
+            return await wait(timeout)
+
+    @asynccontextmanager
+    async def watch_cancel(self, run_id: str) -> AsyncIterator[CancelWait]:
+        pubsub = self.client.pubsub()
+        await pubsub.subscribe(self._cancel_key(run_id))
+        # Check after subscribing so a cancel sent in between isn't missed, later ones arrive as messages
+        pending = await self.cancel_requested(run_id)
+
+        async def wait(timeout: float) -> bool:
+            nonlocal pending
+            if pending:
+                pending = False
+                return True
+            deadline = time.monotonic() + timeout
+            while (remaining := deadline - time.monotonic()) > 0:
+                # Subscribe confirmations come back as None, so keep reading until the deadline
+                message = await pubsub.get_message(ignore_subscribe_messages=True, timeout=remaining)
+                if message is not None:
+                    return True
+            return False
+
+        try:
+            yield wait
+        finally:
+            await pubsub.unsubscribe(self._cancel_key(run_id))
+            await pubsub.aclose()
+
+    async def close(self) -> None:
+        await self.client.aclose()
+
+
+_backend: Optional[SessionStateBackend] = None
+
+
+def get_session_state() -> SessionStateBackend:
+    """Return the process wide session state backend configured by the environment."""
+    global _backend
+    if _backend is None:
+        if SESSION_STATE_BACKEND == "redis":
+            if not REDIS_URL:
+                raise ValueError("REDIS_URL environment variable is not set.")
+            _backend = RedisSessionState(REDIS_URL)
+        else:
+            _backend = InMemorySessionState()
+    return _backend
+
+
+def set_session_state(backend: SessionStateBackend) -> None:
+    """Override the backend, e.g. with an InMemorySessionState in tests."""
+    global _backend
+    _backend = backend
+
+
+def session_key_for(context) -> str:
+    """Stable key for a Chainlit session.
+
+    The Chainlit thread id survives reconnects and resumes, unlike the
+    websocket session id which changes whenever the browser reconnects.
+    """
+    session = context.session
+    return getattr(session, "thread_id", None) or session.id
@@ -0,0 +1,204 @@
+"""In-process index of the part numbers in the inventory spreadsheets under inventory/.
+
+app_aura.py looks up the identifiers in each message here before the run, so
+questions about a known SKU get its inventory rows as context instead of
+waiting on the agent's search tool. Check what would be matched with:
+
+    python sku_index.py "Do you stock DPR-F140 and ALPU-F140?"
+"""
+import os
+import re
+import csv
+import glob
+import time
+import asyncio
+import argparse
+import threading
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Tuple
+
+# Spreadsheets are read with pandas when installed, otherwise only CSV files are indexed
+try:
+    import pandas as pd
+except ImportError:
+    pd = None
+
+# The dockerfile copies this directory into the image next to the app
+SKU_INDEX_DATA_DIR = os.getenv("SKU_INDEX_DATA_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "inventory"))
+# Columns holding part numbers, compared case-insensitively and ignoring spaces and punctuation
+SKU_INDEX_COLUMNS = [
+    column.strip()
+    for column in os.getenv("SKU_INDEX_COLUMNS", "sku,part number,part no,model,model number,item number,mpn").split(",")
+    if column.strip()
+]
+# More matches than this in one message is a comparison question, the search tool handles those better
+SKU_INDEX_MAX_MATCHES = int(os.getenv("SKU_INDEX_MAX_MATCHES", "5"))
+SKU_INDEX_MAX_CHARS = int(os.getenv("SKU_INDEX_MAX_CHARS", "4000"))
+
+TABLE_EXTENSIONS = [".csv", ".xlsx", ".parquet"]
+# Candidate identifiers: letters and digits, optionally joined by - / . _
+TOKEN_PATTERN = re.compile(r"[A-Za-z0-9]+(?:[-/._][A-Za-z0-9]+)*")
+
+
+def normalize(value: str) -> str:
+    # "dpr-f140", "DPR F140" and "DPRF140" are the same part
+    return re.sub(r"[^0-9A-Z]", "", str(value).upper())
+
+
+def _is_part_number(key: str) -> bool:
+    # Part numbers mix letters and digits, which keeps words and plain numbers ("PoE", "10", "2024") out of the index
+    return len(key) >= 4 and any(c.isdigit() for c in key) and any(c.isalpha() for c in key)
+
+
+@dataclass
+class Table:
+    source: str
+    columns: Tuple[str, ...]
+    rows: List[Tuple[str, ...]] = field(default_factory=list)
+
+
+@dataclass
+class Match:
+    part_number: str
+    table: Table
+    row: Tuple[str, ...]
+
+    def describe(self) -> str:
+        values = "; ".join(f"{column}: {value}" for column, value in zip(self.table.columns, self.row) if value)
+        return f"- {self.part_number} ({os.path.basename(self.table.source)}): {values}"
+
+
+class SkuIndex:
+    """Hash map from normalized part number to the inventory rows that carry it."""
+
+    def __init__(self, key_columns: List[str] = SKU_INDEX_COLUMNS) -> None:
+        self.key_columns = {normalize(column) for column in key_columns}
+        self.tables: List[Table] = []
+        # Rows are shared with their table, an entry is just (table number, row number)
+        self._entries: Dict[str, List[Tuple[int, int]]] = {}
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def add_table(self, table: Table) -> int:
+        key_positions = [i for i, column in enumerate(table.columns) if normalize(column) in self.key_columns]
+        if not key_positions:
+            print(f"No part number column in {table.source}, skipped")
+            return 0
+        table_number = len(self.tables)
+        self.tables.append(table)
+        added = 0
+        for row_number, row in enumerate(table.rows):
+            for position in key_positions:
+                key = normalize(row[position]) if position < len(row) else ""
+                if _is_part_number(key):
+                    self._entries.setdefault(key, []).append((table_number, row_number))
+                    added += 1
+        return added
+
+    def load_dir(self, path: str = SKU_INDEX_DATA_DIR) -> int:
+        if not os.path.isdir(path):
+            print(f"SKU index: {path} does not exist, part number lookups are disabled")
+            return 0
+        added = 0
+        for file_path in sorted(glob.glob(os.path.join(path, "**", "*"), recursive=True)):
+            if os.path.splitext(file_path)[1].lower() not in TABLE_EXTENSIONS:
+                continue
+            try:
+                table = read_table(file_path)
+            except Exception as e:
+                print(f"Could not index {file_path}: {str(e)}")
+                continue
+            if table is not None:
+                added += self.add_table(table)
+        return added
+
+    def lookup(self, part_number: str) -> List[Match]:
+        key = normalize(part_number)
+        return [
+            Match(part_number, self.tables[table_number], self.tables[table_number].rows[row_number])
+            for table_number, row_number in self._entries.get(key, [])
+        ]
+
+    def find(self, text: str) -> List[Match]:
+        """Inventory rows for the known part numbers mentioned in `text`, in order of mention."""
+        matches: List[Match] = []
+        seen = set()
+        for token in TOKEN_PATTERN.findall(text):
+            key = normalize(token)
+            if key in seen or not _is_part_number(key):
+                continue
+            seen.add(key)
+            matches.extend(self.lookup(token))
+        return matches
+
+    def context_for(self, text: str, max_matches: int = SKU_INDEX_MAX_MATCHES) -> Optional[str]:
+        """Run instructions carrying the inventory rows for `text`, None to leave the message to search.
+
+        Messages matching more than `max_matches` rows go to search as a whole rather than
+        with a partial set of records.
+        """
+        matches = self.find(text)
+        if not matches or len(matches) > max_matches:
+            return None
+        lines = [match.describe() for match in matches]
+        block = "\n".join(lines)[:SKU_INDEX_MAX_CHARS]
+        return (
+            "Inventory records for the part numbers in the user's message, looked up by exact part number:\n"
+            f"{block}\n"
+            "Answer from these records where they cover the question, "
+            "use the search tool for anything they don't include."
+        )
+
+
+def read_table(path: str) -> Optional[Table]:
+    extension = os.path.splitext(path)[1].lower()
+    if extension == ".csv":
+        with open(path, "r", encoding="utf-8-sig", newline="") as f:
+            reader = csv.reader(f)
+            columns = tuple(next(reader, []))
+            return Table(path, columns, [tuple(value.strip() for value in row) for row in reader])
+    if pd is None:
+        print(f"pandas is not installed, {path} not indexed")
+        return None
+    frame = pd.read_excel(path, dtype=str) if extension == ".xlsx" else pd.read_parquet(path).fillna("").astype(str)
+    frame = frame.fillna("")
+    return Table(path, tuple(str(column) for column in frame.columns), [tuple(row) for row in frame.itertuples(index=False)])
+
+
+sku_index = None
+_sku_index_lock = threading.Lock()
+
+
+def get_sku_index() -> SkuIndex:
+    # Built once per process on first use, the inventory ships with the image
+    global sku_index
+    with _sku_index_lock:
+        if sku_index is None:
+            start = time.perf_counter()
+            index = SkuIndex()
+            rows = index.load_dir()
+            sku_index = index
+            print(f"SKU index: {len(sku_index)} part numbers from {rows} rows in {(time.perf_counter() - start) * 1000:.0f} ms")
+    return sku_index
+
+
+async def load_sku_index() -> SkuIndex:
+    """get_sku_index for coroutines: reading the spreadsheets happens off the event loop."""
+    if sku_index is not None:
+        return sku_index
+    return await asyncio.to_thread(get_sku_index)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Look up the part numbers in a message")
+    parser.add_argument("message")
+    parser.add_argument("--data-dir", default=SKU_INDEX_DATA_DIR)
+    args = parser.parse_args()
+    index = SkuIndex()
+    index.load_dir(args.data_dir)
+    print(index.context_for(args.message) or "No known part numbers, the message goes to search")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,266 @@
+import os
+import io
+import time
+import asyncio
+import uuid
+import hashlib
+import threading
+from typing import Awaitable, Callable, Dict, Optional, Tuple
+
+from azure.ai.agents.models import FileInfo
+from azure.core.exceptions import HttpResponseError, ServiceRequestError, ServiceResponseError
+from azure.core.rest import HttpRequest
+
+from rate_limiter import backoff_delay, retry_after_seconds
+
+UPLOAD_CHUNK_SIZE = int(os.getenv("UPLOAD_CHUNK_SIZE_KB", "1024")) * 1024
+UPLOAD_MAX_ATTEMPTS = int(os.getenv("UPLOAD_MAX_ATTEMPTS", "5"))
+PROGRESS_INTERVAL = 0.5
+TRANSIENT_STATUS_CODES = (408, 429, 500, 502, 503, 504)
+AGENTS_API_VERSION = "2025-05-15-preview"
+
+OnProgress = Optional[Callable[[int, int], Awaitable[None]]]
+
+
+class ChunkedFileReader(io.RawIOBase):
+    """Read-only file object that hands out at most `chunk_size` bytes per read.
+
+    The SHA-256 is computed as the bytes go out, so the file is read once. The
+    transport may read from a worker thread, hence the lock around the hash.
+    """
+
+    def __init__(self, path: str, chunk_size: int = UPLOAD_CHUNK_SIZE) -> None:
+        self.path = path
+        self.name = os.path.basename(path)
+        self.chunk_size = chunk_size
+        self.size = os.path.getsize(path)
+        self._file = open(path, "rb")
+        self._hash = hashlib.sha256()
+        self._lock = threading.Lock()
+        self.position = 0
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def tell(self) -> int:
+        return self.position
+
+    def read(self, size: int = -1) -> bytes:
+        if size is None or size < 0:
+            # read() means the rest of the file. Uploads never ask for that, they go through
+            # MultipartFileBody, but callers that want the whole content still get it
+            chunks = []
+            while True:
+                data = self._read_chunk(self.chunk_size)
+                if not data:
+                    return b"".join(chunks)
+                chunks.append(data)
+        return self._read_chunk(min(size, self.chunk_size))
+
+    def _read_chunk(self, size: int) -> bytes:
+        with self._lock:
+            data = self._file.read(size)
+            self._hash.update(data)
+            self.position += len(data)
+        return data
+
+    def readinto(self, buffer) -> int:
+        data = self.read(len(buffer))
+        buffer[:len(data)] = data
+        return len(data)
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        """Retries rewind the body, the hash is rebuilt up to the new position."""
+        if whence == io.SEEK_CUR:
+            offset += self.position
+        elif whence == io.SEEK_END:
+            offset += self.size
+        with self._lock:
+            self._file.seek(0)
+            self._hash = hashlib.sha256()
+            remaining = offset
+            while remaining > 0:
+                data = self._file.read(min(self.chunk_size, remaining))
+                if not data:
+                    break
+                self._hash.update(data)
+                remaining -= len(data)
+            self.position = offset - remaining
+        return self.position
+
+    def hexdigest(self) -> str:
+        with self._lock:
+            return self._hash.hexdigest()
+
+    def close(self) -> None:
+        self._file.close()
+        super().close()
+
+
+class MultipartFileBody(io.RawIOBase):
+    """multipart/form-data body that streams a ChunkedFileReader between its form parts.
+
+    requests' `files=` encoder reads the whole file into memory before sending. This
+    body has a known length and hands the transport at most one chunk per read, so
+    the sync clients send it as it is read. Seeking back to 0 lets the SDK retry it.
+    """
+
+    def __init__(self, reader: ChunkedFileReader, fields: Dict[str, str], file_field: str = "file") -> None:
+        boundary = uuid.uuid4().hex
+        self.content_type = f"multipart/form-data; boundary={boundary}"
+        head = "".join(
+            f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n{value}\r\n'
+            for name, value in fields.items()
+        )
+        head += (
+            f'--{boundary}\r\nContent-Disposition: form-data; name="{file_field}"; filename="{reader.name}"\r\n'
+            "Content-Type: application/octet-stream\r\n\r\n"
+        )
+        self.reader = reader
+        self._head = head.encode()
+        self._tail = f"\r\n--{boundary}--\r\n".encode()
+        self.size = len(self._head) + reader.size + len(self._tail)
+        self.position = 0
+
+    def __len__(self) -> int:
+        return self.size
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def tell(self) -> int:
+        return self.position
+
+    def read(self, size: int = -1) -> bytes:
+        if size is None or size < 0:
+            size = self.reader.chunk_size
+        file_end = len(self._head) + self.reader.size
+        if self.position < len(self._head):
+            data = self._head[self.position:self.position + size]
+        elif self.position < file_end:
+            data = self.reader.read(min(size, file_end - self.position))
+        else:
+            offset = self.position - file_end
+            data = self._tail[offset:offset + size]
+        self.position += len(data)
+        return data
+
+    def readinto(self, buffer) -> int:
+        data = self.read(len(buffer))
+        buffer[:len(data)] = data
+        return len(data)
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        if whence == io.SEEK_CUR:
+            offset += self.position
+        elif whence == io.SEEK_END:
+            offset += self.size
+        file_offset = min(max(offset - len(self._head), 0), self.reader.size)
+        self.reader.seek(file_offset)
+        self.position = offset
+        return self.position
+
+
+def upload_agent_file(agents_client, reader: ChunkedFileReader, purpose: str = "assistants") -> FileInfo:
+    """Upload through the sync AgentsClient's Files API with a streamed multipart body."""
+    body = MultipartFileBody(reader, {"purpose": purpose})
+    request = HttpRequest(
+        "POST",
+        "/files",
+        params={"api-version": AGENTS_API_VERSION},
+        headers={"Accept": "application/json", "Content-Type": body.content_type, "Content-Length": str(len(body))},
+        content=body,
+    )
+    response = agents_client.send_request(request)
+    response.raise_for_status()
+    return FileInfo(response.json())
+
+
+def is_transient(error: Exception) -> bool:
+    if isinstance(error, (ServiceRequestError, ServiceResponseError, ConnectionError, asyncio.TimeoutError)):
+        return True
+    return isinstance(error, HttpResponseError) and error.status_code in TRANSIENT_STATUS_CODES
+
+
+def _retry_delay(error: Exception, attempt: int) -> float:
+    response = getattr(error, "response", None)
+    retry_after = retry_after_seconds(response.headers) if response is not None else None
+    return backoff_delay(attempt, retry_after)
+
+
+async def _report_progress(reader: ChunkedFileReader, on_progress: OnProgress) -> None:
+    sent = -1
+    while True:
+        if reader.position != sent:
+            sent = reader.position
+            await on_progress(sent, reader.size)
+        await asyncio.sleep(PROGRESS_INTERVAL)
+
+
+async def upload_streaming(
+    upload: Callable[[ChunkedFileReader], Awaitable],
+    path: str,
+    on_progress: OnProgress = None,
+    chunk_size: int = UPLOAD_CHUNK_SIZE,
+    max_attempts: int = UPLOAD_MAX_ATTEMPTS,
+) -> Tuple[object, str]:
+    """Stream `path` through `upload(reader)` in fixed-size chunks.
+
+    Transient failures restart the upload from the beginning of the file (the
+    Files API takes a single request), up to `max_attempts`. Returns the upload
+    result and the SHA-256 of the bytes that were sent.
+    """
+    for attempt in range(max_attempts):
+        reader = ChunkedFileReader(path, chunk_size)
+        reporter = asyncio.create_task(_report_progress(reader, on_progress)) if on_progress else None
+        start = time.perf_counter()
+        try:
+            result = await upload(reader)
+            digest = reader.hexdigest()
+            if on_progress:
+                await on_progress(reader.size, reader.size)
+            print(f"Uploaded {reader.name}: {reader.size} bytes in {time.perf_counter() - start:.1f}s")
+            return result, digest
+        except Exception as e:
+            if not is_transient(e) or attempt + 1 == max_attempts:
+                raise
+            delay = _retry_delay(e, attempt)
+            print(f"Upload of {reader.name} failed at {reader.position}/{reader.size} bytes ({e}), retrying in {delay:.1f}s")
+            await asyncio.sleep(delay)
+        finally:
+            if reporter:
+                reporter.cancel()
+            reader.close()
+
+
+def upload_streaming_sync(
+    upload: Callable[[ChunkedFileReader], object],
+    path: str,
+    chunk_size: int = UPLOAD_CHUNK_SIZE,
+    max_attempts: int = UPLOAD_MAX_ATTEMPTS,
+) -> Tuple[object, str]:
+    """Blocking variant for the setup scripts."""
+    for attempt in range(max_attempts):
+        reader = ChunkedFileReader(path, chunk_size)
+        try:
+            result = upload(reader)
+            return result, reader.hexdigest()
+        except Exception as e:
+            if not is_transient(e) or attempt + 1 == max_attempts:
+                raise
+            delay = _retry_delay(e, attempt)
+            print(f"Upload of {reader.name} failed ({e}), retrying in {delay:.1f}s")
+            time.sleep(delay)
+        finally:
+            reader.close()
+
+
+def format_progress(sent: int, total: int) -> str:
+    percent = 100 if not total else int(sent * 100 / total)
+    return f"{percent}% ({sent / 1024 / 1024:.1f} of {total / 1024 / 1024:.1f} MB)"
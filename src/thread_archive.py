@@ -0,0 +1,207 @@
+"""Moves the steps, elements and feedback of inactive threads to blob storage.
+
+    python thread_archive.py                      # archive threads idle for THREAD_ARCHIVE_AFTER_DAYS
+    python thread_archive.py --days 60 --max-batches 10
+    python thread_archive.py --rehydrate <thread_id>
+
+The Thread rows stay, so archived threads are still listed in the sidebar.
+data_layer.py rehydrates a thread when it is opened.
+"""
+from dotenv import load_dotenv
+load_dotenv()
+
+import os
+import gzip
+import json
+import uuid
+import asyncio
+import argparse
+import tempfile
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Optional
+
+import asyncpg
+from azure.core.exceptions import ResourceExistsError
+from azure.storage.blob.aio import ContainerClient
+
+from element_storage import AZURITE_CONNECTION_STRING
+
+DATABASE_URL = os.getenv("DATABASE_URL")
+THREAD_ARCHIVE_CONNECTION_STRING = os.getenv("THREAD_ARCHIVE_CONNECTION_STRING") or AZURITE_CONNECTION_STRING
+THREAD_ARCHIVE_CONTAINER = os.getenv("THREAD_ARCHIVE_CONTAINER", "thread-archive")
+# Chainlit keeps sessions for 15 days, archive well after that
+THREAD_ARCHIVE_AFTER_DAYS = int(os.getenv("THREAD_ARCHIVE_AFTER_DAYS", "30"))
+THREAD_ARCHIVE_BATCH_SIZE = int(os.getenv("THREAD_ARCHIVE_BATCH_SIZE", "200"))
+CURSOR_PREFETCH = 50
+# Batches are staged in memory up to this size, then on disk
+SPOOL_MAX_BYTES = 32 * 1024 * 1024
+
+# Threads with steps, none of them started after the cutoff. Locked so a
+# concurrent run of the job skips them, and new steps wait for the commit.
+SELECT_BATCH = """
+SELECT t.id
+FROM "Thread" t
+WHERE t."createdAt" < $1
+  AND NOT EXISTS (SELECT 1 FROM "ThreadArchive" a WHERE a."threadId" = t.id)
+  AND EXISTS (SELECT 1 FROM "Step" s WHERE s."threadId" = t.id)
+  AND NOT EXISTS (SELECT 1 FROM "Step" s WHERE s."threadId" = t.id AND s."startTime" >= $1)
+ORDER BY t."createdAt"
+LIMIT $2
+FOR UPDATE OF t SKIP LOCKED
+"""
+
+# One JSON line per thread (jsonb renders without newlines), built by Postgres and streamed through a cursor
+EXPORT_THREADS = """
+SELECT t.id,
+       jsonb_array_length(x.steps) AS steps,
+       jsonb_array_length(x.elements) AS elements,
+       jsonb_array_length(x.feedback) AS feedback,
+       jsonb_build_object('thread', to_jsonb(t), 'steps', x.steps, 'elements', x.elements, 'feedback', x.feedback)::TEXT AS record
+FROM "Thread" t
+CROSS JOIN LATERAL (
+    SELECT
+        COALESCE((SELECT jsonb_agg(s ORDER BY s."startTime") FROM "Step" s WHERE s."threadId" = t.id), '[]'::JSONB) AS steps,
+        COALESCE((SELECT jsonb_agg(e) FROM "Element" e JOIN "Step" s ON s.id = e."stepId" WHERE s."threadId" = t.id), '[]'::JSONB) AS elements,
+        COALESCE((SELECT jsonb_agg(f) FROM "Feedback" f JOIN "Step" s ON s.id = f."stepId" WHERE s."threadId" = t.id), '[]'::JSONB) AS feedback
+) x
+WHERE t.id = ANY($1::TEXT[])
+"""
+
+ARCHIVE_COLUMNS = ["threadId", "blobKey", "offset", "length", "steps", "elements", "feedback"]
+
+
+class ThreadArchiver:
+    """Archives inactive threads batch by batch and brings single threads back on demand.
+
+    Each batch becomes one blob of concatenated gzip members, one member per
+    thread, so the blob reads as a regular .jsonl.gz and a single thread can
+    be fetched with a ranged download. The blob is written before the rows
+    are deleted, in the same transaction that took the row locks.
+    """
+
+    def __init__(
+        self,
+        pool: asyncpg.Pool,
+        container_client: ContainerClient,
+        after_days: int = THREAD_ARCHIVE_AFTER_DAYS,
+        batch_size: int = THREAD_ARCHIVE_BATCH_SIZE,
+    ) -> None:
+        self.pool = pool
+        self.container_client = container_client
+        self.after_days = after_days
+        self.batch_size = batch_size
+
+    async def ensure_container(self) -> None:
+        try:
+            await self.container_client.create_container()
+        except ResourceExistsError:
+            pass
+
+    async def archive_batch(self) -> int:
+        """Archive up to batch_size threads, returns how many were archived."""
+        cutoff = datetime.now(timezone.utc).replace(tzinfo=None) - timedelta(days=self.after_days)
+        blob_key = f"threads/{datetime.now(timezone.utc):%Y/%m/%d}/{uuid.uuid4().hex}.jsonl.gz"
+        async with self.pool.acquire() as connection:
+            async with connection.transaction():
+                thread_ids = [row["id"] for row in await connection.fetch(SELECT_BATCH, cutoff, self.batch_size)]
+                if not thread_ids:
+                    return 0
+
+                records = []
+                with tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_BYTES) as spool:
+                    async for row in connection.cursor(EXPORT_THREADS, thread_ids, prefetch=CURSOR_PREFETCH):
+                        member = gzip.compress(row["record"].encode("utf-8") + b"\n")
+                        records.append((row["id"], blob_key, spool.tell(), len(member), row["steps"], row["elements"], row["feedback"]))
+                        spool.write(member)
+                    size = spool.tell()
+                    spool.seek(0)
+                    await self.container_client.upload_blob(blob_key, spool, length=size, overwrite=False)
+
+                await connection.copy_records_to_table("ThreadArchive", records=records, columns=ARCHIVE_COLUMNS)
+                # The ratings stay counted in the feedback rollups
+                await connection.execute("SET LOCAL chainlit.archiving = 'on'")
+                await connection.execute(
+                    'DELETE FROM "Feedback" f USING "Step" s WHERE s.id = f."stepId" AND s."threadId" = ANY($1::TEXT[])',
+                    thread_ids,
+                )
+                # Elements and child steps go with their steps (ON DELETE CASCADE)
+                await connection.execute('DELETE FROM "Step" WHERE "threadId" = ANY($1::TEXT[])', thread_ids)
+
+        print(f"Archived {len(records)} threads ({size / 1024:.0f} KB) to {blob_key}")
+        return len(records)
+
+    async def archive(self, max_batches: Optional[int] = None) -> int:
+        archived = 0
+        batches = 0
+        while max_batches is None or batches < max_batches:
+            count = await self.archive_batch()
+            if not count:
+                break
+            archived += count
+            batches += 1
+        return archived
+
+    async def load(self, blob_key: str, offset: int, length: int) -> Dict:
+        downloader = await self.container_client.download_blob(blob_key, offset=offset, length=length)
+        return json.loads(gzip.decompress(await downloader.readall()))
+
+    async def rehydrate(self, thread_id: str) -> bool:
+        """Restore an archived thread's rows. Returns False if the thread wasn't archived."""
+        async with self.pool.acquire() as connection:
+            # Cheap check first, this runs every time a thread is opened
+            if not await connection.fetchval('SELECT 1 FROM "ThreadArchive" WHERE "threadId" = $1', thread_id):
+                return False
+            async with connection.transaction():
+                archive = await connection.fetchrow('SELECT * FROM "ThreadArchive" WHERE "threadId" = $1 FOR UPDATE', thread_id)
+                if not archive:
+                    # Rehydrated by a concurrent request
+                    return True
+                record = await self.load(archive["blobKey"], archive["offset"], archive["length"])
+                await connection.execute("SET LOCAL chainlit.archiving = 'on'")
+                # Steps referencing a parent in the same statement are fine, FKs are checked at the end of it
+                for table, rows in (("Step", record["steps"]), ("Element", record["elements"]), ("Feedback", record["feedback"])):
+                    if rows:
+                        await connection.execute(
+                            f'INSERT INTO "{table}" SELECT * FROM json_populate_recordset(NULL::"{table}", $1::JSON) ON CONFLICT (id) DO NOTHING',
+                            json.dumps(rows),
+                        )
+                await connection.execute('DELETE FROM "ThreadArchive" WHERE "threadId" = $1', thread_id)
+        print(f"Rehydrated thread {thread_id}: {len(record['steps'])} steps from {archive['blobKey']}")
+        return True
+
+
+def create_archiver(pool: asyncpg.Pool) -> ThreadArchiver:
+    container_client = ContainerClient.from_connection_string(THREAD_ARCHIVE_CONNECTION_STRING, THREAD_ARCHIVE_CONTAINER)
+    return ThreadArchiver(pool, container_client)
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser(description="Archive inactive Chainlit threads to blob storage")
+    parser.add_argument("--database-url", default=DATABASE_URL)
+    parser.add_argument("--days", type=int, default=THREAD_ARCHIVE_AFTER_DAYS, help="Archive threads idle for this many days")
+    parser.add_argument("--batch-size", type=int, default=THREAD_ARCHIVE_BATCH_SIZE)
+    parser.add_argument("--max-batches", type=int)
+    parser.add_argument("--rehydrate", metavar="THREAD_ID", help="Restore one archived thread instead")
+    args = parser.parse_args()
+    if not args.database_url:
+        raise ValueError("DATABASE_URL environment variable is not set.")
+
+    pool = await asyncpg.create_pool(args.database_url, min_size=1, max_size=2)
+    archiver = create_archiver(pool)
+    archiver.after_days = args.days
+    archiver.batch_size = args.batch_size
+    try:
+        if args.rehydrate:
+            if not await archiver.rehydrate(args.rehydrate):
+                print(f"Thread {args.rehydrate} is not archived")
+            return
+        await archiver.ensure_container()
+        archived = await archiver.archive(args.max_batches)
+        print(f"Archived {archived} threads idle for {args.days} days")
+    finally:
+        await archiver.container_client.close()
+        await pool.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,201 @@
+import os
+import json
+import time
+import asyncio
+import hashlib
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+from semantic_kernel.functions import FunctionResult
+
+TOOL_CACHE_MAX_ENTRIES = int(os.getenv("TOOL_CACHE_MAX_ENTRIES", "2000"))
+TOOL_CACHE_MAX_MB = int(os.getenv("TOOL_CACHE_MAX_MB", "64"))
+TOOL_CACHE_DEFAULT_TTL = int(os.getenv("TOOL_CACHE_DEFAULT_TTL", "600"))
+
+# Read-only GitHub MCP tools that are safe to cache, with their TTL in seconds.
+# Anything not listed (create_issue, push_files, ...) always goes to the server.
+# The GitHub server runs with one token for every session, so results don't
+# depend on who asked and can be shared between users.
+CACHEABLE_TOOLS: Dict[str, int] = {
+    "search_repositories": 1800,
+    "search_users": 3600,
+    "search_code": 1800,
+    "search_issues": 600,
+    "get_file_contents": 1800,
+    "list_commits": 600,
+    "list_issues": 300,
+    "get_issue": 300,
+    "list_pull_requests": 300,
+    "get_pull_request": 300,
+    "get_pull_request_files": 300,
+}
+
+
+@dataclass
+class ToolStats:
+    hits: int = 0
+    misses: int = 0
+    bypassed: int = 0
+
+    @property
+    def hit_rate(self) -> float:
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+
+def canonical_arguments(arguments: Optional[Dict]) -> str:
+    """Arguments as sorted JSON, with unset values dropped so {"page": None} == {}."""
+    cleaned = {key: value for key, value in (arguments or {}).items() if value is not None}
+    return json.dumps(cleaned, sort_keys=True, separators=(",", ":"), default=str)
+
+
+def _tool_name(tool: str) -> str:
+    # Kernel functions are exposed as "Plugin-tool", MCP sessions use the bare name
+    return tool.split("-", 1)[-1]
+
+
+def _size_of(value) -> int:
+    return len(value) if isinstance(value, (str, bytes)) else len(str(value))
+
+
+class ToolResultCache:
+    """Size-bounded LRU of MCP tool results keyed by server, tool and arguments.
+
+    Concurrent identical calls share a single request to the server.
+    """
+
+    def __init__(
+        self,
+        ttls: Dict[str, int] = CACHEABLE_TOOLS,
+        max_entries: int = TOOL_CACHE_MAX_ENTRIES,
+        max_bytes: int = TOOL_CACHE_MAX_MB * 1024 * 1024,
+    ) -> None:
+        self.ttls = ttls
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self.evictions = 0
+        self._entries: "OrderedDict[str, Tuple[float, int, Any]]" = OrderedDict()
+        self._in_flight: Dict[str, asyncio.Future] = {}
+        self.tools: Dict[str, ToolStats] = {}
+
+    def is_cacheable(self, tool: str) -> bool:
+        return _tool_name(tool) in self.ttls
+
+    def key(self, server: str, tool: str, arguments: Optional[Dict]) -> str:
+        raw = f"{server.lower()}\n{_tool_name(tool)}\n{canonical_arguments(arguments)}"
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def get(self, key: str):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires_at, size, value = entry
+        if expires_at < time.monotonic():
+            self._remove(key)
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    def put(self, key: str, tool: str, value) -> None:
+        size = _size_of(value)
+        if size > self.max_bytes:
+            return
+        if key in self._entries:
+            self._remove(key)
+        ttl = self.ttls.get(_tool_name(tool), TOOL_CACHE_DEFAULT_TTL)
+        self._entries[key] = (time.monotonic() + ttl, size, value)
+        self.bytes += size
+        while len(self._entries) > self.max_entries or self.bytes > self.max_bytes:
+            self._remove(next(iter(self._entries)))
+            self.evictions += 1
+
+    def _remove(self, key: str) -> None:
+        _, size, _ = self._entries.pop(key)
+        self.bytes -= size
+
+    async def get_or_call(
+        self,
+        server: str,
+        tool: str,
+        arguments: Optional[Dict],
+        call: Callable[[], Awaitable[Any]],
+        should_cache: Callable[[Any], bool] = lambda value: value is not None,
+    ):
+        """Return a cached result for read-only tools, otherwise await `call` and cache it."""
+        stats = self.tools.setdefault(_tool_name(tool), ToolStats())
+        if not self.is_cacheable(tool):
+            stats.bypassed += 1
+            return await call()
+
+        key = self.key(server, tool, arguments)
+        value = self.get(key)
+        if value is not None:
+            stats.hits += 1
+            print(f"Tool cache hit {server}/{tool} ({stats.hit_rate:.0%} hit rate)")
+            return value
+        if key in self._in_flight:
+            stats.hits += 1
+            return await asyncio.shield(self._in_flight[key])
+
+        stats.misses += 1
+        future = asyncio.get_running_loop().create_future()
+        self._in_flight[key] = future
+        try:
+            value = await call()
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            # Nobody else may be waiting, don't leave an unretrieved exception behind
+            future.exception()
+            raise
+        else:
+            if should_cache(value):
+                self.put(key, tool, value)
+            future.set_result(value)
+            return value
+        finally:
+            self._in_flight.pop(key, None)
+
+    def stats(self) -> Dict:
+        return {
+            "entries": len(self._entries),
+            "bytes": self.bytes,
+            "evictions": self.evictions,
+            "tools": {
+                name: {"hits": stats.hits, "misses": stats.misses, "bypassed": stats.bypassed, "hit_rate": round(stats.hit_rate, 3)}
+                for name, stats in self.tools.items()
+            },
+        }
+
+
+tool_cache = ToolResultCache()
+
+
+def is_tool_error(result) -> bool:
+    # MCP reports tool failures in the result instead of raising
+    return bool(getattr(result, "isError", False)) or (isinstance(result, str) and result.startswith('{"error"'))
+
+
+async def cache_tool_invocations(context, next):
+    """Semantic Kernel function invocation filter that serves cacheable MCP tools from tool_cache."""
+    function = context.function
+    if not tool_cache.is_cacheable(function.name):
+        await next(context)
+        return
+
+    async def invoke():
+        await next(context)
+        return context.result.value if context.result else None
+
+    value = await tool_cache.get_or_call(
+        function.plugin_name or "",
+        function.name,
+        dict(context.arguments or {}),
+        invoke,
+        should_cache=lambda value: value is not None and not is_tool_error(value),
+    )
+    context.result = FunctionResult(function=function.metadata, value=value)
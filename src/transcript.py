@@ -0,0 +1,69 @@
+from typing import List
+
+from semantic_kernel.agents import AgentGroupChat, ChatCompletionAgent, ChatHistoryAgentThread
+from semantic_kernel.agents.channels.chat_history_channel import ChatHistoryChannel
+from semantic_kernel.contents import ChatHistory, ChatMessageContent
+
+from session_memory import cap_history, SESSION_HISTORY_MAX_KB
+
+
+class TranscriptChannel(ChatHistoryChannel):
+    """ChatHistoryChannel that references the group chat's messages instead of deep-copying them.
+
+    Only messages carrying content the channel can't use are copied, with
+    those items left out. Nothing in the channel edits message content, so
+    one ChatMessageContent serves the transcript, the channel and the thread.
+    """
+
+    thread_history: ChatHistory | None = None
+
+    async def receive(self, history: List[ChatMessageContent]) -> None:
+        for message in history:
+            items = [item for item in message.items or [] if isinstance(item, self.ALLOWED_CONTENT_TYPES)]
+            if not items:
+                continue
+            if len(items) != len(message.items):
+                message = message.model_copy(update={"items": items})
+            self.messages.append(message)
+
+
+# The channel's thread field is a forward reference, resolve it once now that the agents are imported
+TranscriptChannel.model_rebuild()
+
+
+class TranscriptThread(ChatHistoryAgentThread):
+    """Agent thread that doesn't take the same message twice."""
+
+    async def _on_new_message(self, new_message: str | ChatMessageContent) -> None:
+        # The channel hands each agent the previous agent's reply, which is already in the thread
+        if isinstance(new_message, ChatMessageContent) and any(message is new_message for message in reversed(self._chat_history.messages)):
+            return
+        await super()._on_new_message(new_message)
+
+
+class TranscriptAgent(ChatCompletionAgent):
+    """ChatCompletionAgent whose group chat channel is a TranscriptChannel over a TranscriptThread."""
+
+    async def create_channel(self, chat_history: ChatHistory | None = None, thread_id: str | None = None) -> TranscriptChannel:
+        # Kept on the channel so cap_transcript can trim what the agents see
+        history = chat_history if chat_history is not None else ChatHistory()
+        thread = TranscriptThread(chat_history=history, thread_id=thread_id)
+        if thread.id is None:
+            await thread.create()
+        return TranscriptChannel(messages=list(history.messages), thread=thread, thread_history=history)
+
+
+def create_group_chat(chat_history: ChatHistory, **kwargs) -> AgentGroupChat:
+    """AgentGroupChat that records its messages in `chat_history` rather than a history of its own."""
+    return AgentGroupChat(chat_history=chat_history, **kwargs)
+
+
+def cap_transcript(agent_group_chat: AgentGroupChat, max_bytes: int = SESSION_HISTORY_MAX_KB * 1024) -> int:
+    """Trim the group chat's history, channels and agent threads to the session history budget."""
+    removed = cap_history(agent_group_chat.history, max_bytes)
+    for channel in agent_group_chat.agent_channels.values():
+        if isinstance(channel, TranscriptChannel):
+            cap_history(channel, max_bytes)
+            if channel.thread_history is not None:
+                cap_history(channel.thread_history, max_bytes)
+    return removed
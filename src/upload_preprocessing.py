@@ -0,0 +1,287 @@
+import os
+import json
+import shutil
+import datetime
+import tempfile
+from dataclasses import dataclass, field
+from typing import Callable, Dict, Iterator, List, Optional
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+CHUNK_ROWS = int(os.getenv("UPLOAD_PREPROCESS_CHUNK_ROWS", "100000"))
+PARQUET_COMPRESSION = os.getenv("UPLOAD_PREPROCESS_COMPRESSION", "zstd")
+SAMPLE_ROWS = 5
+# Integers longer than this are identifiers (card, account, tracking numbers), not quantities
+MAX_INTEGER_DIGITS = 15
+
+TABULAR_EXTENSIONS = [".csv", ".xlsx"]
+
+
+@dataclass
+class ColumnStats:
+    dtype: str
+    nulls: int = 0
+    min: Optional[object] = None
+    max: Optional[object] = None
+
+    def update(self, series: pd.Series) -> None:
+        self.nulls += int(series.isna().sum())
+        if self.dtype in ("number", "integer", "datetime") and series.notna().any():
+            low, high = series.min(), series.max()
+            self.min = low if self.min is None else min(self.min, low)
+            self.max = high if self.max is None else max(self.max, high)
+
+
+@dataclass
+class PreprocessedFile:
+    """A tabular upload converted to Parquet plus the JSON summary that goes with it."""
+    source_name: str
+    parquet_path: str
+    summary_path: str
+    summary: Dict = field(default_factory=dict)
+    # Set when preprocess_table made the directory, remove_preprocessed deletes it
+    temp_dir: Optional[str] = None
+
+    @property
+    def paths(self) -> List[str]:
+        return [self.parquet_path, self.summary_path]
+
+
+def is_tabular(name: str) -> bool:
+    # Go by extension, browsers report CSV mime types inconsistently
+    return os.path.splitext(name)[1].lower() in TABULAR_EXTENSIONS
+
+
+def _normalize_name(name, index: int) -> str:
+    name = str(name).strip() if name is not None else ""
+    return name or f"column_{index + 1}"
+
+
+def _is_identifier(values: pd.Series) -> bool:
+    # "01234" is a zip code or a part number, reading it as 1234 loses the leading zero
+    text = values.astype(str).str.strip()
+    return bool(text.str.fullmatch(r"0\d+").any() or text.str.fullmatch(rf"\d{{{MAX_INTEGER_DIGITS + 1},}}").any())
+
+
+def _infer_types(frame: pd.DataFrame) -> Dict[str, Optional[str]]:
+    """Type of each column in one chunk, None for a column with no values in it."""
+    types = {}
+    for column in frame.columns:
+        series = frame[column].dropna()
+        if series.empty:
+            types[column] = None
+            continue
+        if pd.api.types.is_datetime64_any_dtype(series):
+            types[column] = "datetime"
+            continue
+        if pd.api.types.is_numeric_dtype(series) and not pd.api.types.is_bool_dtype(series):
+            types[column] = "integer" if (series % 1 == 0).all() else "number"
+            continue
+        if pd.api.types.is_bool_dtype(series):
+            types[column] = "string"
+            continue
+        # Workbook cells already carry dates, CSV values are strings that may parse
+        if series.map(lambda value: isinstance(value, (datetime.date, pd.Timestamp))).all():
+            types[column] = "datetime"
+            continue
+        if _is_identifier(series):
+            types[column] = "string"
+            continue
+        numbers = pd.to_numeric(series, errors="coerce")
+        if numbers.notna().all():
+            types[column] = "integer" if (numbers % 1 == 0).all() else "number"
+            continue
+        dates = pd.to_datetime(series, errors="coerce", format="mixed")
+        if dates.notna().all():
+            types[column] = "datetime"
+            continue
+        types[column] = "string"
+    return types
+
+
+def _merge_types(types: Dict[str, Optional[str]], chunk_types: Dict[str, Optional[str]]) -> None:
+    """Widen the file's column types so every chunk's values fit: integer + number is number, any other mix is string."""
+    for column, kind in chunk_types.items():
+        previous = types.get(column)
+        if previous is None or kind is None or previous == kind:
+            types[column] = previous or kind
+        elif {previous, kind} == {"integer", "number"}:
+            types[column] = "number"
+        else:
+            types[column] = "string"
+
+
+def _coerce(frame: pd.DataFrame, types: Dict[str, str]) -> pd.DataFrame:
+    for column, kind in types.items():
+        if column not in frame:
+            frame[column] = None
+        original = frame[column]
+        if kind == "integer":
+            frame[column] = pd.to_numeric(original, errors="coerce").astype("Int64")
+        elif kind == "number":
+            frame[column] = pd.to_numeric(original, errors="coerce").astype("float64")
+        elif kind == "datetime":
+            frame[column] = pd.to_datetime(original, errors="coerce", format="mixed")
+        else:
+            frame[column] = original.astype("string")
+        # Types come from every chunk, so a value that doesn't convert is a bug, not a null
+        lost = original.notna() & frame[column].isna()
+        if lost.any():
+            raise ValueError(f"Column {column!r}: {original[lost].iloc[0]!r} is not a valid {kind}")
+    return frame[list(types)]
+
+
+def _read_csv_chunks(path: str, chunk_rows: int) -> Iterator[pd.DataFrame]:
+    # Read everything as strings so type inference is ours, not pandas' per-chunk guess
+    yield from pd.read_csv(path, chunksize=chunk_rows, dtype=str, keep_default_na=True, encoding_errors="replace")
+
+
+def _read_xlsx_chunks(path: str, sheet_name: str, chunk_rows: int) -> Iterator[pd.DataFrame]:
+    from openpyxl import load_workbook
+
+    # read_only mode streams rows instead of loading the whole workbook
+    workbook = load_workbook(path, read_only=True, data_only=True)
+    try:
+        rows = workbook[sheet_name].iter_rows(values_only=True)
+        header = next(rows, None)
+        if header is None:
+            return
+        columns = [_normalize_name(name, index) for index, name in enumerate(header)]
+        batch = []
+        for row in rows:
+            if all(value is None for value in row):
+                continue
+            batch.append(row[:len(columns)])
+            if len(batch) >= chunk_rows:
+                yield pd.DataFrame(batch, columns=columns)
+                batch = []
+        if batch:
+            yield pd.DataFrame(batch, columns=columns)
+    finally:
+        workbook.close()
+
+
+def _xlsx_sheet_names(path: str) -> List[str]:
+    from openpyxl import load_workbook
+
+    workbook = load_workbook(path, read_only=True)
+    try:
+        return workbook.sheetnames
+    finally:
+        workbook.close()
+
+
+def _named(chunks: Iterator[pd.DataFrame]) -> Iterator[pd.DataFrame]:
+    for chunk in chunks:
+        chunk.columns = [_normalize_name(name, index) for index, name in enumerate(chunk.columns)]
+        yield chunk
+
+
+def _write_parquet(read_chunks: Callable[[], Iterator[pd.DataFrame]], source_name: str, output_dir: str, stem: str) -> Optional[PreprocessedFile]:
+    parquet_path = os.path.join(output_dir, f"{stem}.parquet")
+    summary_path = os.path.join(output_dir, f"{stem}.summary.json")
+    # First pass decides the types from the whole file, a value in the last chunk can still make a column a string
+    inferred: Dict[str, Optional[str]] = {}
+    for chunk in _named(read_chunks()):
+        _merge_types(inferred, _infer_types(chunk))
+    types = {column: kind or "string" for column, kind in inferred.items()}
+    stats = {column: ColumnStats(dtype=kind) for column, kind in types.items()}
+    writer = None
+    samples = None
+    row_count = 0
+    try:
+        for chunk in _named(read_chunks()):
+            chunk = _coerce(chunk, types)
+            table = pa.Table.from_pandas(chunk, preserve_index=False)
+            if writer is None:
+                writer = pq.ParquetWriter(parquet_path, table.schema, compression=PARQUET_COMPRESSION)
+                samples = chunk.head(SAMPLE_ROWS)
+            writer.write_table(table.cast(writer.schema))
+            for column in types:
+                stats[column].update(chunk[column])
+            row_count += len(chunk)
+    finally:
+        if writer is not None:
+            writer.close()
+    if writer is None:
+        return None
+
+    summary = {
+        "source": source_name,
+        "parquet_file": os.path.basename(parquet_path),
+        "rows": row_count,
+        "columns": [
+            {
+                "name": column,
+                "type": column_stats.dtype,
+                "nulls": column_stats.nulls,
+                "min": None if column_stats.min is None else str(column_stats.min),
+                "max": None if column_stats.max is None else str(column_stats.max),
+            }
+            for column, column_stats in stats.items()
+        ],
+        "sample": json.loads(samples.to_json(orient="records", date_format="iso")),
+        "load_with": f"pd.read_parquet('{os.path.basename(parquet_path)}')",
+    }
+    with open(summary_path, "w", encoding="utf-8") as f:
+        json.dump(summary, f, indent=2)
+    return PreprocessedFile(source_name=source_name, parquet_path=parquet_path, summary_path=summary_path, summary=summary)
+
+
+def preprocess_table(
+    path: str,
+    name: Optional[str] = None,
+    output_dir: Optional[str] = None,
+    chunk_rows: int = CHUNK_ROWS,
+) -> List[PreprocessedFile]:
+    """Stream a CSV/XLSX file into compressed Parquet with a schema/summary sidecar.
+
+    Workbooks produce one Parquet file per non-empty sheet.
+    """
+    name = name or os.path.basename(path)
+    temp_dir = None if output_dir else tempfile.mkdtemp(prefix="upload-")
+    output_dir = output_dir or temp_dir
+    stem, extension = os.path.splitext(name)
+    results = []
+    try:
+        if extension.lower() == ".xlsx":
+            for sheet_name in _xlsx_sheet_names(path):
+                sheet_stem = f"{stem}-{sheet_name}".replace(" ", "_")
+                read_sheet = lambda sheet_name=sheet_name: _read_xlsx_chunks(path, sheet_name, chunk_rows)
+                result = _write_parquet(read_sheet, f"{name}#{sheet_name}", output_dir, sheet_stem)
+                if result:
+                    results.append(result)
+        else:
+            result = _write_parquet(lambda: _read_csv_chunks(path, chunk_rows), name, output_dir, stem)
+            if result:
+                results.append(result)
+    except Exception:
+        if temp_dir:
+            shutil.rmtree(temp_dir, ignore_errors=True)
+        raise
+    if temp_dir and not results:
+        shutil.rmtree(temp_dir, ignore_errors=True)
+    for result in results:
+        result.temp_dir = temp_dir
+
+    for result in results:
+        before = os.path.getsize(path)
+        after = os.path.getsize(result.parquet_path)
+        print(f"Preprocessed {result.source_name}: {result.summary['rows']} rows, {before} -> {after} bytes")
+    return results
+
+
+def remove_preprocessed(results: List[PreprocessedFile]) -> None:
+    """Delete the temporary directories preprocess_table wrote, once the files are uploaded."""
+    for temp_dir in {result.temp_dir for result in results if result.temp_dir}:
+        shutil.rmtree(temp_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    import sys
+
+    for source in sys.argv[1:]:
+        for result in preprocess_table(source, output_dir=os.path.dirname(os.path.abspath(source))):
+            print(f" - {result.parquet_path}\n - {result.summary_path}")
@@ -0,0 +1,258 @@
+import os
+import asyncio
+import hashlib
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional, Set
+
+from azure.ai.agents.models import (
+    FilePurpose,
+    FileSearchToolResource,
+    ToolResources,
+    VectorStoreExpirationPolicy,
+    VectorStoreExpirationPolicyAnchor,
+    VectorStoreFileBatchStatus,
+    VectorStoreStatus,
+)
+
+from azure.core.exceptions import ResourceNotFoundError
+
+from streaming_upload import upload_streaming
+
+VECTOR_STORE_PREFIX = os.getenv("UPLOAD_VECTOR_STORE_PREFIX", "chainlit-uploads")
+# The service drops stores that haven't been used for this many days
+VECTOR_STORE_EXPIRES_AFTER_DAYS = int(os.getenv("UPLOAD_VECTOR_STORE_EXPIRES_AFTER_DAYS", "7"))
+BATCH_POLL_INTERVAL = float(os.getenv("UPLOAD_VECTOR_STORE_POLL_INTERVAL", "0.5"))
+BATCH_POLL_MAX_INTERVAL = 5.0
+BATCH_SIZE = 100
+EXPIRY_SWEEP_INTERVAL = timedelta(hours=6)
+# Threads whose store id and file map are kept in memory, older ones are looked up again when used
+VECTOR_STORE_CACHE_SIZE = int(os.getenv("UPLOAD_VECTOR_STORE_CACHE_SIZE", "1000"))
+FILE_CACHE_SIZE = 10 * VECTOR_STORE_CACHE_SIZE
+HASH_CHUNK_SIZE = 1024 * 1024
+
+
+def file_digest(path: str) -> str:
+    """SHA-256 of a file, read in chunks so large uploads aren't loaded at once."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(HASH_CHUNK_SIZE), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class VectorStoreManager:
+    """Keeps one vector store per agent thread and only embeds documents it hasn't seen.
+
+    Stores are scoped to a thread so a conversation never searches documents
+    uploaded to another one, but a document is uploaded once: the same content
+    added to another thread reuses the uploaded file. Files are uploaded under
+    their content hash, so the hash -> file mapping can be rebuilt from the
+    vector store itself after a restart.
+
+    Takes the async AgentsClient (azure.ai.agents.aio).
+    """
+
+    def __init__(
+        self,
+        agents_client,
+        prefix: str = VECTOR_STORE_PREFIX,
+        expires_after_days: int = VECTOR_STORE_EXPIRES_AFTER_DAYS,
+        cache_size: int = VECTOR_STORE_CACHE_SIZE,
+    ) -> None:
+        self.agents_client = agents_client
+        self.prefix = prefix
+        self.expires_after_days = expires_after_days
+        self.cache_size = cache_size
+        # Thread id -> store id and store id -> {content hash: file id}, least recently used first
+        self._stores: Dict[str, str] = OrderedDict()
+        self._files: Dict[str, Dict[str, str]] = {}
+        self._locks: Dict[str, asyncio.Lock] = {}
+        # Content hash -> uploaded file id, shared by every thread's store
+        self._uploads: Dict[str, str] = OrderedDict()
+        self._last_sweep: Optional[datetime] = None
+
+    def _lock(self, thread_id: str) -> asyncio.Lock:
+        if thread_id not in self._locks:
+            self._locks[thread_id] = asyncio.Lock()
+        return self._locks[thread_id]
+
+    def _remember_store(self, thread_id: str, vector_store_id: str) -> None:
+        self._stores[thread_id] = vector_store_id
+        self._stores.move_to_end(thread_id)
+        while len(self._stores) > self.cache_size:
+            evicted_thread, evicted_store = self._stores.popitem(last=False)
+            self._files.pop(evicted_store, None)
+            lock = self._locks.get(evicted_thread)
+            if lock and not lock.locked():
+                del self._locks[evicted_thread]
+
+    def _remember_upload(self, digest: str, file_id: str) -> None:
+        self._uploads[digest] = file_id
+        self._uploads.move_to_end(digest)
+        while len(self._uploads) > FILE_CACHE_SIZE:
+            self._uploads.popitem(last=False)
+
+    def _store_name(self, thread_id: str) -> str:
+        return f"{self.prefix}-{thread_id}"
+
+    async def _find_store(self, thread_id: str) -> Optional[str]:
+        # The thread remembers its store in its file_search tool resources
+        thread = await self.agents_client.threads.get(thread_id)
+        file_search = thread.tool_resources.file_search if thread.tool_resources else None
+        for vector_store_id in (file_search.vector_store_ids if file_search else None) or []:
+            vector_store = await self.agents_client.vector_stores.get(vector_store_id)
+            if vector_store.name == self._store_name(thread_id) and vector_store.status != VectorStoreStatus.EXPIRED:
+                return vector_store.id
+        return None
+
+    async def _load_file_map(self, vector_store_id: str) -> Dict[str, str]:
+        files = {}
+        async for vector_store_file in self.agents_client.vector_store_files.list(vector_store_id=vector_store_id, filter="completed"):
+            file_info = await self.agents_client.files.get(vector_store_file.id)
+            digest = os.path.splitext(file_info.filename)[0]
+            files[digest] = file_info.id
+            self._remember_upload(digest, file_info.id)
+        return files
+
+    async def get_vector_store(self, thread_id: str) -> str:
+        """Return the thread's vector store id, reusing an existing store when there is one."""
+        if thread_id in self._stores:
+            self._stores.move_to_end(thread_id)
+            return self._stores[thread_id]
+        async with self._lock(thread_id):
+            if thread_id not in self._stores:
+                vector_store_id = await self._find_store(thread_id)
+                if vector_store_id:
+                    self._files[vector_store_id] = await self._load_file_map(vector_store_id)
+                else:
+                    vector_store = await self.agents_client.vector_stores.create(
+                        name=self._store_name(thread_id),
+                        expires_after=VectorStoreExpirationPolicy(
+                            anchor=VectorStoreExpirationPolicyAnchor.LAST_ACTIVE_AT,
+                            days=self.expires_after_days,
+                        ),
+                        metadata={"thread_id": thread_id},
+                    )
+                    vector_store_id = vector_store.id
+                    self._files[vector_store_id] = {}
+                    print(f"Created vector store {vector_store_id} for thread {thread_id}")
+                self._remember_store(thread_id, vector_store_id)
+            return self._stores[thread_id]
+
+    async def add_files(self, thread_id: str, paths: List[str]) -> List[str]:
+        """Add documents to the thread's vector store, skipping content that is already indexed.
+
+        Content another thread already uploaded is added to this store without uploading
+        it again. Returns the file ids (new or existing) in the same order as `paths`.
+        """
+        vector_store_id = await self.get_vector_store(thread_id)
+        known = self._files[vector_store_id]
+        digests = await asyncio.gather(*[asyncio.to_thread(file_digest, path) for path in paths])
+
+        added = {}
+        uploaded = 0
+        for path, digest in zip(paths, digests):
+            if digest in known or digest in added:
+                continue
+            if digest in self._uploads:
+                self._uploads.move_to_end(digest)
+                added[digest] = self._uploads[digest]
+                continue
+            filename = f"{digest}{os.path.splitext(path)[1]}"
+            uploaded_file, streamed_digest = await upload_streaming(
+                lambda reader: self.agents_client.files.upload(file=reader, purpose=FilePurpose.AGENTS, filename=filename),
+                path,
+            )
+            if streamed_digest != digest:
+                raise RuntimeError(f"{path} changed while it was being uploaded")
+            added[digest] = uploaded_file.id
+            self._remember_upload(digest, uploaded_file.id)
+            uploaded += 1
+
+        if added:
+            file_ids = list(added.values())
+            for start in range(0, len(file_ids), BATCH_SIZE):
+                await self._add_batch(vector_store_id, file_ids[start:start + BATCH_SIZE])
+            known.update(added)
+        print(f"Vector store {vector_store_id}: {uploaded} uploaded, {len(added) - uploaded} shared, {len(paths) - len(added)} already indexed")
+        return [known[digest] for digest in digests]
+
+    async def attach(self, thread_id: str) -> None:
+        """Point the thread's file_search tool at its vector store."""
+        vector_store_id = await self.get_vector_store(thread_id)
+        await self.agents_client.threads.update(
+            thread_id=thread_id,
+            tool_resources=ToolResources(file_search=FileSearchToolResource(vector_store_ids=[vector_store_id])),
+        )
+
+    async def _add_batch(self, vector_store_id: str, file_ids: List[str]) -> None:
+        batch = await self.agents_client.vector_store_file_batches.create(
+            vector_store_id=vector_store_id, file_ids=file_ids
+        )
+        # Poll without blocking the event loop, backing off while the batch is embedding
+        interval = BATCH_POLL_INTERVAL
+        while batch.status == VectorStoreFileBatchStatus.IN_PROGRESS:
+            await asyncio.sleep(interval)
+            interval = min(interval * 2, BATCH_POLL_MAX_INTERVAL)
+            batch = await self.agents_client.vector_store_file_batches.get(
+                vector_store_id=vector_store_id, batch_id=batch.id
+            )
+        if batch.status != VectorStoreFileBatchStatus.COMPLETED:
+            raise RuntimeError(f"Vector store file batch {batch.id} finished with status {batch.status}")
+
+    async def expire_unused(self, max_idle_days: Optional[int] = None) -> List[str]:
+        """Delete this app's vector stores that have been idle longer than `max_idle_days`.
+
+        Their files are deleted too, except those another, still active store shares.
+        """
+        max_idle_days = self.expires_after_days if max_idle_days is None else max_idle_days
+        cutoff = datetime.now(timezone.utc) - timedelta(days=max_idle_days)
+        expired, active = [], []
+        async for vector_store in self.agents_client.vector_stores.list():
+            if not (vector_store.name or "").startswith(f"{self.prefix}-"):
+                continue
+            last_active_at = vector_store.last_active_at or vector_store.created_at
+            if vector_store.status == VectorStoreStatus.EXPIRED or (last_active_at and last_active_at < cutoff):
+                expired.append(vector_store.id)
+            else:
+                active.append(vector_store.id)
+        shared = set()
+        if expired:
+            for vector_store_id in active:
+                async for vector_store_file in self.agents_client.vector_store_files.list(vector_store_id=vector_store_id):
+                    shared.add(vector_store_file.id)
+        deleted = []
+        for vector_store_id in expired:
+            await self._delete_files(vector_store_id, keep=shared)
+            await self.agents_client.vector_stores.delete(vector_store_id)
+            deleted.append(vector_store_id)
+        for thread_id, vector_store_id in list(self._stores.items()):
+            if vector_store_id in deleted:
+                del self._stores[thread_id]
+                self._files.pop(vector_store_id, None)
+        return deleted
+
+    async def _delete_files(self, vector_store_id: str, keep: Set[str]) -> None:
+        # Deleting a store keeps its files, they would count against the project's storage forever
+        file_ids = set(self._files.get(vector_store_id, {}).values())
+        async for vector_store_file in self.agents_client.vector_store_files.list(vector_store_id=vector_store_id):
+            file_ids.add(vector_store_file.id)
+        file_ids -= keep
+        for digest, file_id in list(self._uploads.items()):
+            if file_id in file_ids:
+                del self._uploads[digest]
+        for file_id in file_ids:
+            try:
+                await self.agents_client.files.delete(file_id)
+            except ResourceNotFoundError:
+                pass
+
+    def schedule_expiry_sweep(self) -> None:
+        """Run expire_unused in the background, at most once per EXPIRY_SWEEP_INTERVAL."""
+        now = datetime.now(timezone.utc)
+        if self._last_sweep and now - self._last_sweep < EXPIRY_SWEEP_INTERVAL:
+            return
+        self._last_sweep = now
+        task = asyncio.create_task(self.expire_unused())
+        task.add_done_callback(lambda done: done.exception() and print(f"Vector store expiry sweep failed: {done.exception()}"))
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# The app modules are flat files in src/, imported the way the apps import each other
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
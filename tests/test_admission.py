@@ -0,0 +1,43 @@
+import asyncio
+
+import pytest
+
+from admission import Gate
+
+
+def test_failed_on_wait_gives_up_the_place_in_line():
+    gate = Gate("runs", capacity=1)
+
+    async def failing_notifier(position):
+        raise ConnectionError("websocket closed")
+
+    async def scenario():
+        await gate.acquire()
+        with pytest.raises(ConnectionError):
+            await gate.acquire(on_wait=failing_notifier)
+        gate.release()
+        # The failed waiter must not hold on to the freed unit
+        return gate.try_acquire()
+
+    assert asyncio.run(scenario())
+    assert gate.waiting == 0
+
+
+def test_cancelled_during_on_wait_gives_up_the_place_in_line():
+    gate = Gate("runs", capacity=1)
+
+    async def slow_notifier(position):
+        await asyncio.sleep(10)
+
+    async def scenario():
+        await gate.acquire()
+        waiter = asyncio.create_task(gate.acquire(on_wait=slow_notifier))
+        await asyncio.sleep(0.01)
+        waiter.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiter
+        gate.release()
+        return gate.try_acquire()
+
+    assert asyncio.run(scenario())
+    assert gate.in_use == 1
@@ -0,0 +1,136 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+from azure.core.exceptions import ResourceNotFoundError
+from azure.search.documents.indexes.models import SearchIndex, SimpleField, SearchFieldDataType
+
+from blob_ingestion import BlobIngestionWorker, ensure_index, build_docs_index, VECTOR_FIELD
+
+
+class FakeDownloader:
+    def __init__(self, data):
+        self.data = data
+
+    async def readall(self):
+        return self.data
+
+
+class FakeContainer:
+    url = "http://blobs/docs"
+    container_name = "docs"
+
+    def __init__(self, blobs):
+        # name -> (etag, text)
+        self.blobs = blobs
+
+    async def list_blobs(self):
+        for name, (etag, text) in self.blobs.items():
+            yield SimpleNamespace(name=name, etag=etag, size=len(text), last_modified=None)
+
+    async def download_blob(self, name, etag=None, match_condition=None):
+        return FakeDownloader(self.blobs[name][1].encode())
+
+
+class FakeSearch:
+    def __init__(self, failures=0):
+        self.failures = failures
+        self.documents = {}
+
+    async def _fail(self):
+        if self.failures:
+            self.failures -= 1
+            raise ConnectionError("search service unavailable")
+
+    async def merge_or_upload_documents(self, documents):
+        await self._fail()
+        self.documents.update((document["id"], document) for document in documents)
+
+    async def delete_documents(self, documents):
+        await self._fail()
+        for document in documents:
+            self.documents.pop(document["id"], None)
+
+
+def _worker(tmp_path, container, search):
+    return BlobIngestionWorker(container, search, cursor_path=str(tmp_path / "cursor.json"))
+
+
+def test_failed_write_keeps_documents_and_old_etag(tmp_path):
+    container = FakeContainer({"guide.md": ("v1", "# Setup\nPlug it in.")})
+    search = FakeSearch(failures=1)
+
+    async def scenario():
+        worker = _worker(tmp_path, container, search)
+        with pytest.raises(ConnectionError):
+            await worker.sync_once()
+        failed_cursor = dict(worker.cursor.blobs)
+        # A fresh worker reads the saved cursor, as after a restart
+        worker = _worker(tmp_path, container, search)
+        stats = await worker.sync_once()
+        return failed_cursor, stats, worker.cursor.blobs
+
+    failed_cursor, stats, cursor = asyncio.run(scenario())
+    assert failed_cursor == {}
+    assert stats["changed"] == 1
+    assert cursor["guide.md"]["etag"] == "v1"
+    assert sorted(search.documents) == cursor["guide.md"]["chunks"]
+
+
+def test_failed_delete_keeps_the_blob_in_the_cursor(tmp_path):
+    container = FakeContainer({"guide.md": ("v1", "# Setup\nPlug it in.")})
+    search = FakeSearch()
+
+    async def scenario():
+        worker = _worker(tmp_path, container, search)
+        await worker.sync_once()
+        del container.blobs["guide.md"]
+        search.failures = 1
+        with pytest.raises(ConnectionError):
+            await worker.sync_once()
+        kept = "guide.md" in worker.cursor.blobs
+        await worker.sync_once()
+        return kept, worker.cursor.blobs
+
+    kept, cursor = asyncio.run(scenario())
+    assert kept
+    assert cursor == {}
+    assert search.documents == {}
+
+
+class FakeIndexClient:
+    def __init__(self, index=None):
+        self.index = index
+
+    async def get_index(self, name):
+        if self.index is None:
+            raise ResourceNotFoundError("no such index")
+        return self.index
+
+    async def create_index(self, index):
+        self.index = index
+
+    async def create_or_update_index(self, index):
+        self.index = index
+
+
+def test_ensure_index_adds_missing_fields():
+    index = SearchIndex(name="docs", fields=[
+        SimpleField(name="id", type=SearchFieldDataType.String, key=True),
+        SimpleField(name="content", type=SearchFieldDataType.String),
+    ])
+    client = FakeIndexClient(index)
+    asyncio.run(ensure_index(client, "docs"))
+    names = {field.name for field in client.index.fields}
+    assert names == {field.name for field in build_docs_index("docs").fields}
+    assert VECTOR_FIELD in names
+    assert client.index.vector_search.profiles
+
+
+def test_ensure_index_rejects_an_indexer_built_index():
+    index = SearchIndex(name="azureblob-index", fields=[
+        SimpleField(name="metadata_storage_path", type=SearchFieldDataType.String, key=True),
+        SimpleField(name="content", type=SearchFieldDataType.String),
+    ])
+    with pytest.raises(ValueError, match="BLOB_INGESTION_INDEX"):
+        asyncio.run(ensure_index(FakeIndexClient(index), "azureblob-index"))
@@ -0,0 +1,114 @@
+import asyncio
+from types import SimpleNamespace
+
+from azure.ai.agents.models import (
+    MessageTextFileCitationAnnotation,
+    MessageTextFileCitationDetails,
+    MessageTextUrlCitationAnnotation,
+    MessageTextUrlCitationDetails,
+)
+
+from citations import CitationResolver, DocMetadata, MetadataCache, search_in_filter, sources_markdown
+
+
+async def _iterate(items):
+    for item in items:
+        yield item
+
+
+class FakeSearch:
+    def __init__(self, documents):
+        self.documents = documents
+        self.filters = []
+
+    async def search(self, search_text, filter, select, top):
+        self.filters.append(filter)
+        return _iterate(self.documents)
+
+
+def _url_citation(marker, url, title=None):
+    return MessageTextUrlCitationAnnotation(text=marker, url_citation=MessageTextUrlCitationDetails(url=url, title=title), start_index=0, end_index=len(marker))
+
+
+def _file_citation(marker, file_id, quote=None):
+    return MessageTextFileCitationAnnotation(text=marker, file_citation=MessageTextFileCitationDetails(file_id=file_id, quote=quote), start_index=0, end_index=len(marker))
+
+
+def _message(text, annotations):
+    return SimpleNamespace(text_messages=[SimpleNamespace(text=SimpleNamespace(value=text, annotations=annotations))])
+
+
+def _agents(filenames):
+    async def get(file_id):
+        return SimpleNamespace(id=file_id, filename=filenames[file_id])
+    return SimpleNamespace(files=SimpleNamespace(get=get))
+
+
+def test_chunks_of_one_document_share_a_number():
+    search = FakeSearch([{"id": "doc_a", "title": "Datasheet", "url": "https://example.com/a.pdf"}])
+    resolver = CitationResolver(_agents({"file_1": "notes.md"}), search)
+    message = _message(
+        "Ports【1:0†source】 and power【1:1†source】, see notes【2:0†source】 and【1:0†source】.",
+        [
+            _url_citation("【1:0†source】", "doc_a"),
+            _url_citation("【1:1†source】", "doc_a"),
+            _file_citation("【2:0†source】", "file_1", quote="quoted"),
+            _url_citation("【1:0†source】", "doc_a"),
+        ],
+    )
+
+    text, citations = asyncio.run(resolver.resolve(message))
+    assert text == "Ports [1] and power [1], see notes [2] and [1]."
+    assert [(citation.number, citation.title, citation.url) for citation in citations] == [
+        (1, "Datasheet", "https://example.com/a.pdf"),
+        (2, "notes.md", None),
+    ]
+    assert citations[0].markers == ["【1:0†source】", "【1:1†source】"]
+    assert citations[1].quote == "quoted"
+    # Both chunks were resolved in one query
+    assert len(search.filters) == 1
+    assert sources_markdown(citations) == (
+        "\n\n**Sources**\n\nSource 1: [Datasheet](https://example.com/a.pdf)\n\nSource 2: notes.md"
+    )
+
+
+def test_links_are_cited_without_a_lookup():
+    search = FakeSearch([])
+    resolver = CitationResolver(_agents({}), search)
+    message = _message("See【1†source】.", [_url_citation("【1†source】", "https://example.com/docs/guide/")])
+
+    text, citations = asyncio.run(resolver.resolve(message))
+    assert text == "See [1]."
+    assert citations[0].title == "guide"
+    assert search.filters == []
+
+
+def test_search_in_filter_quotes_keys():
+    assert search_in_filter("id", ["a", "o'brien"]) == "search.in(id, 'a|o''brien', '|')"
+
+
+def test_cached_metadata_expires(monkeypatch):
+    clock = [1000.0]
+    monkeypatch.setattr("citations.time.monotonic", lambda: clock[0])
+    cache = MetadataCache(ttl=60, max_entries=2)
+    cache.put("doc:a", DocMetadata(id="a", title="A"))
+    clock[0] += 59
+    assert cache.get("doc:a").title == "A"
+    clock[0] += 2
+    assert cache.get("doc:a") is None
+    assert (cache.hits, cache.misses) == (1, 1)
+
+    for key in ("doc:b", "doc:c", "doc:d"):
+        cache.put(key, DocMetadata(id=key, title=key))
+    assert list(cache._entries) == ["doc:c", "doc:d"]
+
+
+def test_resolved_documents_are_not_fetched_again():
+    search = FakeSearch([{"id": "doc_a", "title": "Datasheet", "url": None}])
+    resolver = CitationResolver(_agents({}), search)
+    message = _message("Ports【1†source】.", [_url_citation("【1†source】", "doc_a")])
+
+    asyncio.run(resolver.resolve(message))
+    _, citations = asyncio.run(resolver.resolve(message))
+    assert citations[0].title == "Datasheet"
+    assert len(search.filters) == 1
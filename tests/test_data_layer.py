@@ -0,0 +1,100 @@
+import asyncio
+from contextlib import asynccontextmanager
+
+from chainlit.context import init_http_context
+
+import data_layer
+from data_layer import PooledDataLayer, UPSERT_STEP
+
+
+class FakeConnection:
+    def __init__(self, pool):
+        self.pool = pool
+
+    @asynccontextmanager
+    async def transaction(self):
+        yield
+
+    async def executemany(self, query, args):
+        await asyncio.sleep(self.pool.write_seconds)
+        if self.pool.failures:
+            self.pool.failures -= 1
+            raise ConnectionError("connection lost")
+        if query == UPSERT_STEP:
+            self.pool.written.extend(row[0] for row in args)
+
+
+class FakePool:
+    def __init__(self, write_seconds=0.0, failures=0):
+        self.write_seconds = write_seconds
+        self.failures = failures
+        self.written = []
+
+    @asynccontextmanager
+    async def acquire(self):
+        yield FakeConnection(self)
+
+
+def _layer(pool):
+    layer = PooledDataLayer("postgresql://unused")
+    layer.pool = pool
+    return layer
+
+
+def _step(step_id):
+    return {"id": step_id, "threadId": "thread-1", "type": "assistant_message", "output": step_id, "metadata": {}}
+
+
+def test_step_added_while_a_batch_is_written_is_flushed(monkeypatch):
+    monkeypatch.setattr(data_layer, "DATA_LAYER_FLUSH_MS", 10)
+
+    async def scenario():
+        init_http_context()
+        pool = FakePool(write_seconds=0.05)
+        layer = _layer(pool)
+        await layer.create_step(_step("s1"))
+        await asyncio.sleep(0.03)  # s1's batch is being written
+        await layer.update_step(_step("s2"))
+        await asyncio.sleep(0.3)
+        return pool.written, layer._pending
+
+    written, pending = asyncio.run(scenario())
+    assert written == ["s1", "s2"]
+    assert pending == []
+
+
+def test_failed_batch_is_retried_not_dropped(monkeypatch):
+    monkeypatch.setattr(data_layer, "DATA_LAYER_FLUSH_MS", 10)
+
+    async def scenario():
+        init_http_context()
+        pool = FakePool(failures=2)
+        layer = _layer(pool)
+        await layer.create_step(_step("s1"))
+        await layer.create_step(_step("s2"))
+        await asyncio.sleep(0.5)
+        return pool.written, layer._pending
+
+    written, pending = asyncio.run(scenario())
+    assert written == ["s1", "s2"]
+    assert pending == []
+
+
+def test_failed_explicit_flush_keeps_the_batch_in_order(monkeypatch):
+    monkeypatch.setattr(data_layer, "DATA_LAYER_FLUSH_MS", 10_000)
+
+    async def scenario():
+        init_http_context()
+        pool = FakePool(failures=1)
+        layer = _layer(pool)
+        await layer.create_step(_step("s1"))
+        try:
+            await layer.flush()
+        except ConnectionError:
+            pass
+        await layer.create_step(_step("s2"))
+        await layer.flush()
+        layer._flush_task.cancel()
+        return pool.written
+
+    assert asyncio.run(scenario()) == ["s1", "s2"]
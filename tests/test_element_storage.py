@@ -0,0 +1,32 @@
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+import chainlit as cl
+from chainlit.auth import create_jwt
+
+from element_storage import ElementStorage, AZURITE_CONNECTION_STRING, ELEMENT_ROUTE, content_key, mount_element_route
+
+KEY = content_key(b"chart", "chart.png")
+
+
+def _client():
+    app = FastAPI()
+    mount_element_route(app, ElementStorage(AZURITE_CONNECTION_STRING))
+    return TestClient(app, follow_redirects=False)
+
+
+def test_blob_links_need_a_logged_in_user(monkeypatch):
+    monkeypatch.setenv("CHAINLIT_CUSTOM_AUTH", "true")
+    monkeypatch.setenv("CHAINLIT_AUTH_SECRET", "test-secret-that-is-long-enough-for-hs256")
+    client = _client()
+    assert client.get(f"{ELEMENT_ROUTE}/{KEY}").status_code == 401
+
+    client.cookies.set("access_token", create_jwt(cl.User(identifier="ada")))
+    response = client.get(f"{ELEMENT_ROUTE}/{KEY}")
+    assert response.status_code == 307
+    assert "sig=" in response.headers["location"]
+
+
+def test_only_element_keys_are_signed(monkeypatch):
+    monkeypatch.delenv("CHAINLIT_CUSTOM_AUTH", raising=False)
+    assert _client().get(f"{ELEMENT_ROUTE}/private/secrets.txt").status_code == 404
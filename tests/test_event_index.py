@@ -0,0 +1,99 @@
+import time
+
+import pytest
+
+from event_index import chunk_events, extract_metadata, multi_query_search, reciprocal_rank_fusion
+
+EVENTS = """# Python Agents Hackathon
+Date: 2025-03-12
+Location: Seattle, WA
+
+Build agents with Semantic Kernel and Azure OpenAI.
+
+## Prizes
+Winners get a GitHub Copilot license.
+
+---
+
+# Rust Meetup
+Where: **Berlin**
+Dec 4, 2025. Talks about Rust and WebAssembly.
+"""
+
+
+def test_chunks_follow_events_and_headings_and_inherit_metadata():
+    chunks = chunk_events(EVENTS)
+    assert [chunk.title for chunk in chunks] == ["Python Agents Hackathon", "Prizes", "Rust Meetup"]
+    hackathon, prizes, meetup = chunks
+    assert hackathon.parent_id == prizes.parent_id != meetup.parent_id
+    # The prizes section has no date or location of its own, it gets the event's
+    assert (prizes.date, prizes.location) == ("2025-03-12", "Seattle, WA")
+    assert "Copilot" in prizes.tags and "Python" in prizes.tags
+    assert (meetup.date, meetup.location, meetup.tags) == ("Dec 4, 2025", "Berlin", ["Rust"])
+    # Ids are content hashes, so re-chunking the same file gives the same ids
+    assert [chunk.id for chunk in chunk_events(EVENTS)] == [chunk.id for chunk in chunks]
+
+
+def test_long_sections_are_split_into_overlapping_windows():
+    # The heading line counts too: 26 words in windows of 10 that step by 8
+    body = " ".join(f"w{index}" for index in range(24))
+    chunks = chunk_events(f"# Long\n{body}", max_tokens=10, overlap=2)
+    assert len(chunks) == 3
+    first, second = chunks[0].content.split(), chunks[1].content.split()
+    assert first[-2:] == second[:2]
+    assert chunks[-1].content.split()[-1] == "w23"
+
+
+def test_tags_match_whole_names_only():
+    assert extract_metadata("Intro to Java and .NET")["tags"] == [".NET", "Java"]
+    assert extract_metadata("JavaScript for C# developers")["tags"] == ["C#", "JavaScript"]
+    assert extract_metadata("Tea and cake")["tags"] == []
+
+
+def test_fusion_rewards_documents_several_lists_agree_on():
+    first = [{"id": "a"}, {"id": "b"}, {"id": "c"}]
+    second = [{"id": "c"}, {"id": "d"}]
+    fused = reciprocal_rank_fusion([first, second], k=60)
+    assert [result["id"] for result in fused] == ["c", "a", "b", "d"]
+    assert reciprocal_rank_fusion([]) == []
+
+
+class FakeSearch:
+    def __init__(self, results, delays=None):
+        self.results = results
+        self.delays = delays or {}
+        self.vectors = {}
+
+    def search(self, search_text, vector_queries, select, filter, top):
+        # Later queries finish first, the fused order must not depend on it
+        time.sleep(self.delays.get(search_text, 0))
+        self.vectors[search_text] = vector_queries[0].vector if vector_queries else None
+        if search_text not in self.results:
+            raise ConnectionError("search unavailable")
+        return [{"id": doc_id} for doc_id in self.results[search_text][:top]]
+
+
+def test_multi_query_search_fuses_in_query_order():
+    search = FakeSearch(
+        {"rust": ["a", "b", "c"], "webassembly": ["c", "d"], "berlin": ["d", "c", "e"]},
+        delays={"rust": 0.05, "webassembly": 0.02},
+    )
+    embedded = []
+
+    def embed(texts):
+        embedded.append(texts)
+        return [[float(index)] for index in range(len(texts))]
+
+    results = multi_query_search(search, ["rust", " webassembly ", "rust", "", "berlin"], embed=embed, limit=4)
+    assert [result["id"] for result in results] == ["c", "d", "a", "b"]
+    # Duplicates and blanks are dropped and every query is embedded in one request
+    assert embedded == [["rust", "webassembly", "berlin"]]
+    assert search.vectors == {"rust": [0.0], "webassembly": [1.0], "berlin": [2.0]}
+
+
+def test_multi_query_search_survives_a_failed_query():
+    search = FakeSearch({"rust": ["a", "b"]})
+    assert [result["id"] for result in multi_query_search(search, ["rust", "flaky"])] == ["a", "b"]
+    with pytest.raises(ConnectionError):
+        multi_query_search(search, ["flaky"])
+    assert multi_query_search(search, [" ", ""]) == []
@@ -0,0 +1,39 @@
+import json
+
+import numpy as np
+
+from figure_downsampling import downsample_trace, reduce_figure
+
+
+def test_implicit_x_keeps_point_positions():
+    y = np.sin(np.linspace(0, 20, 10000))
+    trace = {"type": "scatter", "mode": "lines", "y": y.tolist(), "x0": 100, "dx": 0.5}
+    assert downsample_trace(trace, max_points=500)
+    assert "x0" not in trace and "dx" not in trace
+    for x, value in zip(trace["x"], trace["y"]):
+        index = round((x - 100) / 0.5)
+        assert value == y[index]
+
+
+def test_implicit_date_x():
+    trace = {"type": "scatter", "mode": "markers", "y": list(range(10000)), "x0": "2024-01-01", "dx": 60000}
+    assert downsample_trace(trace, max_points=100)
+    assert trace["x"][0].startswith("2024-01-01T00:00")
+    last = np.datetime64(trace["x"][-1])
+    assert last == np.datetime64("2024-01-01T00:00") + np.timedelta64(9999, "m")
+
+
+def test_categorical_y_is_left_alone():
+    y = [f"step {i % 7}" for i in range(10000)]
+    trace = {"type": "scatter", "mode": "markers", "x": list(range(10000)), "y": y}
+    assert not downsample_trace(trace, max_points=100)
+    assert trace["y"] == y
+
+
+def test_figure_with_categorical_trace_still_renders():
+    figure = {"data": [
+        {"type": "scatter", "y": [str(i % 3) for i in range(6000)]},
+        {"type": "scatter", "y": [float(i) for i in range(6000)]},
+    ], "layout": {}}
+    _, report = reduce_figure("file-categorical", json.dumps(figure), max_points=1000)
+    assert report["traces_reduced"] == 1
@@ -0,0 +1,75 @@
+from types import SimpleNamespace
+
+from semantic_kernel import Kernel
+from semantic_kernel.functions import kernel_function
+
+from prompt_cache import PromptCacheStats, order_tools, prefix_fingerprint, stable_text
+
+
+class Events:
+    @kernel_function(name="search", description="Search events")
+    def search(self, query: str) -> str:
+        return query
+
+    @kernel_function(name="list", description="List events")
+    def list(self) -> str:
+        return ""
+
+
+class Repos:
+    @kernel_function(name="get", description="Get a repository")
+    def get(self, name: str) -> str:
+        return name
+
+
+def _kernel(plugins):
+    kernel = Kernel()
+    for name, plugin in plugins:
+        kernel.add_plugin(plugin, name)
+    return kernel
+
+
+def test_static_blocks_are_byte_identical():
+    windows = "\r\n    You are an agent.  \r\n    Be brief.\r\n"
+    unix = "You are an agent.\nBe brief."
+    assert stable_text(windows) == stable_text(unix) == "You are an agent.\nBe brief.\n"
+
+
+def test_tool_order_does_not_change_the_fingerprint():
+    first = _kernel([("Events", Events()), ("Repos", Repos())])
+    second = _kernel([("Repos", Repos()), ("Events", Events())])
+    second.plugins["Events"].functions = dict(reversed(list(second.plugins["Events"].functions.items())))
+    assert prefix_fingerprint("x", first) != prefix_fingerprint("x", second)
+
+    order_tools(first)
+    order_tools(second)
+    assert list(second.plugins) == ["Events", "Repos"]
+    assert list(second.plugins["Events"].functions) == ["list", "search"]
+    assert prefix_fingerprint("x", first) == prefix_fingerprint("x", second)
+    assert prefix_fingerprint("y", first) != prefix_fingerprint("x", first)
+
+
+def _content(prompt_tokens, cached_tokens, completion_tokens=10):
+    usage = SimpleNamespace(
+        prompt_tokens=prompt_tokens,
+        completion_tokens=completion_tokens,
+        prompt_tokens_details=SimpleNamespace(cached_tokens=cached_tokens),
+    )
+    return SimpleNamespace(inner_content=SimpleNamespace(usage=usage))
+
+
+def test_cached_tokens_are_summed_per_agent():
+    stats = PromptCacheStats()
+    assert stats.record("EventsAgent", _content(2000, 0))
+    assert stats.record("EventsAgent", _content(2000, 1536))
+    # Streaming chunks without usage aren't counted
+    assert not stats.record("EventsAgent", SimpleNamespace(inner_content=SimpleNamespace(usage=None)))
+    assert stats.summary() == {
+        "EventsAgent": {
+            "requests": 2,
+            "prompt_tokens": 4000,
+            "cached_tokens": 1536,
+            "uncached_tokens": 2464,
+            "hit_ratio": 0.384,
+        }
+    }
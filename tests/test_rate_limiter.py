@@ -0,0 +1,129 @@
+import time
+import socket
+import asyncio
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import httpx
+import pytest
+from azure.core import PipelineClient
+from azure.core.exceptions import ServiceResponseError
+from azure.core.rest import HttpRequest
+
+from rate_limiter import (
+    AGENT_RUN_TOKENS, RateLimiter, RateLimitedRetryPolicy, RateLimitedTransport, estimate_tokens, is_inference_request,
+)
+
+
+class _UnavailableHandler(BaseHTTPRequestHandler):
+    hits = 0
+
+    def do_GET(self):
+        type(self).hits += 1
+        self.send_response(503)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+
+def _drained(**kwargs):
+    limiter = RateLimiter("test", rpm=60, **kwargs)
+    limiter.requests.tokens = 0
+    return limiter
+
+
+def test_acquire_sync_never_sleeps_on_the_event_loop():
+    limiter = _drained()
+
+    async def scenario():
+        start = time.monotonic()
+        limiter.acquire_sync()
+        return time.monotonic() - start
+
+    assert asyncio.run(scenario()) < 0.1
+    # The request was charged, async callers wait it off
+    assert limiter.requests.tokens < 0
+    assert limiter._reserve(1, 0) > 1
+
+
+def test_acquire_sync_waits_off_the_loop():
+    limiter = _drained()
+    limiter.requests.tokens = 0.9
+    start = time.monotonic()
+    limiter.acquire_sync()
+    assert time.monotonic() - start >= 0.05
+
+
+def test_only_inference_requests_are_limited():
+    assert is_inference_request("POST", "https://ai/api/projects/p/threads/thread_1/runs?api-version=v1")
+    assert is_inference_request("POST", "https://ai/threads/thread_1/runs/run_1/submit_tool_outputs")
+    assert is_inference_request("POST", "https://ai/openai/deployments/gpt/chat/completions")
+    assert not is_inference_request("GET", "https://ai/threads/thread_1/runs/run_1")
+    assert not is_inference_request("GET", "https://ai/threads/thread_1/runs/run_1/steps")
+    assert not is_inference_request("POST", "https://ai/threads/thread_1/messages")
+
+
+def test_control_plane_calls_skip_the_bucket(monkeypatch):
+    limiter = _drained(applies_to=is_inference_request)
+    sent = []
+    monkeypatch.setattr(httpx.HTTPTransport, "handle_request", lambda self, request: sent.append(request) or httpx.Response(200))
+    transport = RateLimitedTransport(limiter)
+    start = time.monotonic()
+    for _ in range(5):
+        transport.handle_request(httpx.Request("GET", "https://ai/threads/thread_1/runs/run_1"))
+    assert time.monotonic() - start < 0.1
+    assert len(sent) == 5
+    assert limiter.requests.tokens == 0
+
+
+def _send(endpoint):
+    client = PipelineClient(endpoint, policies=[RateLimitedRetryPolicy(RateLimiter("test", rpm=600))])
+    return client.send_request(HttpRequest("GET", f"{endpoint}/indexes"))
+
+
+def test_sync_policy_does_not_retry_on_the_event_loop():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _UnavailableHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    async def scenario():
+        return _send(f"http://127.0.0.1:{server.server_port}").status_code
+
+    try:
+        assert asyncio.run(scenario()) == 503
+        assert _UnavailableHandler.hits == 1
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def test_sync_policy_raises_connection_errors_on_the_event_loop():
+    listener = socket.create_server(("127.0.0.1", 0))
+    accepted = []
+
+    def hang_up():
+        while True:
+            try:
+                connection, _ = listener.accept()
+            except OSError:
+                return
+            accepted.append(connection)
+            connection.close()
+
+    threading.Thread(target=hang_up, daemon=True).start()
+
+    async def scenario():
+        _send(f"http://127.0.0.1:{listener.getsockname()[1]}")
+
+    try:
+        with pytest.raises(ServiceResponseError):
+            asyncio.run(scenario())
+    finally:
+        listener.close()
+    assert len(accepted) == 1
+
+
+def test_agent_runs_are_charged_for_the_thread_not_the_body():
+    assert estimate_tokens(b'{"assistant_id": "asst_1"}', "https://ai/threads/thread_1/runs?api-version=v1") == AGENT_RUN_TOKENS
+    assert estimate_tokens(b"x" * 400, "https://ai/openai/deployments/gpt/chat/completions") == 100
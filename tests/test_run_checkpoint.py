@@ -0,0 +1,135 @@
+import asyncio
+
+import run_checkpoint
+from run_checkpoint import RunCheckpoint, RunCheckpointer, claim_orphaned_run
+
+
+class FakeStore:
+    """RunCheckpoint table of one database, with the ages its clock would report."""
+
+    def __init__(self, save_delay=0.0):
+        self.rows = {}
+        self.ages = {}
+        self.save_delay = save_delay
+
+    async def save_run_checkpoint(self, checkpoint):
+        await asyncio.sleep(self.save_delay)
+        self.rows[checkpoint["thread_id"]] = {
+            "threadId": checkpoint["thread_id"],
+            "agentThreadId": checkpoint["agent_thread_id"],
+            "runId": checkpoint["run_id"],
+            "lastEventId": checkpoint["last_event_id"],
+            "messageId": checkpoint["message_id"],
+            "messagesDone": checkpoint["messages_done"],
+            "content": checkpoint["content"],
+            "replicaId": checkpoint["replica_id"],
+        }
+        self.ages[checkpoint["thread_id"]] = 0.0
+        return True
+
+    async def get_run_checkpoint(self, thread_id):
+        row = self.rows.get(thread_id)
+        return dict(row, age=self.ages[thread_id]) if row else None
+
+    async def claim_run_checkpoint(self, thread_id, run_id, replica_id, stale_seconds):
+        row = self.rows.get(thread_id)
+        if not row or row["runId"] != run_id or self.ages[thread_id] <= stale_seconds:
+            return False
+        row["replicaId"] = replica_id
+        self.ages[thread_id] = 0.0
+        return True
+
+    async def delete_run_checkpoint(self, thread_id, run_id):
+        if self.rows.get(thread_id, {}).get("runId") == run_id:
+            del self.rows[thread_id]
+
+
+def _use_store(monkeypatch, store):
+    monkeypatch.setattr(run_checkpoint, "get_data_layer", lambda: store)
+    monkeypatch.setattr(run_checkpoint, "RUN_CHECKPOINT_INTERVAL", 0.01)
+
+
+def _checkpoint(replica_id="replica-a"):
+    return RunCheckpoint(thread_id="thread_1", agent_thread_id="agent_thread_1", run_id="run_1", content="Hel", replica_id=replica_id)
+
+
+def test_save_in_flight_does_not_outlive_finish():
+    store = FakeStore(save_delay=0.05)
+
+    async def scenario():
+        checkpointer = RunCheckpointer(store, _checkpoint())
+        save = asyncio.create_task(checkpointer.save())
+        await asyncio.sleep(0.01)
+        await checkpointer.finish()
+        await save
+        await checkpointer.save()
+
+    asyncio.run(scenario())
+    assert store.rows == {}
+
+
+def test_finish_can_keep_the_checkpoint_for_a_resume():
+    store = FakeStore()
+
+    async def scenario():
+        checkpointer = RunCheckpointer(store, _checkpoint())
+        await checkpointer.start()
+        checkpointer.update(content="Hello", messages_done=1)
+        await checkpointer.save()
+        await checkpointer.finish(delete=False)
+        await checkpointer.save()
+        return checkpointer
+
+    checkpointer = asyncio.run(scenario())
+    assert checkpointer._task is None
+    assert (store.rows["thread_1"]["content"], store.rows["thread_1"]["messagesDone"]) == ("Hello", 1)
+
+
+def test_stale_checkpoints_are_claimed(monkeypatch):
+    store = FakeStore()
+    _use_store(monkeypatch, store)
+
+    async def scenario():
+        await store.save_run_checkpoint(run_checkpoint.asdict(_checkpoint()))
+        store.ages["thread_1"] = run_checkpoint.RUN_CHECKPOINT_STALE_SECONDS + 1
+        claimed = await claim_orphaned_run("thread_1")
+        # Another replica that loaded the same stale checkpoint loses the claim
+        lost = await store.claim_run_checkpoint("thread_1", "run_1", "replica-b", run_checkpoint.RUN_CHECKPOINT_STALE_SECONDS)
+        return claimed, lost
+
+    claimed, lost = asyncio.run(scenario())
+    assert claimed.checkpoint.run_id == "run_1"
+    assert claimed.checkpoint.content == "Hel"
+    assert claimed.checkpoint.replica_id == run_checkpoint.REPLICA_ID
+    assert store.rows["thread_1"]["replicaId"] == run_checkpoint.REPLICA_ID
+    assert not lost
+
+
+def test_live_checkpoints_are_waited_out(monkeypatch):
+    store = FakeStore()
+    _use_store(monkeypatch, store)
+
+    async def owner_finishes():
+        await store.save_run_checkpoint(run_checkpoint.asdict(_checkpoint()))
+        claim = asyncio.create_task(claim_orphaned_run("thread_1"))
+        await asyncio.sleep(0.03)
+        assert not claim.done()
+        await store.delete_run_checkpoint("thread_1", "run_1")
+        return await claim
+
+    async def owner_goes_away():
+        await store.save_run_checkpoint(run_checkpoint.asdict(_checkpoint()))
+        claim = asyncio.create_task(claim_orphaned_run("thread_1"))
+        await asyncio.sleep(0.03)
+        assert not claim.done()
+        store.ages["thread_1"] = run_checkpoint.RUN_CHECKPOINT_STALE_SECONDS + 1
+        return await claim
+
+    assert asyncio.run(owner_finishes()) is None
+    assert asyncio.run(owner_goes_away()).checkpoint.run_id == "run_1"
+
+
+def test_no_checkpoint_store_means_no_resume(monkeypatch):
+    monkeypatch.setattr(run_checkpoint, "get_data_layer", lambda: None)
+    assert run_checkpoint.create_checkpointer("thread_1", "agent_thread_1", "run_1") is None
+    assert asyncio.run(run_checkpoint.load_checkpoint("thread_1")) is None
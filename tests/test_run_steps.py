@@ -0,0 +1,76 @@
+import asyncio
+from types import SimpleNamespace
+
+from azure.ai.agents.models import (
+    RunStepAzureAISearchToolCall,
+    RunStepMessageCreationDetails,
+    RunStepMessageCreationReference,
+    RunStepToolCallDetails,
+)
+
+from run_steps import RunStepWatcher, _count_documents
+
+
+async def _iterate(items):
+    for item in items:
+        yield item
+
+
+class FakeAgents:
+    def __init__(self):
+        self.steps = []
+        self.fetched = []
+        self.run_steps = SimpleNamespace(list=lambda thread_id, run_id, order: _iterate(list(self.steps)))
+        self.messages = SimpleNamespace(get=self._get_message)
+
+    async def _get_message(self, thread_id, message_id):
+        self.fetched.append(message_id)
+        return SimpleNamespace(id=message_id)
+
+
+def _search_step(status, output=None):
+    tool_call = RunStepAzureAISearchToolCall(id="call_1", azure_ai_search={"input": "ports", "output": output})
+    return SimpleNamespace(id="step_1", status=status, step_details=RunStepToolCallDetails(tool_calls=[tool_call]))
+
+
+def _message_step(status):
+    details = RunStepMessageCreationDetails(message_creation=RunStepMessageCreationReference(message_id="msg_1"))
+    return SimpleNamespace(id="step_2", status=status, step_details=details)
+
+
+def test_count_documents_parses_search_output():
+    assert _count_documents('[{"id": 1}, {"id": 2}]') == 2
+    assert _count_documents("{'documents': [{'id': 1}]}") == 1
+    assert _count_documents('{"value": []}') == 0
+    assert _count_documents('{"count": 3}') is None
+    assert _count_documents("not a literal") is None
+    assert _count_documents(None) is None
+
+
+def test_steps_are_reported_once_across_polls():
+    agents = FakeAgents()
+    tools, messages = [], []
+
+    async def on_tool(progress):
+        tools.append((progress.status, progress.query, progress.documents))
+
+    async def on_message(message):
+        messages.append(message.id)
+
+    async def scenario():
+        watcher = RunStepWatcher(agents, "thread_1", "run_1", on_tool, on_message)
+        agents.steps = [_search_step("in_progress")]
+        await watcher.poll()
+        await watcher.poll()
+        agents.steps = [_search_step("completed", output="[1, 2, 3]"), _message_step("in_progress")]
+        await watcher.poll()
+        agents.steps = [_search_step("completed", output="[1, 2, 3]"), _message_step("completed")]
+        await watcher.poll()
+        await watcher.poll()
+        return watcher
+
+    watcher = asyncio.run(scenario())
+    assert tools == [("in_progress", "ports", None), ("completed", "ports", 3)]
+    assert messages == ["msg_1"]
+    assert agents.fetched == ["msg_1"]
+    assert watcher.message_ids == ["msg_1"]
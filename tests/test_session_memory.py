@@ -0,0 +1,27 @@
+import asyncio
+
+from chainlit.user_session import user_sessions
+
+from session_memory import IdleSessionEvictor
+from session_state import InMemorySessionState
+
+
+def test_eviction_releases_objects_and_deletes_the_snapshot(monkeypatch):
+    state = InMemorySessionState()
+    released = []
+
+    async def close(objects):
+        released.append(objects)
+
+    monkeypatch.setitem(user_sessions, "ws_1", {"kernel": "kernel", "chat_history": "history", "user": "ada"})
+    evictor = IdleSessionEvictor(["kernel", "chat_history"], close=close, idle_seconds=0, session_state=state)
+
+    async def scenario():
+        await state.update("thread_1", chat_history="[]")
+        evictor.touch("ws_1", "thread_1")
+        evicted = await evictor.sweep()
+        return evicted, await state.load("thread_1")
+
+    assert asyncio.run(scenario()) == (1, None)
+    assert released == [{"kernel": "kernel", "chat_history": "history"}]
+    assert user_sessions["ws_1"] == {"user": "ada"}
@@ -0,0 +1,126 @@
+import asyncio
+
+import pytest
+
+from session_state import SessionStateBackend, InMemorySessionState, RedisSessionState
+
+
+class FakePubSub:
+    def __init__(self, client):
+        self.client = client
+        self.messages = asyncio.Queue()
+
+    async def subscribe(self, channel):
+        self.client.subscriptions += 1
+        self.client.subscribers.setdefault(channel, []).append(self)
+
+    async def unsubscribe(self, channel):
+        self.client.subscribers[channel].remove(self)
+
+    async def aclose(self):
+        pass
+
+    async def get_message(self, ignore_subscribe_messages, timeout):
+        try:
+            return await asyncio.wait_for(self.messages.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+
+class FakeRedis:
+    def __init__(self):
+        self.keys = {}
+        self.subscribers = {}
+        self.subscriptions = 0
+
+    def pubsub(self):
+        return FakePubSub(self)
+
+    async def set(self, key, value, ex=None):
+        self.keys[key] = value
+
+    async def exists(self, key):
+        return int(key in self.keys)
+
+    async def delete(self, key):
+        self.keys.pop(key, None)
+
+    async def publish(self, channel, message):
+        for pubsub in self.subscribers.get(channel, []):
+            pubsub.messages.put_nowait({"data": message})
+
+
+def _redis_backend():
+    # The redis package isn't needed to exercise the backend against a fake client
+    backend = RedisSessionState.__new__(RedisSessionState)
+    backend.client = FakeRedis()
+    backend.ttl = 60
+    return backend
+
+
+def test_backends_must_implement_the_interface():
+    class Partial(SessionStateBackend):
+        async def load(self, session_key):
+            return None
+
+    with pytest.raises(TypeError):
+        Partial()
+
+
+def test_redis_watch_keeps_one_subscription_per_run():
+    backend = _redis_backend()
+
+    async def scenario():
+        async with backend.watch_cancel("run_1") as wait_for_cancel:
+            polls = [await wait_for_cancel(0.01) for _ in range(5)]
+            await backend.request_cancel("run_1")
+            polls.append(await wait_for_cancel(1))
+        return polls
+
+    assert asyncio.run(scenario()) == [False] * 5 + [True]
+    assert backend.client.subscriptions == 1
+    assert backend.client.subscribers["chainlit:cancel:run_1"] == []
+
+
+def test_cancel_sent_before_the_watch_is_seen():
+    for backend in (_redis_backend(), InMemorySessionState()):
+        async def scenario():
+            await backend.request_cancel("run_1")
+            async with backend.watch_cancel("run_1") as wait_for_cancel:
+                return await wait_for_cancel(0.01)
+
+        assert asyncio.run(scenario())
+
+
+def test_in_memory_snapshots_expire_and_are_swept(monkeypatch):
+    clock = [1000.0]
+    monkeypatch.setattr("session_state.time.monotonic", lambda: clock[0])
+    backend = InMemorySessionState(ttl=60)
+
+    async def scenario():
+        await backend.update("idle", chat_history="[]")
+        await backend.update("deleted", chat_history="[]")
+        await backend.delete("deleted")
+        clock[0] += 61
+        expired = await backend.load("idle")
+        await backend.update("active")
+        return expired
+
+    assert asyncio.run(scenario()) is None
+    assert list(backend._snapshots) == ["active"]
+
+
+def test_in_memory_cancel_events_do_not_accumulate():
+    backend = InMemorySessionState()
+
+    async def scenario():
+        for run in range(100):
+            async with backend.watch_cancel(f"run_{run}") as wait_for_cancel:
+                await wait_for_cancel(0)
+        await backend.request_cancel("run_cancelled")
+        cancelled = await backend.wait_for_cancel("run_cancelled", 0)
+        await backend.clear_cancel("run_cancelled")
+        return cancelled
+
+    assert asyncio.run(scenario())
+    assert backend._cancels == {} and backend._waiters == {} and backend._cancel_expires == {}
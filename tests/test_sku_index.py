@@ -0,0 +1,26 @@
+from sku_index import SkuIndex
+
+
+def test_plain_numbers_are_not_part_numbers(tmp_path):
+    (tmp_path / "stock.csv").write_text("sku,year,qty\nDPR-F140,2024,12\n2024,2023,1\n")
+    index = SkuIndex()
+    index.load_dir(str(tmp_path))
+    assert len(index) == 1
+    assert [match.row for match in index.find("Do you have dpr-f140 in stock for 2024?")] == [("DPR-F140", "2024", "12")]
+
+
+def test_missing_directory_leaves_the_index_empty(tmp_path):
+    index = SkuIndex()
+    assert index.load_dir(str(tmp_path / "missing")) == 0
+    assert index.context_for("DPR-F140") is None
+
+
+def test_comparisons_over_the_cap_are_left_to_search(tmp_path):
+    rows = "\n".join(f"DPR-F{number},{number}" for number in range(100, 108))
+    (tmp_path / "stock.csv").write_text(f"sku,qty\n{rows}\n")
+    index = SkuIndex()
+    index.load_dir(str(tmp_path))
+    parts = [f"DPR-F{number}" for number in range(100, 108)]
+    assert len(index.find(" vs ".join(parts))) == 8
+    assert index.context_for(" vs ".join(parts), max_matches=5) is None
+    assert "DPR-F100" in index.context_for(" vs ".join(parts[:5]), max_matches=5)
@@ -0,0 +1,84 @@
+import hashlib
+import json
+import threading
+import tracemalloc
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+from azure.core import PipelineClient
+
+from streaming_upload import ChunkedFileReader, upload_agent_file, upload_streaming_sync
+
+
+class _SpoolHandler(BaseHTTPRequestHandler):
+    """Writes the request body to disk as it arrives, so the server holds no more than a chunk."""
+    spool = None
+
+    def do_POST(self):
+        remaining = int(self.headers["Content-Length"])
+        with open(self.spool, "wb") as f:
+            while remaining:
+                data = self.rfile.read(min(remaining, 64 * 1024))
+                f.write(data)
+                remaining -= len(data)
+        body = json.dumps({"id": "file_1", "object": "file", "purpose": "assistants"}).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def test_read_without_size_returns_the_rest_of_the_file(tmp_path):
+    content = bytes(range(256)) * 11_000
+    path = tmp_path / "data.bin"
+    path.write_bytes(content)
+    reader = ChunkedFileReader(str(path), chunk_size=1024)
+    assert reader.read(10) == content[:10]
+    assert reader.read() == content[10:]
+    assert reader.position == len(content)
+    assert reader.hexdigest() == hashlib.sha256(content).hexdigest()
+    reader.close()
+
+
+class _LocalAgentsClient:
+    """send_request like the sync AgentsClient's, through an azure-core pipeline on requests."""
+
+    def __init__(self, endpoint):
+        self._client = PipelineClient(endpoint)
+
+    def send_request(self, request):
+        request.url = self._client.format_url(request.url)
+        return self._client.send_request(request)
+
+
+def test_sync_upload_streams_the_file_with_bounded_memory(tmp_path):
+    content = hashlib.sha256(b"seed").digest() * 800_000  # ~25 MB
+    path = tmp_path / "big.parquet"
+    path.write_bytes(content)
+    _SpoolHandler.spool = str(tmp_path / "received")
+    server = HTTPServer(("127.0.0.1", 0), _SpoolHandler)
+    threading.Thread(target=server.handle_request, daemon=True).start()
+    client = _LocalAgentsClient(f"http://127.0.0.1:{server.server_port}")
+
+    tracemalloc.start()
+    try:
+        uploaded_file, digest = upload_streaming_sync(
+            lambda reader: upload_agent_file(client, reader),
+            str(path),
+            chunk_size=256 * 1024,
+        )
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+        server.server_close()
+
+    assert peak < len(content) / 5
+    assert uploaded_file.id == "file_1"
+    assert digest == hashlib.sha256(content).hexdigest()
+    received = (tmp_path / "received").read_bytes()
+    assert b'name="purpose"\r\n\r\nassistants\r\n' in received
+    assert b'filename="big.parquet"' in received
+    assert content in received
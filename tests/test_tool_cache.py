@@ -0,0 +1,104 @@
+import asyncio
+
+import pytest
+
+from tool_cache import ToolResultCache
+
+
+def test_entries_expire_after_their_tool_ttl(monkeypatch):
+    clock = [100.0]
+    monkeypatch.setattr("tool_cache.time.monotonic", lambda: clock[0])
+    cache = ToolResultCache(ttls={"list_issues": 300, "get_file_contents": 1800})
+    issues = cache.key("github", "Github-list_issues", {"repo": "a"})
+    readme = cache.key("github", "get_file_contents", {"path": "README.md"})
+    cache.put(issues, "Github-list_issues", "issues")
+    cache.put(readme, "get_file_contents", "readme")
+
+    clock[0] += 301
+    assert cache.get(issues) is None
+    assert cache.get(readme) == "readme"
+    assert cache.bytes == len("readme")
+
+
+def test_least_recently_used_entries_go_first():
+    cache = ToolResultCache(ttls={"get_issue": 300}, max_entries=2, max_bytes=10)
+    first, second, third = (cache.key("github", "get_issue", {"number": n}) for n in range(3))
+    cache.put(first, "get_issue", "aaa")
+    cache.put(second, "get_issue", "bbb")
+    cache.get(first)
+    cache.put(third, "get_issue", "ccc")
+    assert cache.get(second) is None
+    assert cache.get(first) == "aaa" and cache.get(third) == "ccc"
+
+    # The byte budget is enforced too, and a value over it is never stored
+    cache.put(second, "get_issue", "dddddddd")
+    assert cache.stats()["entries"] == 1 and cache.bytes == 8
+    assert cache.evictions == 3
+    cache.put(first, "get_issue", "x" * 11)
+    assert cache.get(first) is None and cache.bytes == 8
+
+
+def test_arguments_are_keyed_canonically():
+    cache = ToolResultCache()
+    assert cache.key("GitHub", "Github-search_code", {"q": "x", "page": None}) == cache.key("github", "search_code", {"q": "x"})
+    assert cache.key("github", "search_code", {"q": "x"}) != cache.key("github", "search_code", {"q": "y"})
+
+
+def test_only_allow_listed_tools_are_cached():
+    cache = ToolResultCache(ttls={"get_issue": 300})
+    calls = []
+
+    async def create_issue():
+        calls.append("create_issue")
+        return "created"
+
+    async def scenario():
+        for _ in range(2):
+            await cache.get_or_call("github", "Github-create_issue", {"title": "bug"}, create_issue)
+
+    asyncio.run(scenario())
+    assert calls == ["create_issue", "create_issue"]
+    assert cache.stats()["tools"]["create_issue"]["bypassed"] == 2
+    assert cache.stats()["entries"] == 0
+
+
+def test_concurrent_identical_calls_share_one_request():
+    cache = ToolResultCache(ttls={"search_repositories": 1800})
+    calls = []
+
+    async def search():
+        calls.append("search")
+        await asyncio.sleep(0.01)
+        return "repos"
+
+    async def scenario():
+        results = await asyncio.gather(*[
+            cache.get_or_call("github", "search_repositories", {"query": "chainlit"}, search) for _ in range(5)
+        ])
+        # Served from the cache afterwards
+        results.append(await cache.get_or_call("github", "search_repositories", {"query": "chainlit"}, search))
+        return results
+
+    assert asyncio.run(scenario()) == ["repos"] * 6
+    assert calls == ["search"]
+    assert cache.stats()["tools"]["search_repositories"] == {"hits": 5, "misses": 1, "bypassed": 0, "hit_rate": 0.833}
+
+
+def test_failed_calls_are_shared_but_not_cached():
+    cache = ToolResultCache(ttls={"get_issue": 300})
+    calls = []
+
+    async def failing():
+        calls.append("get_issue")
+        await asyncio.sleep(0.01)
+        raise ConnectionError("server gone")
+
+    async def scenario():
+        return await asyncio.gather(*[cache.get_or_call("github", "get_issue", {"number": 1}, failing) for _ in range(3)], return_exceptions=True)
+
+    errors = asyncio.run(scenario())
+    assert all(isinstance(error, ConnectionError) for error in errors)
+    assert calls == ["get_issue"]
+    with pytest.raises(ConnectionError):
+        asyncio.run(cache.get_or_call("github", "get_issue", {"number": 1}, failing))
+    assert calls == ["get_issue", "get_issue"]
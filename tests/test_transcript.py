@@ -0,0 +1,47 @@
+import asyncio
+from types import SimpleNamespace
+
+from semantic_kernel.contents import ChatHistory, ChatMessageContent, FileReferenceContent, TextContent
+
+from session_memory import _message_size
+from transcript import TranscriptChannel, TranscriptThread, cap_transcript
+
+
+def _history(turns):
+    history = ChatHistory()
+    history.add_system_message("You are a sales assistant.")
+    for turn in range(turns):
+        history.add_user_message(f"question {turn} " + "x" * 200)
+        history.add_assistant_message(f"answer {turn} " + "y" * 200)
+    return history
+
+
+def _size(history):
+    return sum(_message_size(message) for message in history.messages)
+
+
+def test_channel_references_the_messages_it_receives():
+    history = ChatHistory()
+    channel = TranscriptChannel(messages=[], thread=TranscriptThread(chat_history=history), thread_history=history)
+    text = ChatMessageContent(role="assistant", content="hello")
+    mixed = ChatMessageContent(role="assistant", items=[TextContent(text="calling"), FileReferenceContent(file_id="file_1")])
+
+    asyncio.run(channel.receive([text, mixed]))
+    assert channel.messages[0] is text
+    assert channel.messages[1] is not mixed
+    assert [type(item) for item in channel.messages[1].items] == [TextContent]
+
+
+def test_cap_transcript_trims_history_channels_and_threads():
+    history = _history(20)
+    thread_history = _history(20)
+    channel = TranscriptChannel(messages=list(_history(20).messages), thread=TranscriptThread(chat_history=thread_history), thread_history=thread_history)
+    group_chat = SimpleNamespace(history=history, agent_channels={"agent": channel})
+    max_bytes = _size(history) // 4
+
+    assert cap_transcript(group_chat, max_bytes=max_bytes) > 0
+    for trimmed in (history, channel, thread_history):
+        assert _size(trimmed) <= max_bytes
+        assert trimmed.messages[0].role == "system"
+        assert trimmed.messages[1].role == "user"
+    assert cap_transcript(group_chat, max_bytes=max_bytes) == 0
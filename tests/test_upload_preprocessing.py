@@ -0,0 +1,63 @@
+import os
+
+import pandas as pd
+
+from upload_preprocessing import preprocess_table, remove_preprocessed
+
+
+def _read(result):
+    return pd.read_parquet(result.parquet_path)
+
+
+def test_identifiers_keep_leading_zeros(tmp_path):
+    path = tmp_path / "zips.csv"
+    path.write_text("zip,count\n01234,1\n02345,2\n99999,3\n")
+    [result] = preprocess_table(str(path), output_dir=str(tmp_path))
+    frame = _read(result)
+    assert list(frame["zip"]) == ["01234", "02345", "99999"]
+    assert list(frame["count"]) == [1, 2, 3]
+
+
+def test_value_in_a_later_chunk_turns_the_column_into_strings(tmp_path):
+    path = tmp_path / "values.csv"
+    path.write_text("val,price\n1,1\n2,2.5\nx,3\n")
+    [result] = preprocess_table(str(path), output_dir=str(tmp_path), chunk_rows=2)
+    frame = _read(result)
+    assert list(frame["val"]) == ["1", "2", "x"]
+    assert list(frame["price"]) == [1.0, 2.5, 3.0]
+    types = {column["name"]: column["type"] for column in result.summary["columns"]}
+    assert types == {"val": "string", "price": "number"}
+
+
+def test_column_empty_in_the_first_chunk_takes_the_type_of_later_values(tmp_path):
+    path = tmp_path / "sparse.csv"
+    path.write_text("a,b\n1,\n2,\n3,7\n")
+    [result] = preprocess_table(str(path), output_dir=str(tmp_path), chunk_rows=2)
+    assert _read(result)["b"].tolist()[2] == 7
+
+
+def test_temporary_output_is_removed(tmp_path):
+    path = tmp_path / "small.csv"
+    path.write_text("a\n1\n")
+    results = preprocess_table(str(path))
+    temp_dir = results[0].temp_dir
+    assert os.path.exists(results[0].parquet_path)
+    remove_preprocessed(results)
+    assert not os.path.exists(temp_dir)
+
+
+def test_output_dir_given_by_the_caller_is_kept(tmp_path):
+    path = tmp_path / "small.csv"
+    path.write_text("a\n1\n")
+    results = preprocess_table(str(path), output_dir=str(tmp_path))
+    remove_preprocessed(results)
+    assert os.path.exists(results[0].parquet_path)
+
+
+def test_dates_with_leading_zeros_are_still_dates(tmp_path):
+    path = tmp_path / "dates.csv"
+    path.write_text("day,sku\n01/15/2024,001\n02/01/2024,002\n")
+    [result] = preprocess_table(str(path), output_dir=str(tmp_path))
+    types = {column["name"]: column["type"] for column in result.summary["columns"]}
+    assert types == {"day": "datetime", "sku": "string"}
+    assert _read(result)["sku"].tolist() == ["001", "002"]
@@ -0,0 +1,137 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
+
+from azure.ai.agents.models import VectorStoreFileBatchStatus, VectorStoreStatus
+
+from vector_store_manager import VectorStoreManager
+
+
+async def _iterate(items):
+    for item in items:
+        yield item
+
+
+class FakeAgents:
+    def __init__(self):
+        self.stores = {}
+        self.store_files = {}
+        self.uploaded = {}
+        self.thread_stores = {}
+        self.vector_stores = SimpleNamespace(create=self._create_store, get=self._get_store, list=lambda: _iterate(list(self.stores.values())), delete=self._delete_store)
+        self.vector_store_files = SimpleNamespace(list=lambda vector_store_id, **kwargs: _iterate(list(self.store_files[vector_store_id])))
+        self.vector_store_file_batches = SimpleNamespace(create=self._create_batch)
+        self.files = SimpleNamespace(upload=self._upload, get=self._get_file, delete=self._delete_file)
+        self.threads = SimpleNamespace(get=self._get_thread, update=self._update_thread)
+
+    async def _create_store(self, name, expires_after, metadata):
+        store = SimpleNamespace(id=f"vs_{len(self.stores)}", name=name, status=VectorStoreStatus.COMPLETED,
+                                last_active_at=datetime.now(timezone.utc), created_at=None)
+        self.stores[store.id] = store
+        self.store_files[store.id] = []
+        return store
+
+    async def _get_store(self, vector_store_id):
+        return self.stores[vector_store_id]
+
+    async def _delete_store(self, vector_store_id):
+        del self.stores[vector_store_id]
+
+    async def _create_batch(self, vector_store_id, file_ids):
+        self.store_files[vector_store_id] += [SimpleNamespace(id=file_id) for file_id in file_ids]
+        return SimpleNamespace(id="batch", status=VectorStoreFileBatchStatus.COMPLETED)
+
+    async def _upload(self, file, purpose, filename):
+        file.read()
+        file_id = f"file_{len(self.uploaded)}"
+        self.uploaded[file_id] = filename
+        return SimpleNamespace(id=file_id)
+
+    async def _get_file(self, file_id):
+        return SimpleNamespace(id=file_id, filename=self.uploaded[file_id])
+
+    async def _delete_file(self, file_id):
+        del self.uploaded[file_id]
+
+    async def _get_thread(self, thread_id):
+        store_ids = self.thread_stores.get(thread_id)
+        file_search = SimpleNamespace(vector_store_ids=store_ids) if store_ids else None
+        return SimpleNamespace(id=thread_id, tool_resources=SimpleNamespace(file_search=file_search))
+
+    async def _update_thread(self, thread_id, tool_resources):
+        self.thread_stores[thread_id] = tool_resources.file_search.vector_store_ids
+
+
+def test_stores_are_scoped_per_thread(tmp_path):
+    document = tmp_path / "notes.md"
+    document.write_text("# Notes")
+    agents = FakeAgents()
+
+    async def scenario():
+        manager = VectorStoreManager(agents)
+        await manager.add_files("thread_a", [str(document)])
+        await manager.attach("thread_a")
+        await manager.add_files("thread_b", [str(document)])
+        await manager.attach("thread_b")
+        # After a restart the thread's store is found again and the document isn't re-uploaded
+        restarted = VectorStoreManager(agents)
+        await restarted.add_files("thread_a", [str(document)])
+
+    asyncio.run(scenario())
+    assert agents.thread_stores["thread_a"] != agents.thread_stores["thread_b"]
+    assert len(agents.stores) == 2
+    # Both stores index the one uploaded file
+    assert len(agents.uploaded) == 1
+    assert [file.id for file in agents.store_files["vs_0"]] == [file.id for file in agents.store_files["vs_1"]] == ["file_0"]
+
+
+def test_expire_unused_deletes_the_uploaded_files(tmp_path):
+    document = tmp_path / "notes.md"
+    document.write_text("# Notes")
+    agents = FakeAgents()
+
+    async def scenario():
+        manager = VectorStoreManager(agents)
+        await manager.add_files("thread_a", [str(document)])
+        for store in agents.stores.values():
+            store.last_active_at = datetime.now(timezone.utc) - timedelta(days=30)
+        return await manager.expire_unused(max_idle_days=7)
+
+    deleted = asyncio.run(scenario())
+    assert len(deleted) == 1
+    assert agents.stores == {}
+    assert agents.uploaded == {}
+
+
+def test_files_shared_with_an_active_store_are_kept(tmp_path):
+    document = tmp_path / "notes.md"
+    document.write_text("# Notes")
+    agents = FakeAgents()
+
+    async def scenario():
+        manager = VectorStoreManager(agents)
+        await manager.add_files("thread_a", [str(document)])
+        await manager.add_files("thread_b", [str(document)])
+        agents.stores["vs_0"].last_active_at = datetime.now(timezone.utc) - timedelta(days=30)
+        return await manager.expire_unused(max_idle_days=7)
+
+    assert asyncio.run(scenario()) == ["vs_0"]
+    assert list(agents.stores) == ["vs_1"]
+    assert list(agents.uploaded) == ["file_0"]
+
+
+def test_cached_stores_are_bounded(tmp_path):
+    document = tmp_path / "notes.md"
+    document.write_text("# Notes")
+    agents = FakeAgents()
+    manager = VectorStoreManager(agents, cache_size=2)
+
+    async def scenario():
+        for thread in range(5):
+            await manager.add_files(f"thread_{thread}", [str(document)])
+
+    asyncio.run(scenario())
+    assert list(manager._stores) == ["thread_3", "thread_4"]
+    assert set(manager._files) == {"vs_3", "vs_4"}
+    assert set(manager._locks) <= {"thread_3", "thread_4"}
+    assert len(agents.uploaded) == 1